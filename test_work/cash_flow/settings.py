@@ -16,10 +16,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'transactions',
 ]
 
 MIDDLEWARE = [
+    # Замеры запросов; без TRANSACTIONS_INSTRUMENTATION отключается при старте
+    'transactions.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -27,6 +30,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Версия справочников читается из БД один раз за запрос
+    'transactions.dictionary_cache.dictionary_tree_middleware',
 ]
 
 ROOT_URLCONF = 'cash_flow.urls'
@@ -54,6 +59,48 @@ DATABASES = {
     }
 }
 
+# Профиль SQLite для продакшена (SQLITE_PRODUCTION=1): WAL и прагмы каждого
+# соединения (transactions/database.py), постоянные соединения, запись сразу
+# с блокировкой (BEGIN IMMEDIATE ждёт busy_timeout, а не падает с "database is
+# locked") и отдельное соединение только для чтения
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') == '1'
+SQLITE_PRAGMAS = {}
+DATABASE_READ_ALIAS = 'read'
+
+if SQLITE_PRODUCTION:
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # КиБ
+        'busy_timeout': 5000,  # мс
+        'temp_store': 'MEMORY',
+    }
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    })
+    DATABASES[DATABASE_READ_ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATABASES['default']['NAME'],
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['transactions.database.ReadWriteRouter']
+
+# Кэш справочников, версий данных и страниц списка операций. Локальный кэш
+# подходит для одного процесса; для нескольких процессов нужен общий, например
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache CACHE_LOCATION=/var/tmp/cash_flow
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'cash_flow'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    }
+}
+
 LANGUAGE_CODE = 'ru-ru'
 TIME_ZONE = 'Europe/Moscow'
 USE_I18N = True
@@ -62,4 +109,43 @@ USE_TZ = True
 STATIC_URL = '/static/'
 # STATICFILES_DIRS = [BASE_DIR / 'static']
 
+# Файлы результатов фоновых задач (выгрузки); отдаются представлением job_result
+MEDIA_ROOT = BASE_DIR / 'media'
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Асинхронные варианты читающих представлений (список, выгрузка, отчёт, AJAX);
+# имеет смысл только при запуске через ASGI (cash_flow/asgi.py)
+TRANSACTIONS_ASYNC_VIEWS = os.environ.get('TRANSACTIONS_ASYNC_VIEWS') == '1'
+
+# Ограничение подсчёта строк в списке операций (None - точный COUNT, 0 - не считать)
+TRANSACTION_LIST_COUNT_LIMIT = 1000
+
+# Сколько секунд хранить отрисованные страницы списка операций (0 - не кэшировать)
+TRANSACTION_LIST_CACHE_TIMEOUT = 300
+
+# Замеры запросов: Server-Timing, гистограммы /transactions/metrics/, лог медленных и N+1
+TRANSACTIONS_INSTRUMENTATION = os.environ.get('TRANSACTIONS_INSTRUMENTATION') == '1'
+INSTRUMENTATION_SLOW_REQUEST_MS = 500
+# Сколько одинаковых SQL за запрос считать признаком N+1
+INSTRUMENTATION_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Фоновые задачи (run_worker): пауза перед первым повтором после ошибки и
+# через сколько секунд без отметки обработчика задача возвращается в очередь
+TRANSACTIONS_JOB_RETRY_DELAY = 30
+TRANSACTIONS_JOB_STALE_AFTER = 600
+# Сколько секунд хранить завершённые задачи и файлы их результатов (удаляет run_worker)
+TRANSACTIONS_JOB_KEEP_FINISHED = 7 * 24 * 3600
+
+# REST API только для вошедших пользователей: сессия (запись с CSRF-токеном) или HTTP Basic
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+}
+
+# Лента изменений /api/transactions/changes/: изменения моложе стольких секунд
+# ещё не отдаются (могут быть не зафиксированы)
+TRANSACTIONS_CHANGE_FEED_LAG = 2
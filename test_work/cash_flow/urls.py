@@ -23,4 +23,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', lambda request: redirect('transaction_list')),
     path('transactions/', include('transactions.urls')),
+    path('api/', include('transactions.api_urls')),
 ]
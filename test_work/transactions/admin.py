@@ -1,5 +1,102 @@
-from django.contrib import admin
-from .models import Status, TransactionType, Category, Subcategory, Transaction
+from datetime import date
+
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.paginator import Paginator
+from django.db.models import QuerySet, Sum
+from django.utils.functional import cached_property
+
+from .archive import archive_boundary
+from .dictionary_cache import DictionaryTree, get_tree
+from .models import Status, TransactionType, Category, Subcategory, Transaction, DailyRollup, Job
+from .search import search_queryset
+
+# На сколько строк дальше текущей страницы считает постраничник админки для отфильтрованного списка
+ADMIN_COUNT_LIMIT = 10000
+
+
+class DictionaryFieldListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по справочнику с вариантами из кэша, без запроса и __str__ на каждый вариант"""
+
+    def field_choices(self, field, request, model_admin):
+        tree = get_tree()
+        return [(node.id, DictionaryTree.label(node)) for node in tree.ordered(field.related_model)]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Постраничник без полного COUNT(*): общее число операций берётся из дневных
+    сводок, а отфильтрованный список считается не дальше ADMIN_COUNT_LIMIT строк
+    после текущей страницы (page_number). Если строк больше, capped = True:
+    число не точное, а следующие страницы досчитываются при переходе на них.
+    """
+
+    def __init__(self, *args, page_number=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            self.page_number = max(int(page_number), 1)
+        except (TypeError, ValueError):
+            self.page_number = 1
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            return self._total()
+        limit = self.page_number * self.per_page + ADMIN_COUNT_LIMIT
+        count = self.object_list.order_by().values('pk')[:limit + 1].count()
+        self.capped = count > limit
+        return min(count, limit)
+
+    @staticmethod
+    def _total():
+        rollups = DailyRollup.objects.all()
+        before_archive = 0
+        boundary = archive_boundary()
+        if boundary is not None:
+            # Сводки дней до границы архива считают и архивные операции; рабочих строк
+            # этих дней (внесённых задним числом после переноса) мало, они считаются по индексу даты
+            rollups = rollups.filter(date__gte=boundary)
+            before_archive = Transaction.objects.filter(date__lt=boundary).count()
+        return (rollups.aggregate(total=Sum('count'))['total'] or 0) + before_archive
+
+
+def _period_start(value, kind):
+    if kind == 'year':
+        return date(value.year, 1, 1)
+    if kind == 'month':
+        return date(value.year, value.month, 1)
+    return value
+
+
+def _next_period(value, kind):
+    if kind == 'year':
+        return date(value.year + 1, 1, 1)
+    if kind == 'month':
+        return date(value.year + (value.month == 12), value.month % 12 + 1, 1)
+    return date.fromordinal(value.toordinal() + 1)
+
+
+class SeekDatesQuerySet(QuerySet):
+    """
+    QuerySet, у которого dates() для date_hierarchy находит периоды переходами
+    по индексу (одна выборка LIMIT 1 на период) вместо DISTINCT по всей таблице.
+    """
+
+    def dates(self, field_name, kind, order='ASC'):
+        if kind not in ('year', 'month', 'day'):
+            return super().dates(field_name, kind, order)
+
+        values = self.order_by(field_name).values_list(field_name, flat=True)
+        periods = []
+        value = values.first()
+        while value is not None:
+            start = _period_start(value, kind)
+            periods.append(start)
+            value = values.filter(**{f'{field_name}__gte': _next_period(start, kind)}).first()
+        if order == 'DESC':
+            periods.reverse()
+        return periods
 
 
 @admin.register(Status)
@@ -17,15 +114,29 @@ class TransactionTypeAdmin(admin.ModelAdmin):
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'transaction_type']
-    list_filter = ['transaction_type']
+    list_filter = [('transaction_type', DictionaryFieldListFilter)]
     search_fields = ['name']
+    ordering = ['name']
+    autocomplete_fields = ['transaction_type']
+
+    def get_queryset(self, request):
+        # __str__ категории выводит тип: и в списке, и в автодополнении
+        return super().get_queryset(request).select_related('transaction_type')
 
 
 @admin.register(Subcategory)
 class SubcategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'get_transaction_type']
-    list_filter = ['category__transaction_type', 'category']
+    list_filter = [
+        ('category__transaction_type', DictionaryFieldListFilter),
+        ('category', DictionaryFieldListFilter),
+    ]
     search_fields = ['name']
+    ordering = ['name']
+    autocomplete_fields = ['category']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category__transaction_type')
 
     def get_transaction_type(self, obj):
         return obj.category.transaction_type.name
@@ -36,6 +147,50 @@ class SubcategoryAdmin(admin.ModelAdmin):
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ['date', 'transaction_type', 'category', 'subcategory', 'amount', 'status']
-    list_filter = ['date', 'status', 'transaction_type', 'category']
+    list_filter = [
+        'date',
+        ('status', DictionaryFieldListFilter),
+        ('transaction_type', DictionaryFieldListFilter),
+        ('category', DictionaryFieldListFilter),
+    ]
+    # __str__ категории и подкатегории обращаются к родителю, поэтому подтягиваем и его
+    list_select_related = ['status', 'transaction_type', 'category__transaction_type', 'subcategory__category']
     search_fields = ['comment']
     date_hierarchy = 'date'
+    autocomplete_fields = ['status', 'transaction_type', 'category', 'subcategory']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, page_number=request.GET.get(PAGE_VAR)
+        )
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None and getattr(changelist.paginator, 'capped', False):
+            messages.info(
+                request,
+                f'Найдено больше {changelist.result_count} операций: показаны страницы, которые уже '
+                f'посчитаны, следующие появятся при переходе на последнюю.',
+            )
+        return response
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return SeekDatesQuerySet(model=queryset.model, query=queryset.query, using=queryset._db)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по полнотекстовому индексу комментариев вместо LIKE '%...%' по всей таблице
+        return search_queryset(queryset, search_term), False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'total', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = [
+        'kind', 'params', 'status', 'progress', 'total', 'attempts', 'worker',
+        'heartbeat_at', 'error', 'result', 'created_at', 'started_at', 'finished_at',
+    ]
@@ -0,0 +1,249 @@
+"""
+Аналитика по операциям на массивах NumPy.
+
+Из таблицы читаются только нужные столбцы (дата, id справочников, сумма) в
+int-массивы, группировки и периоды считаются векторно, без создания моделей
+и без цикла Python по строкам. NumPy - необязательная зависимость.
+"""
+import threading
+from datetime import date
+from decimal import Decimal
+
+from .archive import source_model
+from .dictionary_cache import get_tree
+from .list_cache import data_version
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DIMENSIONS = ('status', 'transaction_type', 'category', 'subcategory')
+BUCKETS = ('day', 'week', 'month')
+LOAD_CHUNK_SIZE = 100000
+# Размер пространства ключей группировки, до которого группы считаются без сортировки
+DENSE_GROUP_LIMIT = 1 << 24
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class AnalyticsError(RuntimeError):
+    """Аналитика недоступна или вызвана с некорректными параметрами"""
+
+
+def _require_numpy():
+    if np is None:
+        raise AnalyticsError('Для аналитики установите NumPy: pip install -r requirements-analytics.txt')
+
+
+def _kopecks(amount):
+    return int(amount * 100)
+
+
+def _rubles(kopecks):
+    return Decimal(int(kopecks)).scaleb(-2)
+
+
+def _bucket_date(kind, key):
+    if kind == 'month':
+        return date(1970 + int(key) // 12, int(key) % 12 + 1, 1)
+    if kind == 'week':
+        return date.fromordinal(int(key) * 7 + 1)
+    return date.fromordinal(int(key))
+
+
+class TransactionFrame:
+    """
+    Столбцы операций: date (порядковый номер дня), id справочников и amount
+    в копейках (int64), по одному массиву на столбец.
+    """
+
+    def __init__(self, date, status, transaction_type, category, subcategory, amount, version=None):
+        self.date = date
+        self.status = status
+        self.transaction_type = transaction_type
+        self.category = category
+        self.subcategory = subcategory
+        self.amount = amount
+        self.version = version
+
+    def __len__(self):
+        return len(self.amount)
+
+    @classmethod
+    def load(cls, queryset=None, chunk_size=LOAD_CHUNK_SIZE, version=None):
+        """Читает столбцы queryset (по умолчанию все операции, вместе с архивом) пачками через values_list"""
+        _require_numpy()
+        if queryset is None:
+            queryset = source_model().objects.all()
+        rows = queryset.order_by().values_list(
+            'date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id', 'amount'
+        )
+
+        chunks = []
+        batch = []
+        for row in rows.iterator(chunk_size=chunk_size):
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                chunks.append(cls._columns(batch))
+                batch = []
+        if batch or not chunks:
+            chunks.append(cls._columns(batch))
+
+        columns = [np.concatenate(parts) for parts in zip(*chunks)]
+        return cls(*columns, version=version)
+
+    @staticmethod
+    def _columns(batch):
+        size = len(batch)
+        dates, statuses, types, categories, subcategories, amounts = zip(*batch) if batch else ([],) * 6
+        return (
+            np.fromiter(map(date.toordinal, dates), dtype=np.int32, count=size),
+            np.array(statuses, dtype=np.int64),
+            np.array(types, dtype=np.int64),
+            np.array(categories, dtype=np.int64),
+            np.array(subcategories, dtype=np.int64),
+            np.fromiter(map(_kopecks, amounts), dtype=np.int64, count=size),
+        )
+
+    def select(self, date_from=None, date_to=None, **ids):
+        """Подмножество строк: диапазон дат и равенство по справочникам (status=1, category=3, ...)"""
+        mask = np.ones(len(self), dtype=bool)
+        if date_from is not None:
+            mask &= self.date >= date_from.toordinal()
+        if date_to is not None:
+            mask &= self.date <= date_to.toordinal()
+        for name, value in ids.items():
+            if name not in DIMENSIONS:
+                raise AnalyticsError(f'Неизвестное измерение "{name}"')
+            if value is not None:
+                mask &= getattr(self, name) == value
+        return TransactionFrame(
+            self.date[mask], self.status[mask], self.transaction_type[mask], self.category[mask],
+            self.subcategory[mask], self.amount[mask], version=self.version,
+        )
+
+    def buckets(self, kind):
+        """Ключ периода для каждой строки: номер дня, номер недели или номер месяца с 1970 года"""
+        if kind == 'day':
+            return self.date.astype(np.int64)
+        if kind == 'week':
+            # date.fromordinal(1) - понедельник, поэтому номер недели - (ordinal - 1) // 7
+            return (self.date.astype(np.int64) - 1) // 7
+        if kind == 'month':
+            days = (self.date.astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+            return days.astype('datetime64[M]').astype(np.int64)
+        raise AnalyticsError(f'Неизвестный период "{kind}", допустимо: {", ".join(BUCKETS)}')
+
+    def group_by(self, dimensions=(), bucket=None):
+        """
+        Суммы и количество по произвольному набору измерений и периоду.
+
+        Возвращает список словарей {'period': date, <измерение>: id, 'total': Decimal,
+        'count': int}, отсортированный по ключу группы.
+        """
+        for name in dimensions:
+            if name not in DIMENSIONS:
+                raise AnalyticsError(f'Неизвестное измерение "{name}"')
+        names = (['period'] if bucket else []) + list(dimensions)
+        columns = ([self.buckets(bucket)] if bucket else []) + [getattr(self, name) for name in dimensions]
+        if not len(self):
+            return []
+        if not columns:
+            return [{'total': _rubles(self.amount.sum()), 'count': len(self)}]
+
+        # Каждый столбец кодируется смещением от минимума, комбинация - одним int64
+        code = np.zeros(len(self), dtype=np.int64)
+        bounds = []
+        space = 1
+        for column in columns:
+            low = int(column.min())
+            size = int(column.max()) - low + 1
+            code = code * size + (column - low)
+            bounds.append((low, size))
+            space *= size
+
+        if space <= DENSE_GROUP_LIMIT:
+            # Плотное пространство ключей: счёт без сортировки, одним проходом bincount
+            counts = np.bincount(code, minlength=space)
+            groups = np.flatnonzero(counts)
+            counts = counts[groups]
+            totals = self._sums(code, space)[groups]
+            keys = []
+            remainder = groups
+            for low, size in reversed(bounds):
+                keys.append(remainder % size + low)
+                remainder = remainder // size
+            keys.reverse()
+        else:
+            groups, first, inverse = np.unique(code, return_index=True, return_inverse=True)
+            counts = np.bincount(inverse)
+            totals = self._sums(inverse, len(groups))
+            keys = [column[first] for column in columns]
+
+        result = []
+        for index in range(len(counts)):
+            row = {}
+            for name, key in zip(names, keys):
+                row[name] = _bucket_date(bucket, key[index]) if name == 'period' else int(key[index])
+            row['total'] = _rubles(totals[index])
+            row['count'] = int(counts[index])
+            result.append(row)
+        return result
+
+    def _sums(self, groups, size):
+        """
+        Точные суммы копеек по группам через bincount. Веса bincount - float64,
+        поэтому сумма делится на старшие и младшие 24 бита: каждая часть
+        складывается без потери точности.
+        """
+        high, low = np.divmod(self.amount, 1 << 24)
+        high_sums = np.bincount(groups, weights=high, minlength=size).astype(np.int64)
+        low_sums = np.bincount(groups, weights=low, minlength=size).astype(np.int64)
+        return high_sums * (1 << 24) + low_sums
+
+    def top(self, dimension='category', limit=10):
+        """limit значений измерения с наибольшей суммой"""
+        rows = self.group_by([dimension])
+        rows.sort(key=lambda row: (-row['total'], row[dimension]))
+        return rows[:limit]
+
+    def income_expense(self, bucket='month', income='Пополнение', expense='Списание'):
+        """Поступления, списания и сальдо по периодам; типы операций задаются названиями"""
+        tree = get_tree()
+        type_ids = {node.name: node.id for node in tree.transaction_types}
+        income_id, expense_id = type_ids.get(income), type_ids.get(expense)
+
+        periods = {}
+        for row in self.group_by(['transaction_type'], bucket=bucket):
+            period = periods.setdefault(row['period'], {
+                'period': row['period'], 'income': Decimal('0.00'), 'expense': Decimal('0.00'),
+            })
+            if row['transaction_type'] == income_id:
+                period['income'] += row['total']
+            elif row['transaction_type'] == expense_id:
+                period['expense'] += row['total']
+        for period in periods.values():
+            period['net'] = period['income'] - period['expense']
+        return sorted(periods.values(), key=lambda row: row['period'])
+
+
+_lock = threading.Lock()
+_frame = None
+
+
+def get_frame():
+    """
+    Снимок всех операций в памяти процесса; перечитывается, только если
+    изменилась версия данных (list_cache.data_version - одна выборка по
+    первичному ключу, её меняет любая запись операций и архива из любого процесса)
+    """
+    global _frame
+    _require_numpy()
+    version = data_version()
+    frame = _frame
+    if frame is None or frame.version != version:
+        with _lock:
+            frame = _frame
+            if frame is None or frame.version != version:
+                frame = _frame = TransactionFrame.load(version=version)
+    return frame
@@ -0,0 +1,142 @@
+from django.http import StreamingHttpResponse
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from . import changes
+from .forms import TransactionFilterForm
+from .models import Transaction, Status, TransactionType, Category, Subcategory
+from .pagination import KeysetPaginator
+from .serializers import (
+    BULK_MAX_ITEMS, TransactionSerializer, TransactionBulkSerializer, StatusSerializer,
+    TransactionTypeSerializer, CategorySerializer, SubcategorySerializer, requested_fields,
+)
+
+# Поля, которые нужны курсору и поэтому загружаются всегда
+CURSOR_FIELDS = ('id', 'date', 'created_at')
+
+
+class TransactionCursorPagination(BasePagination):
+    """Курсорная пагинация API поверх KeysetPaginator списка операций (без COUNT)"""
+
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, per_page=self.get_page_size(request), count_limit=0)
+        self.page = paginator.get_page(request.query_params.get(self.cursor_query_param))
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+
+class TransactionViewSet(viewsets.ModelViewSet):
+    """
+    Операции: фильтры как у списка (date_from, date_to, status, transaction_type,
+    category, subcategory), ?fields= для выбора полей и пакетная запись в bulk/.
+    """
+
+    serializer_class = TransactionSerializer
+    pagination_class = TransactionCursorPagination
+
+    def get_queryset(self):
+        queryset = Transaction.objects.all()
+        if self.action != 'list':
+            return queryset
+
+        filter_form = TransactionFilterForm(self.request.query_params)
+        if not filter_form.is_valid():
+            raise ValidationError(filter_form.errors)
+        queryset = filter_form.filter_queryset(queryset)
+
+        # Загружаем только запрошенные столбцы (например, без длинных комментариев)
+        fields = requested_fields(self.request, self.get_serializer_class())
+        if fields is not None:
+            queryset = queryset.only(*set(CURSOR_FIELDS).union(fields))
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Создание (элементы без id) и обновление (элементы с id) пакета операций"""
+        serializer = TransactionBulkSerializer(
+            data=request.data, many=True, max_length=BULK_MAX_ITEMS, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Лента изменений после ?cursor= (без курсора - с начала): NDJSON со
+        строками upsert/delete и последней строкой с курсором следующего запроса.
+        Не больше ?limit= изменений (до CHANGE_FEED_MAX_LIMIT) за ответ.
+        """
+        cursor = request.query_params.get('cursor') or None
+        after = None
+        if cursor is not None:
+            after = changes.decode_cursor(cursor)
+            if after is None:
+                raise ValidationError({'cursor': 'Некорректный курсор'})
+        try:
+            limit = int(request.query_params.get('limit', changes.CHANGE_FEED_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число'})
+        limit = max(1, min(limit, changes.CHANGE_FEED_MAX_LIMIT))
+
+        keys, has_more = changes.change_keys(after, limit)
+        cursor = changes.next_cursor(keys, cursor)
+        response = StreamingHttpResponse(
+            changes.change_stream(keys, cursor, has_more), content_type='application/x-ndjson; charset=utf-8'
+        )
+        # Ключи страницы выбраны до выдачи тела, поэтому курсор отдаётся и в заголовке
+        response['X-Next-Cursor'] = cursor or ''
+        response['X-Has-More'] = 'true' if has_more else 'false'
+        return response
+
+
+class StatusViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Status.objects.order_by('id')
+    serializer_class = StatusSerializer
+    pagination_class = None
+
+
+class TransactionTypeViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = TransactionType.objects.order_by('id')
+    serializer_class = TransactionTypeSerializer
+    pagination_class = None
+
+
+class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Category.objects.order_by('name', 'id')
+    serializer_class = CategorySerializer
+    pagination_class = None
+
+
+class SubcategoryViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Subcategory.objects.order_by('name', 'id')
+    serializer_class = SubcategorySerializer
+    pagination_class = None
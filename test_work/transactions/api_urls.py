@@ -0,0 +1,11 @@
+from rest_framework.routers import DefaultRouter
+from . import api
+
+router = DefaultRouter()
+router.register('transactions', api.TransactionViewSet, basename='api-transaction')
+router.register('statuses', api.StatusViewSet, basename='api-status')
+router.register('transaction-types', api.TransactionTypeViewSet, basename='api-transaction-type')
+router.register('categories', api.CategoryViewSet, basename='api-category')
+router.register('subcategories', api.SubcategoryViewSet, basename='api-subcategory')
+
+urlpatterns = router.urls
@@ -4,3 +4,6 @@ class TransactionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transactions'
     verbose_name = 'Транзакции'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,71 @@
+"""
+Архив операций закрытых периодов.
+
+archive_transactions переносит операции раньше заданной даты из рабочей
+таблицы в transactions_archivedtransaction пачками, каждая в своей
+транзакции. Рабочая таблица и её индексы остаются размером с открытые
+периоды. Дневные сводки и остатки не меняются: операции не удаляются, а
+только переезжают.
+
+Чтения, которым нужны и архивные операции (список, выгрузка, остатки,
+аналитика), берут модель через source_model: представление
+CombinedTransaction (UNION ALL обеих таблиц), только если фильтр по дате
+доходит до архива, иначе - рабочую таблицу.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+
+from .list_cache import bump_data_version
+from .models import ArchivedTransaction, CombinedTransaction, Transaction
+
+ARCHIVE_BATCH_SIZE = 10000
+COLUMNS = (
+    'id', 'date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id',
+    'amount', 'comment', 'created_at', 'updated_at',
+)
+
+
+def archive_boundary():
+    """Первый день после архива (операции раньше него могут быть в архиве) или None, если архив пуст"""
+    # Обратный проход по индексу trx_archive_date_idx - одна строка
+    last = ArchivedTransaction.objects.order_by('-date').values_list('date', flat=True).first()
+    return last + timedelta(days=1) if last is not None else None
+
+
+def source_model(date_from=None):
+    """Модель для чтения операций начиная с date_from (None - за всё время)"""
+    boundary = archive_boundary()
+    if boundary is None or (date_from is not None and date_from >= boundary):
+        return Transaction
+    return CombinedTransaction
+
+
+def archive_rows(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Переносит операции с датой раньше before в архив, возвращает их число.
+    Перенос идёт SQL-запросами INSERT ... SELECT и DELETE по диапазону id,
+    без сигналов моделей: сводки не пересчитываются, из индекса поиска
+    рабочей таблицы в индекс архива строки переносят триггеры.
+    """
+    hot = connection.ops.quote_name(Transaction._meta.db_table)
+    archive = connection.ops.quote_name(ArchivedTransaction._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(column) for column in COLUMNS)
+    boundary = connection.ops.adapt_datefield_value(before)
+    moved = 0
+    while True:
+        ids = Transaction.objects.filter(date__lt=before).order_by('id').values_list('id', flat=True)
+        last_id = ids[batch_size - 1:batch_size].first() or ids.last()
+        if last_id is None:
+            break
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {archive} ({columns}) SELECT {columns} FROM {hot} WHERE date < %s AND id <= %s',
+                    [boundary, last_id],
+                )
+                cursor.execute(f'DELETE FROM {hot} WHERE date < %s AND id <= %s', [boundary, last_id])
+                moved += cursor.rowcount
+    if moved:
+        bump_data_version()
+    return moved
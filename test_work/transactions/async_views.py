@@ -0,0 +1,105 @@
+"""
+Асинхронные варианты читающих представлений из views.py.
+
+Поведение и шаблоны те же; подключаются вместо синхронных при
+TRANSACTIONS_ASYNC_VIEWS = True (при запуске через cash_flow/asgi.py).
+Справочники берутся из снимка без перехода в поток, запросы к операциям
+и сводкам идут через асинхронный ORM.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import Sum
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.template.loader import render_to_string
+
+from .dictionary_cache import aget_tree, use_tree
+from .export import EXPORT_FORMATS, aexport_stream, agzip_stream, export_values, gzip_requested
+from .forms import TransactionFilterForm, TransactionBulkForm, RollupReportForm
+from .list_cache import acached_table, filters_query, normalized_filters
+from .models import Category, Subcategory, DailyRollup
+from .views import REPORT_PERIODS, _int_param, attach_running_balances, transaction_list_paginator
+
+
+async def transaction_list(request):
+    with use_tree(await aget_tree()):
+        filter_form = TransactionFilterForm(request.GET)
+        cursor = request.GET.get('cursor')
+
+        async def render_table():
+            paginator = await sync_to_async(transaction_list_paginator)(filter_form)
+            page_obj = await paginator.aget_page(cursor)
+            await sync_to_async(attach_running_balances)(page_obj)
+            context = {'page_obj': page_obj, 'filter_query': filters_query(normalized_filters(filter_form))}
+            return render_to_string('transactions/transaction_table.html', context, request)
+
+        context = {
+            'table': await acached_table(filter_form, cursor, render_table),
+            'filter_form': filter_form,
+            'bulk_form': TransactionBulkForm(),
+        }
+        return render(request, 'transactions/transaction_list.html', context)
+
+
+async def transaction_export(request):
+    with use_tree(await aget_tree()):
+        filter_form = TransactionFilterForm(request.GET)
+        # Граница архива читается из базы
+        model = await sync_to_async(filter_form.source_model)()
+        rows = export_values(filter_form.filter_queryset(model.objects.all()))
+
+    export_format = request.GET.get('format')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    filename = f'transactions.{export_format}'
+
+    stream = aexport_stream(rows, export_format)
+    content_type = EXPORT_FORMATS[export_format]
+    if gzip_requested(request.GET):
+        stream = agzip_stream(stream)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def load_categories(request):
+    tree = await aget_tree()
+    category_ids = tree.type_categories.get(_int_param(request, 'transaction_type'), ())
+    categories = [tree.get(Category, pk) for pk in category_ids]
+    return JsonResponse([{'id': node.id, 'name': node.name} for node in categories], safe=False)
+
+
+async def load_subcategories(request):
+    tree = await aget_tree()
+    subcategory_ids = tree.category_subcategories.get(_int_param(request, 'category'), ())
+    subcategories = [tree.get(Subcategory, pk) for pk in subcategory_ids]
+    return JsonResponse([{'id': node.id, 'name': node.name} for node in subcategories], safe=False)
+
+
+async def cash_flow_report(request):
+    with use_tree(await aget_tree()):
+        form = RollupReportForm(request.GET)
+        rollups = form.filter_queryset(DailyRollup.objects.all())
+        period = (form.cleaned_data.get('period') if form.is_valid() else None) or 'month'
+
+        rows = rollups.annotate(
+            period=REPORT_PERIODS[period]('date')
+        ).values(
+            'period', 'transaction_type__name', 'category__name'
+        ).annotate(
+            period_total=Sum('total'), period_count=Sum('count')
+        ).order_by('-period', 'transaction_type__name', 'category__name')
+
+        totals = rollups.values('transaction_type__name').annotate(
+            period_total=Sum('total'), period_count=Sum('count')
+        ).order_by('transaction_type__name')
+
+        context = {
+            'form': form,
+            'period': period,
+            'rows': [row async for row in rows],
+            'totals': [row async for row in totals],
+        }
+        return render(request, 'transactions/report.html', context)
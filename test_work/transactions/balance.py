@@ -0,0 +1,167 @@
+import uuid
+from bisect import bisect_left
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When, Window
+from django.db.models.functions import TruncMonth
+
+from .archive import source_model
+from .dictionary_cache import get_tree
+from .models import CacheVersion, DailyRollup, BalanceCheckpoint
+
+# Знак суммы в остатке для типов операций (по названию); остальные типы не учитываются
+DEFAULT_TYPE_SIGNS = {'Пополнение': 1, 'Списание': -1}
+ZERO = Decimal('0.00')
+# Поколение остатков в CacheVersion: меняется при каждом сбросе остатков
+CHECKPOINTS_VERSION_NAME = 'balance_checkpoints'
+
+
+def type_signs():
+    """Словарь id типа операции -> знак (+1/-1)"""
+    names = getattr(settings, 'BALANCE_TYPE_SIGNS', DEFAULT_TYPE_SIGNS)
+    return {node.id: names[node.name] for node in get_tree().transaction_types if node.name in names}
+
+
+def signed_amount(signs, field='amount', type_field='transaction_type_id'):
+    """Выражение: сумма со знаком типа операции"""
+    plus = [pk for pk, sign in signs.items() if sign > 0]
+    minus = [pk for pk, sign in signs.items() if sign < 0]
+    return Case(
+        When(**{f'{type_field}__in': plus}, then=F(field)),
+        When(**{f'{type_field}__in': minus}, then=-F(field)),
+        default=Value(ZERO),
+        output_field=DecimalField(max_digits=18, decimal_places=2),
+    )
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def checkpoints_generation(lock=False):
+    queryset = CacheVersion.objects.filter(name=CHECKPOINTS_VERSION_NAME)
+    if lock:
+        queryset = queryset.select_for_update()
+    return queryset.values_list('token', flat=True).first() or ''
+
+
+def invalidate_checkpoints(day=None):
+    """
+    Сбрасывает остатки начиная с месяца изменённой (в том числе задним числом)
+    операции, day=None - все, и меняет поколение остатков в той же транзакции
+    """
+    CacheVersion.objects.update_or_create(name=CHECKPOINTS_VERSION_NAME, defaults={'token': uuid.uuid4().hex})
+    checkpoints = BalanceCheckpoint.objects.all()
+    if day is not None:
+        checkpoints = checkpoints.filter(month__gte=month_start(day))
+    checkpoints.delete()
+
+
+def ensure_checkpoints(before):
+    """
+    Достраивает остатки для всех месяцев с операциями раньше месяца before и
+    возвращает их списком (месяц, остаток) по возрастанию месяца.
+    Считается по дневным сводкам только после последнего сохранённого остатка.
+    """
+    generation = checkpoints_generation()
+    existing = list(
+        BalanceCheckpoint.objects.filter(month__lt=before).order_by('month').values_list('month', 'balance')
+    )
+    rollups = DailyRollup.objects.filter(date__lt=before)
+    balance = ZERO
+    if existing:
+        last_month, balance = existing[-1]
+        rollups = rollups.filter(date__gte=next_month(last_month))
+
+    monthly = rollups.annotate(
+        month=TruncMonth('date')
+    ).values('month').annotate(
+        month_total=Sum(signed_amount(type_signs(), field='total'))
+    ).order_by('month')
+
+    checkpoints = []
+    for row in monthly:
+        balance += row['month_total']
+        checkpoints.append(BalanceCheckpoint(month=row['month'], balance=balance))
+    if checkpoints:
+        # Вставка сначала берёт блокировку записи, затем поколение перечитывается: если
+        # после чтения сводок остатки сбрасывали (операция задним числом), посчитанное
+        # могло устареть и не сохраняется. При том же поколении параллельный запрос
+        # достраивает те же значения, поэтому конфликты пропускаются.
+        with transaction.atomic():
+            BalanceCheckpoint.objects.bulk_create(checkpoints, ignore_conflicts=True)
+            if checkpoints_generation(lock=True) != generation:
+                transaction.set_rollback(True)
+    return existing + [(checkpoint.month, checkpoint.balance) for checkpoint in checkpoints]
+
+
+def opening_balances(days):
+    """Остаток на начало каждого дня: закрытие предыдущего месяца плюс дни месяца по сводкам"""
+    days = sorted(set(days))
+    if not days:
+        return {}
+    months = sorted({month_start(day) for day in days})
+    # Остатки этого запроса берутся из посчитанного, даже если сохранить их не удалось
+    checkpoint_months = []
+    checkpoint_balances = []
+    for checkpoint_month, balance in ensure_checkpoints(months[-1]):
+        checkpoint_months.append(checkpoint_month)
+        checkpoint_balances.append(balance)
+    month_opening = {}
+    for month in months:
+        # Месяцы без операций остатков не имеют: берём последний остаток до месяца
+        index = bisect_left(checkpoint_months, month)
+        month_opening[month] = checkpoint_balances[index - 1] if index else ZERO
+
+    # Суммы дней от начала месяца до самого позднего нужного дня в этом месяце
+    last_day = {}
+    for day in days:
+        last_day[month_start(day)] = day
+    daily = {}
+    signs = type_signs()
+    for month, day in last_day.items():
+        rows = DailyRollup.objects.filter(date__gte=month, date__lt=day).values('date').annotate(
+            day_total=Sum(signed_amount(signs, field='total'))
+        )
+        for row in rows:
+            daily[row['date']] = row['day_total']
+
+    openings = {}
+    for month in months:
+        balance = month_opening[month]
+        month_days = sorted(day for day in daily if month_start(day) == month)
+        for day in [day for day in days if month_start(day) == month]:
+            while month_days and month_days[0] < day:
+                balance += daily[month_days.pop(0)]
+            openings[day] = balance
+    return openings
+
+
+def running_balances(keys):
+    """
+    Остаток после каждой операции для пар (id, дата): остаток на начало дня
+    плюс оконная сумма по операциям того же дня в порядке created_at, id.
+    Стоимость - строки этих дней и дни их месяцев, а не вся история.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    openings = opening_balances(day for _, day in keys)
+    wanted = {pk for pk, _ in keys}
+    # Архивные операции тех же дней тоже входят в остаток
+    model = source_model(min(openings))
+    rows = model.objects.filter(date__in=openings.keys()).annotate(
+        day_running=Window(
+            Sum(signed_amount(type_signs())),
+            partition_by=[F('date')],
+            order_by=[F('created_at').asc(), F('id').asc()],
+        )
+    ).order_by().values_list('id', 'date', 'day_running')
+    return {pk: openings[day] + running for pk, day, running in rows if pk in wanted}
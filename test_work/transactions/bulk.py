@@ -0,0 +1,125 @@
+"""
+Массовые действия над операциями из списка: смена статуса, смена пары
+категория/подкатегория и удаление; перенос операций при удалении записи
+справочника.
+
+Каждое действие - один UPDATE или DELETE по выборке (отмеченные строки
+или все операции под текущими фильтрами) в одной транзакции. Сигналы
+моделей не вызываются, поэтому дневные сводки правятся здесь же: дельты
+считаются одним GROUP BY по той же выборке до изменения.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .dictionary_cache import get_tree
+from .models import (
+    Transaction, ArchivedTransaction, Status, TransactionType, Category, Subcategory, TransactionTombstone,
+)
+from .rollups import ROLLUP_KEY_FIELDS, add_delta, apply_deltas, queryset_deltas
+
+
+DICTIONARY_FIELDS = {
+    Status: 'status',
+    TransactionType: 'transaction_type',
+    Category: 'category',
+    Subcategory: 'subcategory',
+}
+
+
+class BulkActionError(ValueError):
+    """Действие нельзя применить к выбранным операциям"""
+
+
+def _moved_deltas(queryset, changes):
+    """Дельты сводки при замене полей ключа changes ({'status_id': 3, ...}) у всех операций queryset"""
+    positions = {ROLLUP_KEY_FIELDS.index(field): value for field, value in changes.items()}
+    deltas = {}
+    for key, (amount, count) in queryset_deltas(queryset).items():
+        add_delta(deltas, key, -amount, -count)
+        moved = tuple(positions.get(index, value) for index, value in enumerate(key))
+        add_delta(deltas, moved, amount, count)
+    return deltas
+
+
+def _update(querysets, **changes):
+    key_changes = {f'{field}_id': value.pk for field, value in changes.items()}
+    deltas = {}
+    updated = 0
+    with transaction.atomic():
+        for queryset in querysets:
+            for key, (amount, count) in _moved_deltas(queryset, key_changes).items():
+                add_delta(deltas, key, amount, count)
+        # Сводки пишутся первыми: apply_deltas всегда что-то записывает и этим берёт
+        # блокировку записи при любом transaction_mode. update() не вызывает pre_save,
+        # поэтому auto_now выставляем сами - уже под блокировкой (см. changes.py)
+        apply_deltas(deltas)
+        now = timezone.now()
+        for queryset in querysets:
+            updated += queryset.order_by().update(updated_at=now, **changes)
+    return updated
+
+
+def set_status(queryset, status):
+    """Меняет статус всех операций queryset, возвращает их число"""
+    return _update([queryset], status=status)
+
+
+def set_category(queryset, category, subcategory):
+    """
+    Меняет категорию и подкатегорию всех операций queryset. Тип операции не
+    меняется, поэтому все операции должны быть того же типа, что и категория.
+    """
+    errors = get_tree().hierarchy_errors(category.transaction_type_id, category.pk, subcategory.pk)
+    if errors:
+        raise BulkActionError(' '.join(errors.values()))
+    with transaction.atomic():
+        other_type = queryset.exclude(transaction_type_id=category.transaction_type_id).count()
+        if other_type:
+            raise BulkActionError(
+                f'Категория «{category.name}» не подходит для {other_type} выбранных операций другого типа'
+            )
+        return _update([queryset], category=category, subcategory=subcategory)
+
+
+def delete(queryset):
+    """Удаляет все операции queryset одним DELETE, возвращает их число"""
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    tombstones = connection.ops.quote_name(TransactionTombstone._meta.db_table)
+    # QuerySet.delete() с подключёнными сигналами удаляет и пересчитывает сводку построчно
+    ids_sql, params = queryset.order_by().values('id').query.sql_with_params()
+    with transaction.atomic():
+        # Как в _update: время отметок ставится после первой записи, под блокировкой
+        apply_deltas(queryset_deltas(queryset, sign=-1))
+        deleted_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            # Отметки для ленты изменений, как post_delete у одиночного удаления
+            cursor.execute(
+                f'INSERT INTO {tombstones} (transaction_id, deleted_at) SELECT id, %s FROM {table} WHERE id IN ({ids_sql})',
+                [deleted_at, *params],
+            )
+            cursor.execute(f'DELETE FROM {table} WHERE id IN ({ids_sql})', params)
+            deleted = cursor.rowcount
+    return deleted
+
+
+def delete_dictionary_entry(entry, **replacement):
+    """
+    Удаляет запись справочника. Операции, которые на неё ссылаются (рабочие и
+    архивные), сначала переносятся на replacement (status=..., или category=...,
+    subcategory=...) - по одному UPDATE на таблицу. Без replacement запись с
+    операциями не удаляется. Возвращает число перенесённых операций.
+    """
+    if entry.usage_count and not replacement:
+        raise BulkActionError(f'«{entry.name}» используется в операциях: {entry.usage_count}')
+    field = DICTIONARY_FIELDS[type(entry)]
+    querysets = [model.objects.filter(**{field: entry}) for model in (Transaction, ArchivedTransaction)]
+    with transaction.atomic():
+        # Нулевой счётчик перепроверяется по обеим таблицам: если он разошёлся с данными
+        # (правка базы вручную), оставшаяся ссылка из архива дала бы ошибку внешнего ключа
+        # только при фиксации. Проверка архива - перебор, но удаление справочника редкое
+        in_use = entry.usage_count or any(queryset.exists() for queryset in querysets)
+        if in_use and not replacement:
+            raise BulkActionError(f'«{entry.name}» используется в операциях')
+        moved = _update(querysets, **replacement) if in_use else 0
+        entry.delete()
+    return moved
@@ -0,0 +1,124 @@
+"""
+Лента изменений операций для клиентов, которые держат копию журнала.
+
+Изменения упорядочены по ключу (время изменения, id): updated_at рабочей
+таблицы и архива и deleted_at отметок об удалении (TransactionTombstone).
+Каждый источник читается keyset-запросом по своему индексу не дальше
+limit + 1 строк, затем потоки сливаются. Курсор - ключ последнего отданного
+изменения, следующий запрос продолжает строго после него.
+
+Изменения моложе CHANGE_FEED_LAG секунд не отдаются: время изменения
+выставляется до фиксации транзакции, и запись, зафиксированная чуть позже
+соседней, иначе могла бы оказаться позади уже выданного курсора. Задержка
+верна, пока транзакция записи короче её и время ставится после взятия
+блокировки записи (ожидание busy_timeout в него не входит). Массовые
+действия (bulk.py) и импорт (importing.insert_rows, не больше
+INSERT_TRANSACTION_ROWS строк в одной транзакции) сначала пишут сводки и
+только потом читают часы. Одиночные сохранения через ORM ставят auto_now
+до первой записи, поэтому для них это верно только с BEGIN IMMEDIATE
+(transaction_mode в профиле SQLITE_PRODUCTION); без него (разработка,
+тесты) лента при параллельной записи может пропустить изменение.
+"""
+import base64
+import binascii
+import heapq
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedTransaction, Transaction, TransactionTombstone
+
+CHANGE_FEED_LIMIT = 1000
+CHANGE_FEED_MAX_LIMIT = 5000
+CHANGE_FEED_LAG = 2
+# Сколько строк операций читать одним запросом при выдаче страницы
+CHANGE_FEED_CHUNK_SIZE = 500
+CHANGE_FIELDS = (
+    'id', 'date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id',
+    'amount', 'comment', 'created_at', 'updated_at',
+)
+UPSERT = 'upsert'
+DELETE = 'delete'
+# Источники изменений: (модель, поле времени, поле id, вид изменения)
+SOURCES = (
+    (Transaction, 'updated_at', 'id', UPSERT),
+    (ArchivedTransaction, 'updated_at', 'id', UPSERT),
+    (TransactionTombstone, 'deleted_at', 'transaction_id', DELETE),
+)
+
+
+def encode_cursor(changed_at, pk):
+    raw = json.dumps([changed_at.isoformat(), pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (changed_at, id) или None для некорректного курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        changed_at, pk = json.loads(raw)
+        return datetime.fromisoformat(changed_at), int(pk)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def change_keys(after=None, limit=CHANGE_FEED_LIMIT):
+    """
+    Ключи (changed_at, id, вид, модель) следующих изменений после курсора
+    after, не больше limit, и признак, что за ними есть ещё.
+    """
+    lag = getattr(settings, 'TRANSACTIONS_CHANGE_FEED_LAG', CHANGE_FEED_LAG)
+    until = timezone.now() - timedelta(seconds=lag)
+    streams = []
+    for model, time_field, id_field, kind in SOURCES:
+        queryset = model.objects.filter(**{f'{time_field}__lt': until})
+        if after is not None:
+            changed_at, pk = after
+            # Избыточное условие >= даёт планировщику диапазон по индексу, как в KeysetPaginator
+            queryset = queryset.filter(
+                Q(**{f'{time_field}__gte': changed_at})
+                & (Q(**{f'{time_field}__gt': changed_at}) | Q(**{time_field: changed_at, f'{id_field}__gt': pk}))
+            )
+        rows = queryset.order_by(time_field, id_field).values_list(time_field, id_field)[:limit + 1]
+        streams.append([(changed_at, pk, kind, model) for changed_at, pk in rows])
+    keys = list(heapq.merge(*streams, key=lambda key: key[:2]))
+    return keys[:limit], len(keys) > limit
+
+
+def _records(keys):
+    """Записи ленты в порядке keys; строки операций читаются пачками по id"""
+    for start in range(0, len(keys), CHANGE_FEED_CHUNK_SIZE):
+        chunk = keys[start:start + CHANGE_FEED_CHUNK_SIZE]
+        rows = {}
+        for model in (Transaction, ArchivedTransaction):
+            ids = [pk for _, pk, kind, source in chunk if source is model]
+            if ids:
+                rows.update((row['id'], row) for row in model.objects.filter(id__in=ids).values(*CHANGE_FIELDS))
+        for changed_at, pk, kind, _ in chunk:
+            if kind == DELETE:
+                yield {'op': DELETE, 'id': pk, 'deleted_at': changed_at}
+            elif pk in rows:
+                # Строку могли удалить между чтением ключей и чтением данных: удаление придёт следующей страницей
+                yield {'op': UPSERT, **rows[pk]}
+
+
+def change_stream(keys, cursor, has_more):
+    """
+    NDJSON страницы ленты: по строке на изменение и последняя строка с
+    курсором следующего запроса.
+    """
+    for record in _records(keys):
+        yield (json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n').encode()
+    yield (json.dumps({'op': 'cursor', 'cursor': cursor, 'has_more': has_more}) + '\n').encode()
+
+
+def next_cursor(keys, cursor):
+    """Курсор после последнего ключа страницы; без изменений курсор не сдвигается"""
+    if not keys:
+        return cursor
+    changed_at, pk, _, _ = keys[-1]
+    return encode_cursor(changed_at, pk)
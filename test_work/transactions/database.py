@@ -0,0 +1,54 @@
+"""
+Профиль SQLite для продакшена (включается SQLITE_PRODUCTION=1 в settings.py).
+
+apply_pragmas настраивает каждое новое соединение (WAL, synchronous, mmap,
+кэш страниц, ожидание блокировки), ReadWriteRouter отправляет чтения в
+отдельное соединение только для чтения, а записи - в основное. В режиме WAL
+читатели не блокируют писателя и видят всё, что он уже зафиксировал.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def read_alias():
+    """Псевдоним соединения для чтения или None, если оно не настроено"""
+    alias = getattr(settings, 'DATABASE_READ_ALIAS', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def apply_pragmas(connection):
+    """PRAGMA из SQLITE_PRAGMAS для нового соединения; соединению для чтения - ещё query_only"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    pragmas = dict(pragmas)
+    if connection.alias == read_alias():
+        # Запись через соединение для чтения - ошибка маршрутизации, а не тихая запись
+        pragmas['query_only'] = 'ON'
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class ReadWriteRouter:
+    """
+    Чтения - в DATABASE_READ_ALIAS, записи и миграции - в основную базу.
+    Внутри транзакции основной базы чтения остаются в ней: отдельное
+    соединение не видит её незафиксированных изменений.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Оба псевдонима - одна и та же база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
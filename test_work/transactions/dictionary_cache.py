@@ -0,0 +1,220 @@
+import threading
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.utils.decorators import sync_and_async_middleware
+
+from .models import CacheVersion, Status, TransactionType, Category, Subcategory
+
+VERSION_NAME = 'dictionaries'
+
+StatusNode = namedtuple('StatusNode', ['id', 'name'])
+TypeNode = namedtuple('TypeNode', ['id', 'name'])
+CategoryNode = namedtuple('CategoryNode', ['id', 'name', 'transaction_type'])
+SubcategoryNode = namedtuple('SubcategoryNode', ['id', 'name', 'category'])
+
+
+class DictionaryTree:
+    """
+    Неизменяемый снимок справочников: узлы по id, списки детей и версия,
+    с которой снимок был построен.
+    """
+
+    def __init__(self, version, statuses, transaction_types, categories, subcategories):
+        self.version = version
+        # Списки в порядке отображения, словари id -> узел
+        self.statuses = tuple(statuses)
+        self.transaction_types = tuple(transaction_types)
+        self.categories = tuple(sorted(categories, key=lambda node: (node.name, node.id)))
+        self.subcategories = tuple(sorted(subcategories, key=lambda node: (node.name, node.id)))
+
+        self.nodes = MappingProxyType({
+            Status: MappingProxyType({node.id: node for node in self.statuses}),
+            TransactionType: MappingProxyType({node.id: node for node in self.transaction_types}),
+            Category: MappingProxyType({node.id: node for node in self.categories}),
+            Subcategory: MappingProxyType({node.id: node for node in self.subcategories}),
+        })
+
+        type_categories = {node.id: [] for node in self.transaction_types}
+        for node in self.categories:
+            type_categories[node.transaction_type.id].append(node.id)
+        category_subcategories = {node.id: [] for node in self.categories}
+        for node in self.subcategories:
+            category_subcategories[node.category.id].append(node.id)
+        self.type_categories = MappingProxyType({key: tuple(ids) for key, ids in type_categories.items()})
+        self.category_subcategories = MappingProxyType(
+            {key: tuple(ids) for key, ids in category_subcategories.items()}
+        )
+
+    @classmethod
+    def build(cls, version):
+        statuses = [StatusNode(*row) for row in Status.objects.order_by('id').values_list('id', 'name')]
+        types = {
+            row[0]: TypeNode(*row)
+            for row in TransactionType.objects.order_by('id').values_list('id', 'name')
+        }
+        categories = {
+            pk: CategoryNode(pk, name, types[type_id])
+            for pk, name, type_id in Category.objects.values_list('id', 'name', 'transaction_type_id')
+        }
+        subcategories = [
+            SubcategoryNode(pk, name, categories[category_id])
+            for pk, name, category_id in Subcategory.objects.values_list('id', 'name', 'category_id')
+        ]
+        return cls(version, statuses, types.values(), categories.values(), subcategories)
+
+    def get(self, model, pk):
+        return self.nodes[model].get(pk)
+
+    def ordered(self, model):
+        return {
+            Status: self.statuses,
+            TransactionType: self.transaction_types,
+            Category: self.categories,
+            Subcategory: self.subcategories,
+        }[model]
+
+    def hierarchy_errors(self, type_id, category_id, subcategory_id):
+        """
+        Проверка цепочки тип -> категория -> подкатегория по родителям узлов,
+        без запросов. Возвращает {поле: сообщение}, пустой словарь - цепочка верна.
+        Общая для формы операции, массовых действий, API и импорта.
+        """
+        errors = {}
+        transaction_type = self.get(TransactionType, type_id)
+        category = self.get(Category, category_id)
+        subcategory = self.get(Subcategory, subcategory_id)
+        if transaction_type is None:
+            errors['transaction_type'] = 'Тип операции не найден'
+        if category is None:
+            errors['category'] = 'Категория не найдена'
+        elif transaction_type is not None and category.transaction_type.id != transaction_type.id:
+            errors['category'] = (
+                f'Категория «{category.name}» относится к типу «{category.transaction_type.name}», '
+                f'а не «{transaction_type.name}»'
+            )
+        if subcategory is None:
+            errors['subcategory'] = 'Подкатегория не найдена'
+        elif category is not None and subcategory.category.id != category.id:
+            errors['subcategory'] = (
+                f'Подкатегория «{subcategory.name}» относится к категории «{subcategory.category.name}», '
+                f'а не «{category.name}»'
+            )
+        return errors
+
+    @staticmethod
+    def label(node):
+        """Подпись узла как у __str__ соответствующей модели"""
+        if isinstance(node, CategoryNode):
+            return f"{node.name} ({node.transaction_type.name})"
+        if isinstance(node, SubcategoryNode):
+            return f"{node.name} ({node.category.name})"
+        return node.name
+
+    @staticmethod
+    def instance(model, node):
+        """Экземпляр модели из узла, как если бы он был загружен из БД"""
+        # usage_count в снимок не входит и остаётся отложенным полем
+        if isinstance(node, CategoryNode):
+            fields, values = ['id', 'name', 'transaction_type_id'], [node.id, node.name, node.transaction_type.id]
+        elif isinstance(node, SubcategoryNode):
+            fields, values = ['id', 'name', 'category_id'], [node.id, node.name, node.category.id]
+        else:
+            fields, values = ['id', 'name'], [node.id, node.name]
+        return model.from_db('default', fields, values)
+
+
+_lock = threading.Lock()
+_tree = None
+# Снимок, закреплённый за текущим асинхронным запросом (см. use_tree)
+_pinned_tree = ContextVar('pinned_dictionary_tree', default=None)
+# Снимок текущего запроса: версия из БД читается один раз за запрос (см. dictionary_tree_middleware)
+_request_scope = ContextVar('dictionary_tree_request_scope', default=None)
+
+
+def current_version():
+    """
+    Версия справочников из БД (одна выборка по первичному ключу). Кэш Django
+    для неё не подходит: локальный кэш процесса не видит изменений из других
+    процессов и команд.
+    """
+    return CacheVersion.objects.filter(name=VERSION_NAME).values_list('token', flat=True).first() or ''
+
+
+def get_tree():
+    """Снимок справочников; перестраивается, только если версия в кэше изменилась"""
+    global _tree
+    pinned = _pinned_tree.get()
+    if pinned is not None:
+        return pinned
+    scope = _request_scope.get()
+    if scope is not None and 'tree' in scope:
+        return scope['tree']
+    version = current_version()
+    tree = _tree
+    if tree is None or tree.version != version:
+        with _lock:
+            tree = _tree
+            if tree is None or tree.version != version:
+                tree = _tree = DictionaryTree.build(version)
+    if scope is not None:
+        scope['tree'] = tree
+    return tree
+
+
+async def aget_tree():
+    """get_tree для асинхронных представлений: версия читается из БД, поэтому через sync_to_async"""
+    return await sync_to_async(get_tree)()
+
+
+@contextmanager
+def use_tree(tree):
+    """
+    Закрепляет снимок за текущим контекстом: формы внутри блока вызывают
+    get_tree() синхронно, и он не должен пытаться читать БД из event loop.
+    """
+    token = _pinned_tree.set(tree)
+    try:
+        yield tree
+    finally:
+        _pinned_tree.reset(token)
+
+
+def bump_version():
+    """
+    Помечает снимки всех процессов устаревшими. Новая версия пишется в той же
+    транзакции, что и изменение справочников: другие процессы увидят её только
+    вместе с изменением, а снимок строится после чтения версии и потому не
+    может оказаться старше её.
+    """
+    CacheVersion.objects.update_or_create(name=VERSION_NAME, defaults={'token': uuid.uuid4().hex})
+    scope = _request_scope.get()
+    if scope is not None:
+        scope.pop('tree', None)
+
+
+@sync_and_async_middleware
+def dictionary_tree_middleware(get_response):
+    """
+    Один снимок справочников на запрос: формы и поля вызывают get_tree()
+    много раз, а версию из БД достаточно прочитать при первом вызове.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _request_scope.set({})
+            try:
+                return await get_response(request)
+            finally:
+                _request_scope.reset(token)
+    else:
+        def middleware(request):
+            token = _request_scope.set({})
+            try:
+                return get_response(request)
+            finally:
+                _request_scope.reset(token)
+    return middleware
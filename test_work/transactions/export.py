@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from .balance import running_balances
+
+EXPORT_FIELDS = (
+    ('id', 'id'),
+    ('date', 'date'),
+    ('status', 'status__name'),
+    ('transaction_type', 'transaction_type__name'),
+    ('category', 'category__name'),
+    ('subcategory', 'subcategory__name'),
+    ('amount', 'amount'),
+    ('comment', 'comment'),
+)
+# Остаток после операции считается отдельно (balance.running_balances) и идёт последним столбцом
+EXPORT_COLUMNS = [name for name, _ in EXPORT_FIELDS] + ['balance']
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+EXPORT_CHUNK_SIZE = 2000
+GZIP_TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+
+
+def gzip_requested(params):
+    """Флаг ?gzip=: сжатие только для явного 1/true/yes/on, gzip=0 и gzip=false - без сжатия"""
+    return params.get('gzip', '').strip().lower() in GZIP_TRUE_VALUES
+
+
+def export_values(queryset):
+    """Кортежи значений для выгрузки, без создания экземпляров моделей"""
+    return queryset.order_by('-date', '-created_at', '-id').values_list(
+        *(lookup for _, lookup in EXPORT_FIELDS)
+    )
+
+
+def with_balances(batch):
+    """Добавляет к строкам (id, date, ...) остаток после операции"""
+    balances = running_balances((row[0], row[1]) for row in batch)
+    return [row + (balances.get(row[0]),) for row in batch]
+
+
+def _batches(rows, chunk_size):
+    batch = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield with_balances(batch)
+            batch = []
+    if batch:
+        yield with_balances(batch)
+
+
+async def _abatches(rows, chunk_size):
+    # QuerySet.aiterator() для values_list выполняет запрос прямо в event loop
+    # (SynchronousOnlyOperation), поэтому синхронный генератор пачек создаётся и
+    # прокручивается в потоке - по одному переходу на пачку, а не на строку
+    batches = _batches(rows, chunk_size)
+    try:
+        while True:
+            batch = await sync_to_async(next)(batches, None)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        await sync_to_async(batches.close)()
+
+
+def csv_encoder():
+    """Возвращает (заголовок, функция кодирования пачки строк) для CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM нужен, чтобы Excel корректно открыл кириллицу
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    header = buffer.getvalue().encode()
+
+    def encode(batch):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        return buffer.getvalue().encode()
+
+    return header, encode
+
+
+def ndjson_encoder():
+    def encode(batch):
+        lines = []
+        for row in batch:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record['date'] = record['date'].isoformat()
+            record['amount'] = str(record['amount'])
+            record['balance'] = str(record['balance'])
+            lines.append(json.dumps(record, ensure_ascii=False))
+        return ('\n'.join(lines) + '\n').encode()
+
+    return None, encode
+
+
+def _encoder(export_format):
+    if export_format == 'ndjson':
+        return ndjson_encoder()
+    return csv_encoder()
+
+
+def export_stream(rows, export_format, chunk_size=EXPORT_CHUNK_SIZE, on_batch=None):
+    """Куски выгрузки; on_batch(число строк) вызывается после каждой пачки (прогресс фоновой задачи)"""
+    header, encode = _encoder(export_format)
+    if header:
+        yield header
+    for batch in _batches(rows, chunk_size):
+        yield encode(batch)
+        if on_batch is not None:
+            on_batch(len(batch))
+
+
+async def aexport_stream(rows, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Асинхронный вариант export_stream для StreamingHttpResponse под ASGI"""
+    header, encode = _encoder(export_format)
+    if header:
+        yield header
+    async for batch in _abatches(rows, chunk_size):
+        yield encode(batch)
+
+
+def gzip_stream(chunks):
+    """Сжимает поток на лету; каждый кусок сбрасывается сразу, чтобы клиент получал данные без задержки"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def agzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -1,12 +1,92 @@
 from django import forms
 from django.utils import timezone
-from .models import Transaction, Status, TransactionType, Category, Subcategory
+from django.utils.choices import BaseChoiceIterator
+from .archive import source_model
+from .dictionary_cache import DictionaryTree, get_tree
+from .models import Transaction, CombinedTransaction, Status, TransactionType, Category, Subcategory
+from .search import search_queryset
+
+
+class DictionaryChoiceIterator(BaseChoiceIterator):
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for node in self.field.nodes():
+            yield (node.id, DictionaryTree.label(node))
+
+    def __len__(self):
+        return len(self.field.nodes()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.nodes())
+
+
+class DictionaryChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField, который строит варианты и проверяет значение по снимку
+    справочников из dictionary_cache, не выполняя запросов к БД.
+    """
+
+    def __init__(self, queryset, *args, **kwargs):
+        self.limit_ids = None
+        self.validate_limit = True
+        super().__init__(queryset, *args, **kwargs)
+
+    def limit_to(self, ids, validate=True):
+        """
+        Ограничивает варианты указанными id (None - все записи справочника).
+        validate=False - ограничить только список в виджете, а значение вне
+        списка проверить в форме (с более точным сообщением).
+        """
+        self.limit_ids = None if ids is None else tuple(ids)
+        self.validate_limit = validate
+        self.widget.choices = self.choices
+
+    def nodes(self):
+        tree = get_tree()
+        model = self.queryset.model
+        if self.limit_ids is None:
+            return tree.ordered(model)
+        return [node for node in map(lambda pk: tree.get(model, pk), self.limit_ids) if node is not None]
+
+    def _get_choices(self):
+        if hasattr(self, '_choices'):
+            return self._choices
+        return DictionaryChoiceIterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField.choices.fset)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            pk = None
+        model = self.queryset.model
+        node = get_tree().get(model, pk)
+        if node is None or (self.validate_limit and self.limit_ids is not None and pk not in self.limit_ids):
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return DictionaryTree.instance(model, node)
+
+
+DICTIONARY_FIELDS = ('status', 'transaction_type', 'category', 'subcategory')
 
 
 class TransactionForm(forms.ModelForm):
     class Meta:
         model = Transaction
         fields = ['date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment']
+        field_classes = {field: DictionaryChoiceField for field in DICTIONARY_FIELDS}
         widgets = {
             'date': forms.DateInput(
                 attrs={
@@ -31,40 +111,51 @@ class TransactionForm(forms.ModelForm):
             self.fields['date'].initial = today
             self.fields['date'].widget.attrs['value'] = today.strftime('%Y-%m-%d')
 
-        # Настройка выпадающих списков
-        self.fields['status'].queryset = Status.objects.all()
-        self.fields['transaction_type'].queryset = TransactionType.objects.all()
-
-        if not self.instance.pk:
-            self.fields['category'].queryset = Category.objects.all().order_by('name')
-            self.fields['subcategory'].queryset = Subcategory.objects.all().order_by('name')
-        else:
-            self.fields['category'].queryset = Category.objects.filter(
-                transaction_type=self.instance.transaction_type
-            ).order_by('name')
-            self.fields['subcategory'].queryset = Subcategory.objects.filter(
-                category=self.instance.category
-            ).order_by('name')
+        # Настройка выпадающих списков по кэшу справочников; соответствие
+        # выбранных значений иерархии проверяется в clean()
+        tree = get_tree()
+        if self.instance.pk:
+            self.fields['category'].limit_to(
+                tree.type_categories.get(self.instance.transaction_type_id, ()), validate=False
+            )
+            self.fields['subcategory'].limit_to(
+                tree.category_subcategories.get(self.instance.category_id, ()), validate=False
+            )
 
         # AJAX обработка
         if 'transaction_type' in self.data:
             try:
                 transaction_type_id = int(self.data.get('transaction_type'))
-                self.fields['category'].queryset = Category.objects.filter(
-                    transaction_type_id=transaction_type_id
-                ).order_by('name')
+                self.fields['category'].limit_to(tree.type_categories.get(transaction_type_id, ()), validate=False)
             except (ValueError, TypeError):
                 pass
 
         if 'category' in self.data:
             try:
                 category_id = int(self.data.get('category'))
-                self.fields['subcategory'].queryset = Subcategory.objects.filter(
-                    category_id=category_id
-                ).order_by('name')
+                self.fields['subcategory'].limit_to(
+                    tree.category_subcategories.get(category_id, ()), validate=False
+                )
             except (ValueError, TypeError):
                 pass
 
+    def clean(self):
+        """Категория должна относиться к типу операции, подкатегория - к категории (по кэшу, без запросов)"""
+        cleaned_data = super().clean()
+        values = [cleaned_data.get(field) for field in ('transaction_type', 'category', 'subcategory')]
+        if all(values):
+            errors = get_tree().hierarchy_errors(*(value.pk for value in values))
+            for field, message in errors.items():
+                self.add_error(field, message)
+        return cleaned_data
+
+    def _get_validation_exclusions(self):
+        # Существование справочников уже проверено по кэшу в DictionaryChoiceField,
+        # повторная проверка моделью стоила бы запрос на каждый внешний ключ
+        exclude = super()._get_validation_exclusions()
+        exclude.update(DICTIONARY_FIELDS)
+        return exclude
+
     def clean_date(self):
         """Если дата не указана, используем сегодняшнюю"""
         date = self.cleaned_data.get('date')
@@ -84,31 +175,174 @@ class TransactionFilterForm(forms.Form):
         widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
         label='Дата по'
     )
-    status = forms.ModelChoiceField(
+    status = DictionaryChoiceField(
         queryset=Status.objects.all(),
         required=False,
         empty_label="Все статусы",
         widget=forms.Select(attrs={'class': 'form-control'}),
         label='Статус'
     )
-    transaction_type = forms.ModelChoiceField(
+    transaction_type = DictionaryChoiceField(
         queryset=TransactionType.objects.all(),
         required=False,
         empty_label="Все типы",
         widget=forms.Select(attrs={'class': 'form-control'}),
         label='Тип операции'
     )
-    category = forms.ModelChoiceField(
+    category = DictionaryChoiceField(
         queryset=Category.objects.all(),
         required=False,
         empty_label="Все категории",
         widget=forms.Select(attrs={'class': 'form-control'}),
         label='Категория'
     )
-    subcategory = forms.ModelChoiceField(
+    subcategory = DictionaryChoiceField(
         queryset=Subcategory.objects.all(),
         required=False,
         empty_label="Все подкатегории",
         widget=forms.Select(attrs={'class': 'form-control'}),
         label='Подкатегория'
     )
+    q = forms.CharField(
+        required=False,
+        max_length=200,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Слова из комментария'}),
+        label='Поиск'
+    )
+
+    def search_text(self):
+        """Строка поиска по комментарию или пустая строка"""
+        if not self.is_valid():
+            return ''
+        return (self.cleaned_data.get('q') or '').strip()
+
+    def source_model(self):
+        """Модель операций для выборки: вместе с архивом, только если фильтр по дате до него доходит"""
+        return source_model(self.cleaned_data['date_from'] if self.is_valid() else None)
+
+    def filter_queryset(self, queryset, ranked=False):
+        """
+        Применяет заполненные фильтры к queryset транзакций. ranked - при
+        поиске по комментарию упорядочить результат по релевантности.
+        """
+        if not self.is_valid():
+            return queryset
+
+        data = self.cleaned_data
+        if data['date_from']:
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data['date_to']:
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data['status']:
+            queryset = queryset.filter(status=data['status'])
+        if data['transaction_type']:
+            queryset = queryset.filter(transaction_type=data['transaction_type'])
+        if data['category']:
+            queryset = queryset.filter(category=data['category'])
+        if data['subcategory']:
+            queryset = queryset.filter(subcategory=data['subcategory'])
+        if data.get('q'):
+            queryset = search_queryset(queryset, data['q'], ranked=ranked)
+        return queryset
+
+
+class IdListField(forms.Field):
+    """Список id из повторяющегося параметра (флажки ids=1&ids=2)"""
+
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return [int(pk) for pk in value or ()]
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Некорректный список операций', code='invalid')
+
+
+class TransactionBulkForm(forms.Form):
+    """Массовое действие над отмеченными операциями списка или всеми операциями под фильтрами"""
+
+    ACTION_CHOICES = [
+        ('status', 'Сменить статус'),
+        ('category', 'Сменить категорию'),
+        ('delete', 'Удалить'),
+    ]
+
+    action = forms.ChoiceField(
+        choices=ACTION_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='Действие'
+    )
+    ids = IdListField(required=False)
+    apply_to_all = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        label='Ко всем операциям под фильтром'
+    )
+    status = DictionaryChoiceField(
+        queryset=Status.objects.all(),
+        required=False,
+        empty_label="Новый статус",
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='Статус'
+    )
+    category = DictionaryChoiceField(
+        queryset=Category.objects.all(),
+        required=False,
+        empty_label="Новая категория",
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='Категория'
+    )
+    subcategory = DictionaryChoiceField(
+        queryset=Subcategory.objects.all(),
+        required=False,
+        empty_label="Новая подкатегория",
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='Подкатегория'
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('ids') and not cleaned_data.get('apply_to_all'):
+            raise forms.ValidationError('Отметьте операции или выберите действие ко всем операциям под фильтром')
+        action = cleaned_data.get('action')
+        if action == 'status' and not cleaned_data.get('status'):
+            self.add_error('status', 'Выберите новый статус')
+        if action == 'category':
+            if not cleaned_data.get('category'):
+                self.add_error('category', 'Выберите новую категорию')
+            if not cleaned_data.get('subcategory'):
+                self.add_error('subcategory', 'Выберите новую подкатегорию')
+        return cleaned_data
+
+    def selection(self, filter_form):
+        """Операции рабочей таблицы под фильтрами списка; без apply_to_all - только отмеченные"""
+        queryset = filter_form.filter_queryset(Transaction.objects.all())
+        if not self.cleaned_data['apply_to_all']:
+            queryset = queryset.filter(pk__in=self.cleaned_data['ids'])
+        return queryset
+
+    def skipped_archived(self, filter_form):
+        """
+        Сколько архивных операций под фильтрами списка не попало в выборку
+        apply_to_all: список их показывает, но архив только читается
+        """
+        if not self.cleaned_data['apply_to_all'] or filter_form.source_model() is Transaction:
+            return 0
+        return filter_form.filter_queryset(CombinedTransaction.objects.filter(archived=True)).count()
+
+
+class RollupReportForm(TransactionFilterForm):
+    PERIOD_CHOICES = [
+        ('day', 'По дням'),
+        ('month', 'По месяцам'),
+        ('year', 'По годам'),
+    ]
+
+    period = forms.ChoiceField(
+        choices=PERIOD_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='Период'
+    )
+    # Сводки не содержат комментариев
+    q = None
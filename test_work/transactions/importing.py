@@ -0,0 +1,194 @@
+import csv
+import json
+from operator import itemgetter
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .dictionary_cache import get_tree
+from .models import Transaction
+from .rollups import add_delta, apply_deltas
+from .search import insert_indexed
+
+IMPORT_FIELDS = ('date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment')
+ROW_FIELDS = ('date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id', 'amount', 'comment')
+AMOUNT_QUANT = Decimal('0.01')
+MAX_AMOUNT = Decimal('9999999999.99')
+DATE_FORMATS = ('%d.%m.%Y', '%d/%m/%Y')
+# Больше строк в одной транзакции не пишется: транзакция должна укладываться в
+# задержку ленты изменений (changes.CHANGE_FEED_LAG), около 0,3 с на SQLite
+INSERT_TRANSACTION_ROWS = 10000
+
+
+class RowError(ValueError):
+    """Ошибка разбора строки импорта"""
+
+
+class DictionaryLookup:
+    """
+    Справочники в памяти для разрешения названий в id.
+
+    Категория ищется в пределах типа операции, подкатегория - в пределах категории,
+    поэтому найденная цепочка всегда согласована с иерархией справочников.
+    """
+
+    def __init__(self, statuses, transaction_types, categories, subcategories):
+        self.statuses = statuses
+        self.transaction_types = transaction_types
+        self.categories = categories
+        self.subcategories = subcategories
+
+    @classmethod
+    def load(cls):
+        # Из снимка справочников (dictionary_cache): без запросов, если он актуален
+        tree = get_tree()
+        return cls(
+            statuses={node.name: node.id for node in tree.statuses},
+            transaction_types={node.name: node.id for node in tree.transaction_types},
+            categories={(node.transaction_type.id, node.name): node.id for node in tree.categories},
+            subcategories={(node.category.id, node.name): node.id for node in tree.subcategories},
+        )
+
+    def resolve(self, status, transaction_type, category, subcategory):
+        """Возвращает (status_id, transaction_type_id, category_id, subcategory_id)"""
+        try:
+            status_id = self.statuses[status]
+        except KeyError:
+            raise RowError(f'Неизвестный статус "{status}"')
+        try:
+            type_id = self.transaction_types[transaction_type]
+        except KeyError:
+            raise RowError(f'Неизвестный тип операции "{transaction_type}"')
+        try:
+            category_id = self.categories[(type_id, category)]
+        except KeyError:
+            raise RowError(f'Категория "{category}" не относится к типу "{transaction_type}"')
+        try:
+            subcategory_id = self.subcategories[(category_id, subcategory)]
+        except KeyError:
+            raise RowError(f'Подкатегория "{subcategory}" не относится к категории "{category}"')
+        return status_id, type_id, category_id, subcategory_id
+
+
+def parse_date(value):
+    value = (value or '').strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise RowError(f'Некорректная дата "{value}"')
+
+
+def parse_amount(value):
+    # Банковские выписки часто используют запятую и пробелы в суммах
+    text = str(value if value is not None else '').strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise RowError(f'Некорректная сумма "{value}"')
+    if amount != amount.quantize(AMOUNT_QUANT):
+        raise RowError(f'Сумма "{value}" содержит больше двух знаков после запятой')
+    if not AMOUNT_QUANT <= amount <= MAX_AMOUNT:
+        raise RowError(f'Сумма "{value}" вне допустимого диапазона')
+    return amount.quantize(AMOUNT_QUANT)
+
+
+def parse_record(record, lookup):
+    """
+    Проверяет запись с названиями справочников и возвращает кортеж значений
+    в порядке ROW_FIELDS
+    """
+    missing = [field for field in IMPORT_FIELDS[:-1] if not record.get(field)]
+    if missing:
+        raise RowError(f'Не заполнены поля: {", ".join(missing)}')
+
+    status_id, type_id, category_id, subcategory_id = lookup.resolve(
+        str(record['status']).strip(),
+        str(record['transaction_type']).strip(),
+        str(record['category']).strip(),
+        str(record['subcategory']).strip(),
+    )
+    return (
+        parse_date(str(record['date'])),
+        status_id,
+        type_id,
+        category_id,
+        subcategory_id,
+        parse_amount(record['amount']),
+        str(record.get('comment') or '').strip(),
+    )
+
+
+def read_records(stream, file_format, delimiter=','):
+    """Потоково читает файл, выдавая (номер строки, словарь значений)"""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream, delimiter=delimiter)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, RowError(f'Некорректный JSON: {e}')
+                continue
+            yield line_number, record
+    else:
+        # Обычный JSON-массив читается целиком, для больших файлов используйте NDJSON
+        for index, record in enumerate(json.load(stream), start=1):
+            yield index, record
+
+
+def _insert_sql():
+    quote = connection.ops.quote_name
+    meta = Transaction._meta
+    columns = [meta.get_field(field).column for field in ROW_FIELDS + ('created_at', 'updated_at')]
+    return (
+        f'INSERT INTO {quote(meta.db_table)} ({", ".join(quote(column) for column in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))})'
+    )
+
+
+def insert_rows(rows):
+    """
+    Записывает проверенные строки одним подготовленным INSERT (executemany)
+    и обновляет дневные сводки, по INSERT_TRANSACTION_ROWS строк в atomic-блоке.
+
+    bulk_create подготавливает каждое поле каждого объекта через ORM и на SQLite
+    ограничен 999 параметрами на запрос, что даёт лишь несколько тысяч строк в
+    секунду; здесь значения приводятся к типам БД один раз и без моделей, а
+    поисковый индекс пополняется одним запросом на транзакцию (search.insert_indexed).
+    """
+    if not rows:
+        return 0
+
+    ops = connection.ops
+    # Вставка в порядке дат заполняет индексы почти последовательно, а не вразброс
+    rows = sorted(rows, key=itemgetter(0))
+    for start in range(0, len(rows), INSERT_TRANSACTION_ROWS):
+        deltas = {}
+        params = []
+        for row in rows[start:start + INSERT_TRANSACTION_ROWS]:
+            row_date, status_id, type_id, category_id, subcategory_id, amount, comment = row
+            add_delta(deltas, row[:5], amount, 1)
+            params.append((
+                ops.adapt_datefield_value(row_date), status_id, type_id, category_id, subcategory_id,
+                str(amount), comment,
+            ))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Сводки пишутся первыми: apply_deltas всегда пишет версию данных и этим берёт
+            # блокировку БД, и время изменения ставится уже под ней (см. changes.py)
+            apply_deltas(deltas)
+            now = ops.adapt_datetimefield_value(timezone.now())
+            insert_indexed(cursor, _insert_sql(), [values + (now, now) for values in params])
+    return len(rows)
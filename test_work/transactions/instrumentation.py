@@ -0,0 +1,335 @@
+"""
+Замеры запросов: число и время SQL, время представления и шаблонов.
+
+Включается настройкой TRANSACTIONS_INSTRUMENTATION. Выключенный
+InstrumentationMiddleware убирает себя из цепочки при старте
+(MiddlewareNotUsed), поэтому на обработку запросов не влияет.
+Для каждого запроса добавляется заголовок Server-Timing, длительности
+копятся в гистограммах по маршрутам (текст Prometheus), медленные запросы
+и повторяющиеся SQL (N+1) пишутся в лог.
+
+SQL считается обёрткой, которая стоит на каждом соединении любого потока и
+берёт замер текущего запроса из contextvar: так учитываются и запросы из
+sync_to_async, и запросы при выдаче потокового ответа (выгрузки). Для
+потокового ответа Server-Timing отражает время до начала тела, а
+гистограммы и лог пополняются после его выдачи.
+"""
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Списки параметров IN (%s, %s, ...) разной длины - один и тот же запрос
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+_current_profile = ContextVar('transactions_request_profile', default=None)
+
+
+class RequestProfile:
+    """Замеры одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = []
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # SQL одного запроса может идти из нескольких потоков (sync_to_async)
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка execute_wrapper: время каждого SQL-запроса
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.db_time += elapsed
+                self.queries.append((sql, elapsed))
+
+    def duplicates(self, threshold):
+        """Шаблоны SQL, выполненные не меньше threshold раз: [(sql, раз), ...] по убыванию"""
+        counts = {}
+        for sql, _ in self.queries:
+            key = IN_LIST_RE.sub('IN (...)', sql)
+            counts[key] = counts.get(key, 0) + 1
+        repeated = [(sql, count) for sql, count in counts.items() if count >= threshold]
+        return sorted(repeated, key=lambda item: -item[1])
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с метками route и method"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0, 0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for (route, method), (buckets, count, total) in sorted(self.series.items()):
+            labels = f'route="{_escape(route)}",method="{method}"'
+            for bound, value in zip(self.buckets, buckets):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Counter:
+    """Счётчик процесса в формате Prometheus (без меток)"""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+        COUNTERS.append(self)
+
+    def inc(self):
+        with _metrics_lock:
+            self.value += 1
+
+    def render(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter', f'{self.name} {self.value}']
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+_metrics_lock = threading.Lock()
+REQUEST_DURATION = Histogram('dds_request_duration_seconds', 'Время обработки запроса', DURATION_BUCKETS)
+REQUEST_DB_DURATION = Histogram('dds_request_db_seconds', 'Время SQL-запросов за запрос', DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram('dds_request_queries', 'Число SQL-запросов за запрос', QUERY_COUNT_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_DB_DURATION, REQUEST_QUERIES)
+# Счётчики других модулей (например, попадания в кэш списка операций)
+COUNTERS = []
+
+
+def render_metrics():
+    """Все гистограммы и счётчики в текстовом формате Prometheus"""
+    with _metrics_lock:
+        lines = [line for metric in HISTOGRAMS + tuple(COUNTERS) for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _metrics_lock:
+        for histogram in HISTOGRAMS:
+            histogram.series.clear()
+        for counter in COUNTERS:
+            counter.value = 0
+
+
+def _profile_query(execute, sql, params, many, context):
+    """Обёртка соединения: SQL считается в замер текущего запроса, если он есть"""
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _install_on_connection(connection, **kwargs):
+    if _profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_profile_query)
+
+
+_query_timer_installed = False
+
+
+def install_query_timer():
+    """
+    Ставит _profile_query на соединения текущего потока и на каждое новое
+    соединение любого потока (сигнал connection_created) - в том числе потоков
+    sync_to_async и пула, где middleware не выполнялся.
+    """
+    global _query_timer_installed
+    if _query_timer_installed:
+        return
+    connection_created.connect(_install_on_connection, dispatch_uid='transactions_instrumentation')
+    for connection in connections.all():
+        _install_on_connection(connection)
+    _query_timer_installed = True
+
+
+_template_timer_installed = False
+
+
+def install_template_timer():
+    """
+    Время отрисовки шаблонов: оборачивает Template.render бэкенда Django
+    (вызывается один раз для шаблона верхнего уровня, include считаются внутри).
+    Без активного замера обёртка просто вызывает исходный метод.
+    """
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    from django.template.backends.django import Template
+
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return original_render(self, context, request)
+        started = time.perf_counter()
+        db_time = profile.db_time
+        try:
+            return original_render(self, context, request)
+        finally:
+            # SQL ленивых queryset, выполненный при отрисовке, относится к db, а не к tpl
+            elapsed = time.perf_counter() - started
+            profile.template_time += elapsed - (profile.db_time - db_time)
+
+    Template.render = render
+    _template_timer_installed = True
+
+
+def route_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return '/' + match.route if match.route else match.view_name
+
+
+class InstrumentationMiddleware:
+    """
+    Server-Timing (db, tpl, view, total), гистограммы по маршрутам, лог
+    медленных запросов и повторяющихся SQL. Ставится первым в MIDDLEWARE,
+    чтобы total включал остальные middleware.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRANSACTIONS_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'INSTRUMENTATION_SLOW_REQUEST_MS', 500) / 1000
+        self.duplicate_threshold = getattr(settings, 'INSTRUMENTATION_DUPLICATE_QUERY_THRESHOLD', 5)
+        install_query_timer()
+        install_template_timer()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        request.profile = profile
+        token = _current_profile.set(profile)
+        try:
+            # Соединения этого потока могли открыться до включения замеров
+            for connection in connections.all():
+                _install_on_connection(connection)
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        response['Server-Timing'] = self.server_timing(profile)
+        if response.streaming:
+            # SQL ленивых queryset выполняется при выдаче тела, уже после возврата отсюда
+            response.streaming_content = self.profiled_stream(request, response, profile)
+        else:
+            self.record(request, profile)
+        return response
+
+    def server_timing(self, profile):
+        finished = time.perf_counter()
+        total = finished - profile.started
+        view = finished - profile.view_started if profile.view_started is not None else 0.0
+        # Время представления без SQL и шаблонов, которые выполнялись внутри него
+        view_own = max(view - profile.db_time - profile.template_time, 0.0)
+        duplicates = profile.duplicates(self.duplicate_threshold)
+
+        timing = [
+            f'db;dur={profile.db_time * 1000:.1f};desc="{len(profile.queries)} SQL"',
+            f'tpl;dur={profile.template_time * 1000:.1f}',
+            f'view;dur={view_own * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        if duplicates:
+            # Значения заголовков - только latin-1
+            timing.append(f'dup;desc="{sum(count for _, count in duplicates)} duplicate SQL"')
+        return ', '.join(timing)
+
+    def profiled_stream(self, request, response, profile):
+        """
+        Тело потокового ответа, каждая часть которого выдаётся с замером запроса
+        в contextvar; после последней части замер попадает в гистограммы и лог
+        """
+        content = response.streaming_content
+        if response.is_async:
+            async def stream():
+                iterator = aiter(content)
+                try:
+                    while True:
+                        token = _current_profile.set(profile)
+                        try:
+                            chunk = await anext(iterator)
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current_profile.reset(token)
+                        yield chunk
+                finally:
+                    self.record(request, profile)
+            return stream()
+
+        def stream():
+            iterator = iter(content)
+            try:
+                while True:
+                    token = _current_profile.set(profile)
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        break
+                    finally:
+                        _current_profile.reset(token)
+                    yield chunk
+            finally:
+                self.record(request, profile)
+        return stream()
+
+    def record(self, request, profile):
+        """Замер запроса - в гистограммы; медленные запросы и N+1 - в лог"""
+        total = time.perf_counter() - profile.started
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        labels = (route_label(request), request.method)
+        with _metrics_lock:
+            REQUEST_DURATION.observe(labels, total)
+            REQUEST_DB_DURATION.observe(labels, profile.db_time)
+            REQUEST_QUERIES.observe(labels, len(profile.queries))
+
+        if duplicates:
+            logger.warning(
+                'Повторяющиеся SQL (возможен N+1) в %s %s:\n%s', request.method, request.path,
+                '\n'.join(f'  {count} x {sql}' for sql, count in duplicates),
+            )
+        if total >= self.slow_seconds:
+            logger.warning(
+                'Медленный запрос %s %s: %.0f мс, SQL %d за %.0f мс\n%s', request.method, request.path,
+                total * 1000, len(profile.queries), profile.db_time * 1000,
+                '\n'.join(f'  {elapsed * 1000:.1f} мс: {sql}' for sql, elapsed in profile.queries),
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile.view_started = time.perf_counter()
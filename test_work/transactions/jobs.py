@@ -0,0 +1,196 @@
+"""
+Фоновые задачи без внешнего брокера: очередь - таблица Job в той же БД.
+
+Представления и команды ставят задачу через enqueue и сразу отвечают её
+номером, а run_worker забирает задачи из очереди и выполняет их в пуле
+потоков. Задача захватывается условным UPDATE (status = 'queued'), поэтому
+одну задачу не возьмут два обработчика, в том числе из разных процессов.
+
+Упавшая задача повторяется с удвоением паузы, пока не кончатся попытки.
+Пока задача выполняется, run_worker раз в цикл отмечает heartbeat_at; задача
+без отметки дольше JOB_STALE_AFTER (процесс обработчика убит) возвращается
+в очередь. Итоги задачи (прогресс, файл, состояние) записываются только пока
+она числится за этим обработчиком: задачу, которую вернули в очередь и отдали
+другому, прежний обработчик уже не меняет.
+
+Завершённые задачи старше JOB_KEEP_FINISHED run_worker удаляет вместе с
+файлами результатов.
+"""
+import logging
+import tempfile
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db.models import F
+from django.utils import timezone
+
+from .export import EXPORT_FORMATS, export_stream, export_values, gzip_stream
+from .forms import TransactionFilterForm
+from .models import Job
+from .rollups import rebuild_rollups
+from .search import rebuild_search_index
+
+# Пауза перед повтором после первой ошибки (секунды), дальше удваивается
+JOB_RETRY_DELAY = 30
+# Через сколько секунд без отметки обработчика выполняемая задача считается брошенной
+JOB_STALE_AFTER = 600
+# Сколько секунд хранить завершённые задачи и их файлы результатов
+JOB_KEEP_FINISHED = 7 * 24 * 3600
+
+HANDLERS = {}
+logger = logging.getLogger(__name__)
+
+
+def handler(kind):
+    """Регистрирует функцию handler(job, **params) для задач вида kind"""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, **params):
+    if kind not in HANDLERS:
+        raise ValueError(f'Неизвестный вид задачи: {kind}')
+    return Job.objects.create(kind=kind, params=params)
+
+
+def _owned(job):
+    """Задача, пока она выполняется этим обработчиком (пустой queryset, если её передали другому)"""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker)
+
+
+def report_progress(job, progress, total=None):
+    """Отмечает шаг задачи: выполнено progress из total (total=None - не менять)"""
+    job.progress = progress
+    job.heartbeat_at = timezone.now()
+    fields = {'progress': progress, 'heartbeat_at': job.heartbeat_at}
+    if total is not None:
+        job.total = fields['total'] = total
+    _owned(job).update(**fields)
+
+
+def store_result(job, filename, chunks):
+    """Записывает поток байтов в файл результата задачи (хранилище по умолчанию, MEDIA_ROOT)"""
+    if job.result:
+        # Файл предыдущей неудачной попытки
+        job.result.delete(save=False)
+    with tempfile.TemporaryFile() as buffer:
+        for chunk in chunks:
+            buffer.write(chunk)
+        buffer.seek(0)
+        job.result.save(filename, File(buffer), save=False)
+    if not _owned(job).update(result=job.result.name):
+        # Задачу уже выполняет другой обработчик: файл этой попытки никому не нужен
+        job.result.delete(save=False)
+
+
+def claim_next(worker):
+    """Захватывает самую раннюю готовую к запуску задачу или возвращает None"""
+    while True:
+        now = timezone.now()
+        pk = Job.objects.filter(
+            status=Job.QUEUED, run_after__lte=now
+        ).order_by('run_after', 'id').values_list('id', flat=True).first()
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+        # Задачу успел захватить другой обработчик - берём следующую
+
+
+def _retry_or_fail(job, error):
+    retry_delay = getattr(settings, 'TRANSACTIONS_JOB_RETRY_DELAY', JOB_RETRY_DELAY)
+    if job.attempts < job.max_attempts:
+        delay = retry_delay * 2 ** (job.attempts - 1)
+        changes = {'status': Job.QUEUED, 'run_after': timezone.now() + timedelta(seconds=delay)}
+    else:
+        changes = {'status': Job.FAILED, 'finished_at': timezone.now()}
+    return _owned(job).update(error=error, **changes)
+
+
+def run_job(job):
+    """
+    Выполняет захваченную задачу и записывает итог; исключения не выпускает.
+    Возвращает False, если итог не записан: задачу за время выполнения
+    вернули в очередь (обработчик долго не отмечался) и её ведёт другой.
+    """
+    try:
+        HANDLERS[job.kind](job, **job.params)
+    except Exception:
+        recorded = _retry_or_fail(job, traceback.format_exc())
+    else:
+        recorded = _owned(job).update(status=Job.DONE, error='', finished_at=timezone.now())
+    if not recorded:
+        logger.warning('Итог задачи %s отброшен: она больше не числится за обработчиком %s', job, job.worker)
+    return bool(recorded)
+
+
+def heartbeat(worker, pks):
+    """Отметка обработчика worker для выполняемых им задач; переданные другому не продлеваются"""
+    if pks:
+        Job.objects.filter(pk__in=pks, status=Job.RUNNING, worker=worker).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale():
+    """Возвращает в очередь (или завершает ошибкой) задачи брошенных обработчиков"""
+    stale_after = getattr(settings, 'TRANSACTIONS_JOB_STALE_AFTER', JOB_STALE_AFTER)
+    stale = Job.objects.filter(
+        status=Job.RUNNING, heartbeat_at__lt=timezone.now() - timedelta(seconds=stale_after)
+    )
+    for job in stale:
+        _retry_or_fail(job, f'Обработчик {job.worker} не отвечал дольше {stale_after} с')
+    return len(stale)
+
+
+def purge_finished():
+    """Удаляет завершённые задачи старше JOB_KEEP_FINISHED вместе с файлами результатов"""
+    keep = getattr(settings, 'TRANSACTIONS_JOB_KEEP_FINISHED', JOB_KEEP_FINISHED)
+    finished = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], finished_at__lt=timezone.now() - timedelta(seconds=keep)
+    )
+    jobs = list(finished.only('id', 'result'))
+    for job in jobs:
+        if job.result:
+            job.result.delete(save=False)
+    Job.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+    return len(jobs)
+
+
+@handler('export')
+def export_job(job, filters, export_format='csv', gzip=False):
+    """Выгрузка как transaction_export, но в файл результата"""
+    filter_form = TransactionFilterForm(filters)
+    transactions = filter_form.filter_queryset(filter_form.source_model().objects.all())
+    report_progress(job, 0, transactions.count())
+
+    done = 0
+
+    def on_batch(size):
+        nonlocal done
+        done += size
+        report_progress(job, done)
+
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    filename = f'transactions.{export_format}'
+    stream = export_stream(export_values(transactions), export_format, on_batch=on_batch)
+    if gzip:
+        stream = gzip_stream(stream)
+        filename += '.gz'
+    store_result(job, filename, stream)
+
+
+@handler('rebuild_rollups')
+def rebuild_rollups_job(job):
+    rebuild_rollups()
+
+
+@handler('rebuild_search_index')
+def rebuild_search_index_job(job):
+    rebuild_search_index()
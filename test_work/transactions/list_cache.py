@@ -0,0 +1,128 @@
+"""
+Кэш отрисованной таблицы списка операций.
+
+Ключ - нормализованные фильтры, курсор страницы, версия данных операций и
+версия справочников. Версию данных меняет каждая запись операций (все пути
+записи проходят через rollups.apply_deltas), поэтому старые страницы не
+удаляются, а просто перестают находиться и вытесняются по времени.
+Повторный просмотр страницы не обращается к таблице операций.
+
+Версии хранятся в БД (CacheVersion) и меняются в транзакции записи, поэтому
+запись из команды, архивации или run_worker видят все процессы. Страницы
+лежат в кэше default; с локальным кэшем у каждого процесса свои страницы.
+Ссылки пагинации внутри страницы строятся из нормализованных фильтров, а не
+из строки запроса: страница общая для всех запросов с тем же ключом.
+"""
+import hashlib
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import QueryDict
+
+from .dictionary_cache import get_tree
+from .instrumentation import Counter
+from .models import CacheVersion
+
+DATA_VERSION_NAME = 'transactions'
+PAGE_KEY_PREFIX = 'transactions:list_page:'
+
+LIST_CACHE_HITS = Counter('dds_list_cache_hits_total', 'Страницы списка операций из кэша')
+LIST_CACHE_MISSES = Counter('dds_list_cache_misses_total', 'Страницы списка операций, отрисованные заново')
+
+
+def bump_data_version():
+    """Помечает страницы всех процессов устаревшими; версия пишется в транзакции записи операций"""
+    CacheVersion.objects.update_or_create(name=DATA_VERSION_NAME, defaults={'token': uuid.uuid4().hex})
+
+
+def data_version():
+    """Версия данных операций из БД (одна выборка по первичному ключу)"""
+    return CacheVersion.objects.filter(name=DATA_VERSION_NAME).values_list('token', flat=True).first() or ''
+
+
+def cache_timeout():
+    return getattr(settings, 'TRANSACTION_LIST_CACHE_TIMEOUT', 300)
+
+
+def normalized_filters(filter_form):
+    """Фильтры формы в каноническом виде (None, если форма с ошибками - такие страницы не кэшируются)"""
+    if not filter_form.is_valid():
+        return None
+    filters = {}
+    for name, value in filter_form.cleaned_data.items():
+        if value in (None, ''):
+            continue
+        if hasattr(value, 'pk'):
+            value = value.pk
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif isinstance(value, str):
+            value = ' '.join(value.split())
+        filters[name] = value
+    return filters
+
+
+def filters_query(filters):
+    """
+    Строка запроса для ссылок пагинации из нормализованных фильтров (QueryDict
+    для {% querystring %}); None - фильтров нет, ссылки строятся из request.GET.
+    """
+    if filters is None:
+        return None
+    query = QueryDict(mutable=True)
+    for name, value in filters.items():
+        query[name] = str(value)
+    return query
+
+
+def page_key(filters, cursor, versions):
+    raw = json.dumps([versions, filters, cursor or ''], sort_keys=True, ensure_ascii=False)
+    return PAGE_KEY_PREFIX + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _versions():
+    return [data_version(), get_tree().version]
+
+
+async def _aversions():
+    return await sync_to_async(_versions)()
+
+
+def cached_table(filter_form, cursor, render_table):
+    """HTML таблицы страницы из кэша или render_table() с сохранением в кэш"""
+    filters = normalized_filters(filter_form)
+    if not cache_timeout() or filters is None:
+        return render_table()
+    key = page_key(filters, cursor, _versions())
+    table = cache.get(key)
+    if table is not None:
+        LIST_CACHE_HITS.inc()
+        return table
+    LIST_CACHE_MISSES.inc()
+    table = render_table()
+    cache.set(key, table, timeout=cache_timeout())
+    return table
+
+
+async def acached_table(filter_form, cursor, render_table):
+    """cached_table для асинхронного представления; render_table - корутина"""
+    filters = normalized_filters(filter_form)
+    if not cache_timeout() or filters is None:
+        return await render_table()
+    key = page_key(filters, cursor, await _aversions())
+    table = await cache.aget(key)
+    if table is not None:
+        LIST_CACHE_HITS.inc()
+        return table
+    LIST_CACHE_MISSES.inc()
+    table = await render_table()
+    await cache.aset(key, table, timeout=cache_timeout())
+    return table
+
+
+def stats():
+    """Попадания и промахи кэша в этом процессе"""
+    return {'hits': LIST_CACHE_HITS.value, 'misses': LIST_CACHE_MISSES.value}
@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from transactions.archive import ARCHIVE_BATCH_SIZE, archive_rows
+from transactions.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Перенести операции закрытых периодов (раньше --before) в архивную таблицу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Дата YYYY-MM-DD: архивируются операции раньше неё')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE,
+                            help='Операций в одной транзакции БД')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать операции, ничего не переносить')
+
+    def handle(self, *args, **options):
+        try:
+            before = date.fromisoformat(options['before'])
+        except ValueError:
+            raise CommandError('Дата --before должна быть в формате YYYY-MM-DD')
+        if before > timezone.localdate():
+            raise CommandError('Архивировать можно только прошедшие периоды')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+
+        if options['dry_run']:
+            count = Transaction.objects.filter(date__lt=before).count()
+            self.stdout.write(f'Будет перенесено в архив операций: {count}')
+            return
+        moved = archive_rows(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив операций: {moved}'))
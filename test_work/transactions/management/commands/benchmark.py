@@ -0,0 +1,377 @@
+import io
+import itertools
+import json
+import platform
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Max, Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from transactions.forms import TransactionFilterForm
+from transactions.importing import insert_rows
+from transactions.instrumentation import RequestProfile
+from transactions.management.commands.benchmark_asgi import percentile
+from transactions.models import DailyRollup, Subcategory, Transaction
+from transactions.pagination import KeysetPaginator
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+FILTERS = ('date', 'status', 'transaction_type', 'category', 'subcategory')
+SIZE_RE = re.compile(r'^(\d+)([kKmM]?)$')
+SIZE_SUFFIXES = {'': 1, 'k': 1000, 'm': 1000000}
+# Последний день сгенерированных операций: один и тот же набор при каждом запуске
+END_DATE = date(2025, 12, 31)
+
+
+def parse_sizes(value):
+    """'10k,1M' -> [10000, 1000000]"""
+    sizes = []
+    for part in value.split(','):
+        match = SIZE_RE.match(part.strip())
+        if not match:
+            raise CommandError(f'Некорректный размер "{part}", пример: 10k,1M,10M')
+        sizes.append(int(match.group(1)) * SIZE_SUFFIXES[match.group(2).lower()])
+    return sorted(set(sizes))
+
+
+@contextmanager
+def throwaway_database(db_dir=None):
+    """
+    Временная база вместо рабочей на время блока (как у тестов), затем удаляется.
+    SQLite - файл, а не база в памяти: 10M строк не помещаются в память, а замеры
+    должны включать диск. Псевдонимы с TEST MIRROR смотрят во временную базу.
+    """
+    temp_dir = None
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    original_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and not original_test_name:
+        temp_dir = tempfile.mkdtemp(dir=db_dir)
+        test_settings['NAME'] = str(Path(temp_dir) / 'benchmark.sqlite3')
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    mirrors = {}
+    for alias in connections:
+        if connections[alias].settings_dict.get('TEST', {}).get('MIRROR') == DEFAULT_DB_ALIAS:
+            mirrors[alias] = connections[alias].settings_dict['NAME']
+            connections[alias].close()
+            connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        # Кэш справочников и версий относится к рабочей базе
+        cache.clear()
+        yield
+    finally:
+        for alias, name in mirrors.items():
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = original_test_name
+        cache.clear()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class Scenario:
+    """
+    Измеряемый запрос. prepare(i) возвращает (method, path, data) для i-го
+    повтора и может готовить данные (например, запись для удаления) - это
+    время в замер не входит.
+    """
+
+    def __init__(self, name, prepare, expected_status=200):
+        self.name = name
+        self.prepare = prepare
+        self.expected_status = expected_status
+
+
+def request(client, method, path, data):
+    if method == 'post':
+        return client.post(path, data)
+    return client.get(path, data)
+
+
+def measure(client, scenario, repeat, warmup=2):
+    """
+    Прогрев, затем один запрос с подсчётом SQL, один под tracemalloc (пик
+    памяти Python) и repeat запросов для перцентилей; замеры не смешиваются,
+    чтобы учёт запросов и памяти не искажал время.
+    """
+    counter = itertools.count()
+
+    def run():
+        method, path, data = scenario.prepare(next(counter))
+        started = time.perf_counter()
+        response = request(client, method, path, data)
+        return response, time.perf_counter() - started
+
+    errors = 0
+    for _ in range(warmup):
+        run()
+
+    # Счёт через execute_wrapper: queries_log при DEBUG очищается в начале каждого запроса
+    queries = RequestProfile()
+    with connection.execute_wrapper(queries):
+        response, _ = run()
+    errors += response.status_code != scenario.expected_status
+
+    tracemalloc.start()
+    try:
+        response, _ = run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    errors += response.status_code != scenario.expected_status
+
+    latencies = []
+    for _ in range(repeat):
+        response, elapsed = run()
+        latencies.append(elapsed)
+        errors += response.status_code != scenario.expected_status
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'queries': len(queries.queries),
+        'peak_kib': round(peak / 1024, 1),
+        'errors': errors,
+    }
+
+
+def probe_values():
+    """Значения фильтров, по которым гарантированно есть операции: самая частая подкатегория и статус"""
+    top = DailyRollup.objects.values(
+        'transaction_type_id', 'category_id', 'subcategory_id'
+    ).annotate(rows=Sum('count')).order_by('-rows').first()
+    status = DailyRollup.objects.values('status_id').annotate(rows=Sum('count')).order_by('-rows').first()
+    last_date = DailyRollup.objects.aggregate(value=Max('date'))['value']
+    if top is None or status is None:
+        raise CommandError('Нет операций для замеров')
+    return {
+        'date_from': (last_date - timedelta(days=90)).isoformat(),
+        'date_to': last_date.isoformat(),
+        'status': status['status_id'],
+        'transaction_type': top['transaction_type_id'],
+        'category': top['category_id'],
+        'subcategory': top['subcategory_id'],
+    }
+
+
+def filter_params(probe, combination):
+    params = {}
+    for name in combination:
+        if name == 'date':
+            params['date_from'] = probe['date_from']
+            params['date_to'] = probe['date_to']
+        else:
+            params[name] = probe[name]
+    return params
+
+
+def deep_cursor(params, offset):
+    """Курсор страницы, начинающейся после offset строк списка с фильтрами params"""
+    queryset = TransactionFilterForm(params).filter_queryset(Transaction.objects.only('date', 'created_at'))
+    row = queryset[offset:offset + 1].first()
+    return KeysetPaginator.encode_cursor(row) if row is not None else None
+
+
+def build_scenarios(options):
+    probe = probe_values()
+    list_url = reverse('transaction_list')
+    scenarios = []
+
+    for size in range(len(FILTERS) + 1):
+        for combination in itertools.combinations(FILTERS, size):
+            params = filter_params(probe, combination)
+            label = ','.join(combination) or 'all'
+            scenarios.append(Scenario(f'list_first[{label}]', lambda i, p=params: ('get', list_url, p)))
+            cursor = deep_cursor(params, options['deep_offset'])
+            if cursor is not None:
+                deep = dict(params, cursor=cursor)
+                scenarios.append(Scenario(f'list_deep[{label}]', lambda i, p=deep: ('get', list_url, p)))
+
+    form_data = {
+        'date': probe['date_to'],
+        'status': probe['status'],
+        'transaction_type': probe['transaction_type'],
+        'category': probe['category'],
+        'subcategory': probe['subcategory'],
+        'comment': 'Замер производительности',
+    }
+    edited = Transaction.objects.filter(subcategory_id=probe['subcategory']).order_by('id').values_list(
+        'id', flat=True
+    ).first()
+    scenarios += [
+        Scenario('create_post', lambda i: ('post', reverse('transaction_create'), dict(form_data, amount='100.00')),
+                 expected_status=302),
+        Scenario('edit_post', lambda i: ('post', reverse('transaction_edit', args=[edited]),
+                                         dict(form_data, amount=f'{100 + i % 50}.00')), expected_status=302),
+        Scenario('ajax_load_categories', lambda i: (
+            'get', reverse('ajax_load_categories'), {'transaction_type': probe['transaction_type']})),
+        Scenario('ajax_load_subcategories', lambda i: (
+            'get', reverse('ajax_load_subcategories'), {'category': probe['category']})),
+        Scenario('dictionaries', lambda i: ('get', reverse('dictionaries'), {})),
+        Scenario('subcategory_delete', lambda i: delete_request(probe, options['delete_rows'], i),
+                 expected_status=302),
+    ]
+
+    if options['only']:
+        pattern = re.compile(options['only'])
+        scenarios = [scenario for scenario in scenarios if pattern.search(scenario.name)]
+    return scenarios
+
+
+def delete_request(probe, rows, iteration):
+    """Новая подкатегория с rows операциями и запрос на её удаление"""
+    subcategory = Subcategory.objects.create(name=f'Замер удаления {iteration}', category_id=probe['category'])
+    day = date.fromisoformat(probe['date_to'])
+    insert_rows([
+        (day, probe['status'], probe['transaction_type'], probe['category'], subcategory.pk, Decimal('1.00'), '')
+        for _ in range(rows)
+    ])
+    return 'post', reverse('delete_subcategory', args=[subcategory.pk]), {}
+
+
+def compare_results(baseline, current, tolerance=0.2, min_ms=1.0):
+    """
+    Регрессии current относительно baseline: медиана выросла больше чем на
+    tolerance (и больше чем на min_ms - шум быстрых запросов) или выросло
+    число SQL-запросов. Сравниваются только размеры и сценарии из обоих замеров.
+    """
+    regressions = []
+    for size, result in current['sizes'].items():
+        base_result = baseline.get('sizes', {}).get(size)
+        if base_result is None:
+            continue
+        for name, row in result['scenarios'].items():
+            base = base_result['scenarios'].get(name)
+            if base is None:
+                continue
+            if row['p50_ms'] > base['p50_ms'] * (1 + tolerance) and row['p50_ms'] - base['p50_ms'] > min_ms:
+                regressions.append(f'{size} {name}: p50 {base["p50_ms"]} -> {row["p50_ms"]} мс')
+            if row['queries'] > base['queries']:
+                regressions.append(f'{size} {name}: SQL {base["queries"]} -> {row["queries"]}')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Воспроизводимые замеры основных страниц на временной базе заданного размера: '
+            'перцентили времени, число SQL и пик памяти в JSON, сравнение с сохранённым замером')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10k', help='Размеры базы через запятую (10k,1M,10M)')
+        parser.add_argument('--repeat', type=int, default=20, help='Замеров на сценарий')
+        parser.add_argument('--seed', type=int, default=1, help='Зерно генератора операций')
+        parser.add_argument('--days', type=int, default=3 * 365, help='Глубина периода операций в днях')
+        parser.add_argument('--deep-offset', type=int, default=2000, help='Строк до "глубокой" страницы списка')
+        parser.add_argument('--delete-rows', type=int, default=100, help='Операций у удаляемой подкатегории')
+        parser.add_argument('--only', help='Регулярное выражение по названию сценария')
+        parser.add_argument('--db-dir', help='Каталог для временной базы SQLite (по умолчанию системный temp)')
+        parser.add_argument('--output', help='Сохранить результат в JSON-файл')
+        parser.add_argument('--input', help='Не замерять, а взять результат из JSON-файла')
+        parser.add_argument('--baseline', help='JSON-файл прошлого замера для поиска регрессий')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост медианы (0.2 = 20%%)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть положительным')
+
+        if options['input']:
+            results = self.read_json(options['input'])
+        else:
+            results = self.run(parse_sizes(options['sizes']), options)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False))
+        else:
+            self.print_table(results)
+
+        if options['baseline']:
+            regressions = compare_results(self.read_json(options['baseline']), results, options['tolerance'])
+            for line in regressions:
+                self.stderr.write(self.style.ERROR(f'Регрессия: {line}'))
+            if regressions:
+                raise CommandError(f'Найдено регрессий: {len(regressions)}')
+            self.stderr.write(self.style.SUCCESS('Регрессий относительно базового замера нет'))
+
+    @staticmethod
+    def read_json(path):
+        try:
+            return json.loads(Path(path).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+    def run(self, sizes, options):
+        results = {
+            'meta': {
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'days': options['days'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'sizes': {},
+        }
+        with throwaway_database(options['db_dir']):
+            call_command('load_initial_data', verbosity=0, stdout=io.StringIO())
+            client = Client()
+            seeded = 0
+            # Замеряется отрисовка страниц, а не попадания в кэш списка
+            with override_settings(ALLOWED_HOSTS=['testserver'], TRANSACTION_LIST_CACHE_TIMEOUT=0):
+                for size in sizes:
+                    started = time.perf_counter()
+                    call_command(
+                        'load_test_transactions', count=size - seeded, seed=options['seed'] + size,
+                        days=options['days'], end_date=END_DATE, stdout=io.StringIO(),
+                    )
+                    seeded = size
+                    seed_seconds = time.perf_counter() - started
+                    rows = Transaction.objects.count()
+
+                    scenarios = {}
+                    for scenario in build_scenarios(options):
+                        scenarios[scenario.name] = measure(client, scenario, options['repeat'])
+                        if not options['json']:
+                            self.stderr.write(f'{size}: {scenario.name} {scenarios[scenario.name]["p50_ms"]} мс')
+                    results['sizes'][str(size)] = {
+                        'rows': rows,
+                        'seed_seconds': round(seed_seconds, 1),
+                        'scenarios': scenarios,
+                    }
+
+        if resource is not None:
+            # ru_maxrss в Linux - КиБ
+            results['meta']['max_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return results
+
+    def print_table(self, results):
+        for size, result in results['sizes'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{size} строк (загрузка {result["seed_seconds"]} с):'))
+            for name, row in result['scenarios'].items():
+                self.stdout.write(
+                    f'  {name:<55} p50 {row["p50_ms"]:>9} мс  p90 {row["p90_ms"]:>9} мс  '
+                    f'p99 {row["p99_ms"]:>9} мс  SQL {row["queries"]:>3}  '
+                    f'память {row["peak_kib"]:>8} КиБ  ошибок {row["errors"]}'
+                )
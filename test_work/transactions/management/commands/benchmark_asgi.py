@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from transactions.models import Status, TransactionType, Category
+
+MODES = ('sync', 'async', 'both')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def call_asgi(app, path):
+    """Один GET-запрос к ASGI-приложению внутри процесса; возвращает (статус, секунды)"""
+    url = urlsplit(path)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url.path,
+        'raw_path': url.path.encode(),
+        'root_path': '',
+        'query_string': url.query.encode(),
+        'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    request_sent = False
+    disconnect = asyncio.Event()
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - started
+    disconnect.set()
+    return status, elapsed
+
+
+async def run_load(app, path, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            status, elapsed = await call_asgi(app, path)
+            latencies.append(elapsed)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return {
+        'path': path,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест читающих представлений через ASGI-приложение: '
+            'запросы в секунду и p99 для синхронного и асинхронного вариантов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES, default='both',
+                            help='Какие представления проверять (both - оба варианта в отдельных процессах)')
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждый адрес')
+        parser.add_argument('--concurrency', type=int, default=100, help='Одновременных запросов')
+        parser.add_argument('--path', action='append', help='Адрес для проверки (можно несколько раз)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests и --concurrency должны быть положительными')
+
+        if options['mode'] == 'both':
+            results = {mode: self.run_subprocess(mode, options) for mode in ('sync', 'async')}
+        else:
+            expected = options['mode'] == 'async'
+            if settings.TRANSACTIONS_ASYNC_VIEWS != expected:
+                raise CommandError(f'Для --mode {options["mode"]} задайте TRANSACTIONS_ASYNC_VIEWS='
+                                   f'{int(expected)} в окружении')
+            results = {options['mode']: self.run_mode(options)}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False))
+            return
+        for mode, rows in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{mode}:'))
+            for row in rows:
+                self.stdout.write(
+                    f'  {row["path"]:<60} {row["rps"]:>9} req/s  p50 {row["p50_ms"]:>8} мс  '
+                    f'p99 {row["p99_ms"]:>8} мс  ошибок {row["errors"]}'
+                )
+
+    def default_paths(self):
+        paths = ['/transactions/', '/transactions/report/']
+        status_id = Status.objects.values_list('id', flat=True).first()
+        type_id = TransactionType.objects.values_list('id', flat=True).first()
+        category_id = Category.objects.values_list('id', flat=True).first()
+        if status_id:
+            paths.append(f'/transactions/?status={status_id}')
+        if type_id:
+            paths.append(f'/transactions/ajax/load-categories/?transaction_type={type_id}')
+        if category_id:
+            paths.append(f'/transactions/ajax/load-subcategories/?category={category_id}')
+        return paths
+
+    def run_mode(self, options):
+        paths = options['path'] or self.default_paths()
+        app = get_asgi_application()
+
+        async def main():
+            results = []
+            for path in paths:
+                # Прогрев: снимок справочников, соединение с БД, шаблоны
+                await run_load(app, path, min(options['concurrency'], 20), 1)
+                results.append(await run_load(app, path, options['requests'], options['concurrency']))
+            return results
+
+        return asyncio.run(main())
+
+    def run_subprocess(self, mode, options):
+        # Вариант представлений выбирается при загрузке urls, поэтому каждый режим - отдельный процесс
+        command = [
+            sys.executable, sys.argv[0], 'benchmark_asgi', '--mode', mode, '--json',
+            '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+        ]
+        for path in options['path'] or []:
+            command += ['--path', path]
+        env = dict(os.environ, TRANSACTIONS_ASYNC_VIEWS='1' if mode == 'async' else '0')
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        if output.returncode:
+            raise CommandError(output.stderr)
+        return json.loads(output.stdout)[mode]
@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from transactions.management.commands.benchmark import END_DATE, probe_values, throwaway_database
+from transactions.management.commands.benchmark_asgi import percentile
+
+PROFILES = ('default', 'production', 'both')
+
+
+def worker(kind, deadline, prepare, expected_status, stats, lock):
+    """Запросы одного потока до deadline; исключения (database is locked) считаются ошибками"""
+    client = Client()
+    latencies = []
+    errors = {}
+    iteration = 0
+    try:
+        while time.perf_counter() < deadline:
+            method, path, data = prepare(iteration)
+            iteration += 1
+            started = time.perf_counter()
+            try:
+                response = client.post(path, data) if method == 'post' else client.get(path, data)
+                error = None if response.status_code == expected_status else f'HTTP {response.status_code}'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            if error is None:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors[error] = errors.get(error, 0) + 1
+    finally:
+        connections.close_all()
+    with lock:
+        stats[kind]['latencies'] += latencies
+        for error, count in errors.items():
+            stats[kind]['errors'][error] = stats[kind]['errors'].get(error, 0) + count
+
+
+def run_mixed(readers, writers, seconds):
+    """Читатели открывают список операций и отчёт, писатели создают операции через форму"""
+    probe = probe_values()
+    read_paths = [reverse('transaction_list'), reverse('cash_flow_report')]
+    form_data = {
+        'date': probe['date_to'],
+        'status': probe['status'],
+        'transaction_type': probe['transaction_type'],
+        'category': probe['category'],
+        'subcategory': probe['subcategory'],
+        'amount': '100.00',
+        'comment': 'Замер конкурентной записи',
+    }
+
+    def read(iteration):
+        return 'get', read_paths[iteration % len(read_paths)], {}
+
+    def write(iteration):
+        return 'post', reverse('transaction_create'), form_data
+
+    stats = {kind: {'latencies': [], 'errors': {}} for kind in ('read', 'write')}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=worker, args=('read', deadline, read, 200, stats, lock)) for _ in range(readers)
+    ] + [
+        threading.Thread(target=worker, args=('write', deadline, write, 302, stats, lock)) for _ in range(writers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    result = {}
+    for kind, data in stats.items():
+        latencies = data['latencies']
+        result[kind] = {
+            'ok': len(latencies),
+            'per_second': round(len(latencies) / wall, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'errors': data['errors'],
+        }
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность SQLite при одновременных читателях и писателях: '
+            'обычные настройки против профиля SQLITE_PRODUCTION на временной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=PROFILES, default='both',
+                            help='Какой профиль проверять (both - оба в отдельных процессах)')
+        parser.add_argument('--readers', type=int, default=4, help='Потоков чтения')
+        parser.add_argument('--writers', type=int, default=2, help='Потоков записи')
+        parser.add_argument('--seconds', type=float, default=10, help='Длительность замера')
+        parser.add_argument('--rows', type=int, default=10000, help='Операций во временной базе')
+        parser.add_argument('--db-dir', help='Каталог для временной базы SQLite (по умолчанию системный temp)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if options['readers'] < 0 or options['writers'] < 0 or options['readers'] + options['writers'] < 1:
+            raise CommandError('Нужен хотя бы один поток чтения или записи')
+
+        if options['profile'] == 'both':
+            results = {profile: self.run_subprocess(profile, options) for profile in ('default', 'production')}
+        else:
+            expected = options['profile'] == 'production'
+            if settings.SQLITE_PRODUCTION != expected:
+                raise CommandError(f'Для --profile {options["profile"]} задайте SQLITE_PRODUCTION='
+                                   f'{int(expected)} в окружении')
+            results = {options['profile']: self.run_profile(options)}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, ensure_ascii=False))
+            return
+        for profile, result in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{profile}:'))
+            for kind, row in result.items():
+                errors = sum(row['errors'].values())
+                self.stdout.write(
+                    f'  {kind:<6} {row["per_second"]:>8} в секунду  p50 {row["p50_ms"]:>8} мс  '
+                    f'p99 {row["p99_ms"]:>8} мс  ошибок {errors}'
+                )
+                for error, count in row['errors'].items():
+                    self.stdout.write(f'         {count} x {error}')
+
+    def run_profile(self, options):
+        with throwaway_database(options['db_dir']):
+            call_command('load_initial_data', verbosity=0, stdout=io.StringIO())
+            call_command('load_test_transactions', count=options['rows'], seed=1, days=365,
+                         end_date=END_DATE, stdout=io.StringIO())
+            # Потоки открывают свои соединения
+            connections.close_all()
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                return run_mixed(options['readers'], options['writers'], options['seconds'])
+
+    def run_subprocess(self, profile, options):
+        # Псевдонимы и параметры соединений читаются из settings при запуске, поэтому профиль - отдельный процесс
+        command = [
+            sys.executable, sys.argv[0], 'benchmark_sqlite', '--profile', profile, '--json',
+            '--readers', str(options['readers']), '--writers', str(options['writers']),
+            '--seconds', str(options['seconds']), '--rows', str(options['rows']),
+        ]
+        if options['db_dir']:
+            command += ['--db-dir', options['db_dir']]
+        env = dict(os.environ, SQLITE_PRODUCTION='1' if profile == 'production' else '0')
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        if output.returncode:
+            raise CommandError(output.stderr)
+        return json.loads(output.stdout)[profile]
@@ -0,0 +1,100 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from transactions.importing import (
+    INSERT_TRANSACTION_ROWS, DictionaryLookup, RowError, insert_rows, parse_record, read_records,
+)
+
+FILE_FORMATS = ('csv', 'ndjson', 'json')
+
+
+class Command(BaseCommand):
+    help = 'Импортировать операции из CSV/NDJSON/JSON файла (выписки банка, выгрузки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу')
+        parser.add_argument('--format', choices=FILE_FORMATS, help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--delimiter', default=',', help='Разделитель CSV')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Кодировка файла')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help=f'Строк в пачке разбора; в БД пишется по {INSERT_TRANSACTION_ROWS} строк в транзакции')
+        parser.add_argument('--errors', help='Файл CSV для отчёта об ошибках по строкам')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывать')
+        parser.add_argument('--cache-mb', type=int, default=256, help='Размер кэша страниц SQLite на время импорта')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in FILE_FORMATS:
+            raise CommandError('Не удалось определить формат файла, укажите --format')
+
+        if connection.vendor == 'sqlite':
+            # Индексы таблицы операций не помещаются в стандартный кэш в 2 МБ
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA cache_size = -{options["cache_mb"] * 1024}')
+
+        lookup = DictionaryLookup.load()
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+
+        error_file = error_writer = None
+        if options['errors']:
+            error_file = open(options['errors'], 'w', newline='', encoding='utf-8')
+            error_writer = csv.writer(error_file)
+            error_writer.writerow(['line', 'error', 'data'])
+
+        imported = failed = 0
+        chunk = []
+        started = time.perf_counter()
+        try:
+            with open(path, encoding=options['encoding'], newline='') as stream:
+                for line_number, record in read_records(stream, file_format, options['delimiter']):
+                    try:
+                        if isinstance(record, RowError):
+                            raise record
+                        if not isinstance(record, dict):
+                            raise RowError('Запись должна быть объектом')
+                        chunk.append(parse_record(record, lookup))
+                    except RowError as e:
+                        failed += 1
+                        self.report_error(error_writer, line_number, e, record, failed)
+                        continue
+
+                    if len(chunk) >= chunk_size:
+                        imported += self.flush(chunk, dry_run)
+                        chunk = []
+                imported += self.flush(chunk, dry_run)
+        except json.JSONDecodeError as e:
+            # JSON-массив разбирается целиком до первой строки, поэтому ничего не записано
+            raise CommandError(f'Некорректный JSON в файле {path}: {e}')
+        finally:
+            if error_file:
+                error_file.close()
+
+        elapsed = time.perf_counter() - started
+        rate = imported / elapsed if elapsed else 0
+        action = 'Проверено' if dry_run else 'Импортировано'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} строк: {imported}, с ошибками: {failed} ({elapsed:.2f} с, {rate:.0f} строк/с)'
+        ))
+
+    def flush(self, chunk, dry_run):
+        if not dry_run:
+            insert_rows(chunk)
+        return len(chunk)
+
+    def report_error(self, error_writer, line_number, error, record, failed):
+        if error_writer:
+            data = record if isinstance(record, dict) else None
+            error_writer.writerow([line_number, str(error), json.dumps(data, ensure_ascii=False, default=str)])
+        elif failed <= 20:
+            self.stderr.write(f'Строка {line_number}: {error}')
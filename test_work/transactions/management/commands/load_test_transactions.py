@@ -1,116 +1,142 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
 from django.utils import timezone
 from decimal import Decimal
-from transactions.models import Transaction, Status, TransactionType, Category, Subcategory
+from transactions.importing import INSERT_TRANSACTION_ROWS, insert_rows
+from transactions.models import DailyRollup, Status, TransactionType, Category, Subcategory
+import itertools
+import math
 import random
+import time
 from datetime import date, timedelta
 
+# Заготовленные данные для более реалистичных записей
+TEST_DATA = {
+    'Пополнение': {
+        'amount_range': (15000, 80000),
+        'comments': ['Зарплата за месяц', 'Аванс', 'Премия', 'Оплата за проект', 'Фриланс'],
+    },
+    'Списание': {
+        'amount_range': (500, 15000),
+        'comments': ['Оплата VPS сервера', 'Продвижение на Авито', 'Покупка прокси', 'Реклама в Farpost',
+                     'Техническое обслуживание'],
+    },
+}
+DEFAULT_DATA = {
+    'amount_range': (100, 10000),
+    'comments': ['Операция'],
+}
+FILLER_WORDS = ['счёт', 'оплата', 'договор', 'клиент', 'период', 'услуги', 'возврат', 'комиссия', 'заказ', 'акт']
+
 
 class Command(BaseCommand):
-    help = 'Загрузить тестовые записи транзакций'
+    help = 'Загрузить тестовые записи транзакций (воспроизводимый генератор любого объёма)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10, help='Количество записей')
+        parser.add_argument('--seed', type=int, help='Зерно генератора для воспроизводимого набора')
+        parser.add_argument('--days', type=int, default=30, help='Глубина периода в днях')
+        parser.add_argument('--end-date', type=date.fromisoformat, help='Последняя дата периода (по умолчанию сегодня)')
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help=f'Записей в пачке генерации; в БД пишется по {INSERT_TRANSACTION_ROWS} записей в транзакции')
+        parser.add_argument('--seasonality', type=float, default=0.0,
+                            help='Амплитуда годовой сезонности количества операций, от 0 до 1')
+        parser.add_argument('--category-skew', type=float, default=0.0,
+                            help='Показатель Ципфа для неравномерности категорий (0 - равномерно)')
+        parser.add_argument('--comment-length', type=int, default=0,
+                            help='Максимальная длина комментария (0 - короткие шаблонные комментарии)')
 
     def handle(self, *args, **options):
-        # Проверяем наличие справочников
-        statuses = list(Status.objects.all())
-        transaction_types = list(TransactionType.objects.all())
+        if options['count'] < 0 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--count, --days и --batch-size должны быть положительными')
+        if not 0 <= options['seasonality'] <= 1:
+            raise CommandError('--seasonality должен быть в диапазоне от 0 до 1')
+
+        # Справочники загружаются один раз и в порядке id: иначе набор для --seed зависел бы от порядка строк в БД
+        statuses = list(Status.objects.order_by('id').values_list('id', flat=True))
+        transaction_types = list(TransactionType.objects.order_by('id').values_list('id', 'name'))
 
         if not (statuses and transaction_types):
             self.stdout.write(self.style.ERROR('Не найдены справочники. Сначала выполните load_initial_data'))
             return
 
-        # Получаем типы операций
-        try:
-            income_type = TransactionType.objects.get(name='Пополнение')
-            expense_type = TransactionType.objects.get(name='Списание')
-        except TransactionType.DoesNotExist:
-            self.stdout.write(self.style.ERROR('Не найдены типы операций "Пополнение" и "Списание"'))
-            return
+        subcategories = {}
+        for subcategory_id, category_id in Subcategory.objects.order_by('id').values_list('id', 'category_id'):
+            subcategories.setdefault(category_id, []).append(subcategory_id)
 
-        # Получаем категории и подкатегории
-        income_categories = list(Category.objects.filter(transaction_type=income_type))
-        expense_categories = list(Category.objects.filter(transaction_type=expense_type))
+        categories = {}
+        for category_id, type_id in Category.objects.order_by('id').values_list('id', 'transaction_type_id'):
+            if category_id in subcategories:
+                categories.setdefault(type_id, []).append(category_id)
 
-        if not (income_categories and expense_categories):
+        type_configs = []
+        for type_id, name in transaction_types:
+            if type_id not in categories:
+                continue
+            type_categories = categories[type_id]
+            weights = [1 / (rank ** options['category_skew']) for rank in range(1, len(type_categories) + 1)]
+            type_configs.append((type_id, type_categories, list(itertools.accumulate(weights)),
+                                 TEST_DATA.get(name, DEFAULT_DATA)))
+
+        if not type_configs:
             self.stdout.write(self.style.ERROR('Не найдены категории. Сначала выполните load_initial_data'))
             return
 
-        # Заготовленные данные для более реалистичных записей
-        test_data = [
-            # Пополнения
-            {
-                'type': income_type,
-                'amount_range': (15000, 80000),
-                'comments': ['Зарплата за месяц', 'Аванс', 'Премия', 'Оплата за проект', 'Фриланс']
-            },
-            # Списания
-            {
-                'type': expense_type,
-                'amount_range': (500, 15000),
-                'comments': ['Оплата VPS сервера', 'Продвижение на Авито', 'Покупка прокси', 'Реклама в Farpost',
-                             'Техническое обслуживание']
-            }
-        ]
+        rng = random.Random(options['seed'])
+        end_date = options['end_date'] or timezone.now().date()
+        days = [end_date - timedelta(days=offset) for offset in range(options['days'])]
+        day_weights = list(itertools.accumulate(
+            1 + options['seasonality'] * math.sin(2 * math.pi * day.timetuple().tm_yday / 365.25)
+            for day in days
+        ))
 
         created_count = 0
-        today = timezone.now().date()
-
-        # Создаем 10 тестовых записей
-        for i in range(10):
-            # Выбираем случайный тип операции
-            data_config = random.choice(test_data)
-            transaction_type = data_config['type']
-
-            # Получаем категории для выбранного типа
-            if transaction_type == income_type:
-                available_categories = income_categories
-            else:
-                available_categories = expense_categories
-
-            if not available_categories:
-                continue
-
-            category = random.choice(available_categories)
-
-            # Получаем подкатегории для выбранной категории
-            subcategories = list(Subcategory.objects.filter(category=category))
-            if not subcategories:
-                continue
-
-            subcategory = random.choice(subcategories)
+        started = time.perf_counter()
+        while created_count < options['count']:
+            size = min(options['batch_size'], options['count'] - created_count)
+            rows = self.generate_rows(rng, size, statuses, type_configs, subcategories, days, day_weights,
+                                      options['comment_length'])
+            # Пишем через insert_rows (один executemany на пачку), а не bulk_create: на SQLite
+            # bulk_create ограничен 999 параметрами на запрос и в разы медленнее на миллионах строк
+            created_count += insert_rows(rows)
+            self.stdout.write(f'Создано записей: {created_count} из {options["count"]}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {created_count} тестовых записей транзакций за {elapsed:.1f} с'
+        ))
+
+        # Показываем статистику по дневным сводкам, не агрегируя таблицу операций
+        totals = DailyRollup.objects.values('transaction_type__name').annotate(
+            rollup_count=Sum('count')
+        ).order_by('transaction_type__name')
+        for row in totals:
+            self.stdout.write(f'{row["transaction_type__name"]}: {row["rollup_count"]}')
+
+    @staticmethod
+    def generate_rows(rng, size, statuses, type_configs, subcategories, days, day_weights, comment_length):
+        rows = []
+        row_days = rng.choices(days, cum_weights=day_weights, k=size)
+        row_statuses = rng.choices(statuses, k=size)
+        row_types = rng.choices(type_configs, k=size)
+        for transaction_date, status_id, type_config in zip(row_days, row_statuses, row_types):
+            type_id, type_categories, category_weights, data_config = type_config
+            category_id = rng.choices(type_categories, cum_weights=category_weights)[0]
+            subcategory_id = rng.choice(subcategories[category_id])
 
-            # Генерируем случайную сумму в зависимости от типа операции
             min_amount, max_amount = data_config['amount_range']
-            amount = Decimal(random.randint(min_amount, max_amount))
-
-            # Генерируем случайную дату (от сегодня до 30 дней назад)
-            days_ago = random.randint(0, 30)
-            transaction_date = today - timedelta(days=days_ago)
-
-            # Выбираем случайный статус и комментарий
-            status = random.choice(statuses)
-            comment = random.choice(data_config['comments'])
-
-            # Создаем транзакцию
-            transaction = Transaction.objects.create(
-                date=transaction_date,
-                status=status,
-                transaction_type=transaction_type,
-                category=category,
-                subcategory=subcategory,
-                amount=amount,
-                comment=comment
-            )
-
-            created_count += 1
-            self.stdout.write(
-                f'Создана транзакция {created_count}: {transaction_date} - {amount} руб. ({transaction_type.name})')
-
-        self.stdout.write(self.style.SUCCESS(f'Загружено {created_count} тестовых записей транзакций'))
-
-        # Показываем статистику
-        total_transactions = Transaction.objects.count()
-        income_total = Transaction.objects.filter(transaction_type__name='Пополнение').count()
-        expense_total = Transaction.objects.filter(transaction_type__name='Списание').count()
-
-        self.stdout.write(f'Всего транзакций в базе: {total_transactions}')
-        self.stdout.write(f'Пополнений: {income_total}, Списаний: {expense_total}')
+            amount = Decimal(rng.randint(min_amount, max_amount))
+
+            comment = rng.choice(data_config['comments'])
+            if comment_length:
+                target = rng.randint(0, comment_length)
+                words = [comment]
+                length = len(comment) + 1
+                while length < target:
+                    word = rng.choice(FILLER_WORDS)
+                    words.append(word)
+                    length += len(word) + 1
+                comment = ' '.join(words)[:comment_length]
+
+            rows.append((transaction_date, status_id, type_id, category_id, subcategory_id, amount, comment))
+        return rows
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from transactions.jobs import enqueue
+from transactions.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать дневные сводки операций из таблицы транзакций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пакета вставки')
+        parser.add_argument('--background', action='store_true', help='Поставить в очередь для run_worker')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('rebuild_rollups')
+            self.stdout.write(self.style.SUCCESS(f'Пересборка поставлена в очередь: задача {job.pk}'))
+            return
+        created = rebuild_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано строк сводки: {created}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from transactions.jobs import enqueue
+from transactions.search import rebuild_search_index, search_available
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать полнотекстовый индекс комментариев операций (SQLite FTS5)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--background', action='store_true', help='Поставить в очередь для run_worker')
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite')
+        if options['background']:
+            job = enqueue('rebuild_search_index')
+            self.stdout.write(self.style.SUCCESS(f'Пересборка поставлена в очередь: задача {job.pk}'))
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS('Индекс поиска пересобран'))
@@ -0,0 +1,66 @@
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from transactions.jobs import claim_next, heartbeat, purge_finished, requeue_stale, run_job
+
+# Как часто удалять старые завершённые задачи, секунды
+PURGE_INTERVAL = 3600
+
+
+def _run_in_thread(job):
+    try:
+        run_job(job)
+    finally:
+        # Поток пула держит свои соединения; без закрытия они живут до конца процесса
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Выполнять фоновые задачи из очереди (таблица Job) в пуле потоков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Сколько задач выполнять одновременно (больше одной - с WAL, SQLITE_PRODUCTION=1)')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Пауза между проверками очереди, секунды')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError('--threads должен быть положительным')
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        running = {}
+        purged_at = None
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            try:
+                while True:
+                    heartbeat(worker, [job.pk for job in running.values()])
+                    requeue_stale()
+                    if purged_at is None or time.monotonic() - purged_at > PURGE_INTERVAL:
+                        purge_finished()
+                        purged_at = time.monotonic()
+                    while len(running) < options['threads']:
+                        job = claim_next(worker)
+                        if job is None:
+                            break
+                        self.stdout.write(f'Начата задача {job}')
+                        running[pool.submit(_run_in_thread, job)] = job
+
+                    if not running:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+                    done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = running.pop(future)
+                        job.refresh_from_db(fields=['status'])
+                        self.stdout.write(f'Завершена задача {job}')
+            except KeyboardInterrupt:
+                # Начатые задачи дорабатывают, новые не берутся
+                self.stdout.write('Остановка: ждём начатые задачи')
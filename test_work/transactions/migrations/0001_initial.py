@@ -0,0 +1,92 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:11
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Категория',
+                'verbose_name_plural': 'Категории',
+            },
+        ),
+        migrations.CreateModel(
+            name='Status',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Статус')),
+            ],
+            options={
+                'verbose_name': 'Статус',
+                'verbose_name_plural': 'Статусы',
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Тип операции',
+                'verbose_name_plural': 'Типы операций',
+            },
+        ),
+        migrations.CreateModel(
+            name='Subcategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Подкатегория')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subcategories', to='transactions.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Подкатегория',
+                'verbose_name_plural': 'Подкатегории',
+                'unique_together': {('name', 'category')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Сумма')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.subcategory', verbose_name='Подкатегория')),
+                ('transaction_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.transactiontype', verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Транзакция',
+                'verbose_name_plural': 'Транзакции',
+                'ordering': ['-date', '-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='transaction_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='transactions.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together={('name', 'transaction_type')},
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.status', verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='subcategory',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.subcategory', verbose_name='Подкатегория'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date', 'created_at'], name='trx_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'date', 'created_at'], name='trx_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'date', 'created_at'], name='trx_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'date', 'created_at'], name='trx_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['subcategory', 'date', 'created_at'], name='trx_subcategory_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['updated_at'], name='trx_updated_at_idx'),
+        ),
+    ]
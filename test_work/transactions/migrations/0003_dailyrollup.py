@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rollups(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    DailyRollup = apps.get_model('transactions', 'DailyRollup')
+    key_fields = ('date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id')
+    rows = Transaction.objects.order_by().values(*key_fields).annotate(
+        rollup_total=Sum('amount'), rollup_count=Count('id')
+    )
+    DailyRollup.objects.bulk_create(
+        [
+            DailyRollup(
+                total=row['rollup_total'],
+                count=row['rollup_count'],
+                **{field: row[field] for field in key_fields},
+            )
+            for row in rows.iterator(chunk_size=1000)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Сумма')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.subcategory', verbose_name='Подкатегория')),
+                ('transaction_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transactions.transactiontype', verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Дневная сводка',
+                'verbose_name_plural': 'Дневные сводки',
+                'constraints': [models.UniqueConstraint(fields=('date', 'status', 'transaction_type', 'category', 'subcategory'), name='daily_rollup_key')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0003_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='Месяц')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=18, verbose_name='Остаток на конец месяца')),
+            ],
+            options={
+                'verbose_name': 'Остаток на конец месяца',
+                'verbose_name_plural': 'Остатки на конец месяца',
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:44
+
+import django.db.models.deletion
+import transactions.models
+from django.db import migrations, models
+
+
+# Внешнее содержимое: индекс хранит только токены, текст берётся из таблицы операций.
+# Триггеры покрывают все пути записи: ORM, bulk_create/bulk_update и сырой executemany импорта.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE transactions_transaction_fts USING fts5(
+        comment,
+        content='transactions_transaction',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER transactions_transaction_fts_insert AFTER INSERT ON transactions_transaction BEGIN
+        INSERT INTO transactions_transaction_fts(rowid, comment) VALUES (new.id, new.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER transactions_transaction_fts_delete AFTER DELETE ON transactions_transaction BEGIN
+        INSERT INTO transactions_transaction_fts(transactions_transaction_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER transactions_transaction_fts_update AFTER UPDATE OF comment ON transactions_transaction BEGIN
+        INSERT INTO transactions_transaction_fts(transactions_transaction_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+        INSERT INTO transactions_transaction_fts(rowid, comment) VALUES (new.id, new.comment);
+    END
+    """,
+    "INSERT INTO transactions_transaction_fts(transactions_transaction_fts) VALUES ('rebuild')",
+]
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS transactions_transaction_fts_insert',
+    'DROP TRIGGER IF EXISTS transactions_transaction_fts_delete',
+    'DROP TRIGGER IF EXISTS transactions_transaction_fts_update',
+    'DROP TABLE IF EXISTS transactions_transaction_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 есть только в SQLite, на других БД поиск работает через icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionSearch',
+            fields=[
+                ('transaction', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='transactions.transaction')),
+                ('comment', transactions.models.SearchField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'transactions_transaction_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
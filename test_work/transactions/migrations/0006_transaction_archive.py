@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:59
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+COLUMNS = 'id, date, status_id, transaction_type_id, category_id, subcategory_id, amount, comment, created_at, updated_at'
+# Рабочая таблица и архив как одна таблица только для чтения (модель CombinedTransaction)
+CREATE_VIEW_SQL = f"""
+    CREATE VIEW transactions_combinedtransaction AS
+    SELECT {COLUMNS}, FALSE AS archived FROM transactions_transaction
+    UNION ALL
+    SELECT {COLUMNS}, TRUE AS archived FROM transactions_archivedtransaction
+"""
+DROP_VIEW_SQL = 'DROP VIEW IF EXISTS transactions_combinedtransaction'
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_transaction_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Сумма')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.subcategory', verbose_name='Подкатегория')),
+                ('transaction_type', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='transactions.transactiontype', verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Архивная транзакция',
+                'verbose_name_plural': 'Архив транзакций',
+                'ordering': ['-date', '-created_at'],
+                'indexes': [models.Index(fields=['date', 'created_at'], name='trx_archive_date_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CombinedTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('comment', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'transactions_combinedtransaction',
+                'ordering': ['-date', '-created_at'],
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW_SQL, DROP_VIEW_SQL),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_usage_counts(apps, schema_editor):
+    # Дневные сводки учитывают и рабочую таблицу, и архив
+    DailyRollup = apps.get_model('transactions', 'DailyRollup')
+    for model_name, field in [('Status', 'status'), ('TransactionType', 'transaction_type'),
+                              ('Category', 'category'), ('Subcategory', 'subcategory')]:
+        model = apps.get_model('transactions', model_name)
+        rows = DailyRollup.objects.order_by().values_list(f'{field}_id').annotate(usage=Sum('count'))
+        for pk, usage in rows:
+            model.objects.filter(pk=pk).update(usage_count=usage)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Операций'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Операций'),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Операций'),
+        ),
+        migrations.AddField(
+            model_name='transactiontype',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Операций'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='transactions.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='status',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='transactions.status', verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='subcategory',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='transactions.subcategory', verbose_name='Подкатегория'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='transaction_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='transactions.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='transactions.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='transactions.status', verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='subcategory',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='transactions.subcategory', verbose_name='Подкатегория'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='transactions.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.RunPython(populate_usage_counts, migrations.RunPython.noop),
+    ]
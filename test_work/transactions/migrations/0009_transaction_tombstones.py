@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionTombstone',
+            fields=[
+                ('transaction_id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Операция')),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Удалена')),
+            ],
+            options={
+                'verbose_name': 'Удалённая операция',
+                'verbose_name_plural': 'Удалённые операции',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['updated_at'], name='trx_archive_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactiontombstone',
+            index=models.Index(fields=['deleted_at', 'transaction_id'], name='trx_tombstone_deleted_idx'),
+        ),
+    ]
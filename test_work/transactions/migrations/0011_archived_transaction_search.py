@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:27
+
+import django.db.models.deletion
+import transactions.models
+from django.db import migrations, models
+
+
+# Индекс архива устроен как индекс рабочей таблицы (0005): внешнее содержимое и
+# триггеры. Строки попадают в него при переносе (INSERT ... SELECT в archive_rows).
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE transactions_archivedtransaction_fts USING fts5(
+        comment,
+        content='transactions_archivedtransaction',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER transactions_archivedtransaction_fts_insert AFTER INSERT ON transactions_archivedtransaction BEGIN
+        INSERT INTO transactions_archivedtransaction_fts(rowid, comment) VALUES (new.id, new.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER transactions_archivedtransaction_fts_delete AFTER DELETE ON transactions_archivedtransaction BEGIN
+        INSERT INTO transactions_archivedtransaction_fts(transactions_archivedtransaction_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+    END
+    """,
+    """
+    CREATE TRIGGER transactions_archivedtransaction_fts_update
+    AFTER UPDATE OF comment ON transactions_archivedtransaction BEGIN
+        INSERT INTO transactions_archivedtransaction_fts(transactions_archivedtransaction_fts, rowid, comment)
+        VALUES ('delete', old.id, old.comment);
+        INSERT INTO transactions_archivedtransaction_fts(rowid, comment) VALUES (new.id, new.comment);
+    END
+    """,
+    "INSERT INTO transactions_archivedtransaction_fts(transactions_archivedtransaction_fts) VALUES ('rebuild')",
+]
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS transactions_archivedtransaction_fts_insert',
+    'DROP TRIGGER IF EXISTS transactions_archivedtransaction_fts_delete',
+    'DROP TRIGGER IF EXISTS transactions_archivedtransaction_fts_update',
+    'DROP TABLE IF EXISTS transactions_archivedtransaction_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 есть только в SQLite, на других БД поиск работает через icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_cache_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransactionSearch',
+            fields=[
+                ('transaction', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='transactions.archivedtransaction')),
+                ('comment', transactions.models.SearchField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'transactions_archivedtransaction_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -6,6 +6,8 @@ from django.utils import timezone
 
 class Status(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Статус")
+    # Число операций (вместе с архивом), поддерживается rollups.apply_deltas
+    usage_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Операций")
 
     class Meta:
         verbose_name = "Статус"
@@ -18,6 +20,7 @@ class Status(models.Model):
 class TransactionType(models.Model):
 
     name = models.CharField(max_length=100, unique=True, verbose_name="Тип операции")
+    usage_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Операций")
 
     class Meta:
         verbose_name = "Тип операции"
@@ -35,6 +38,7 @@ class Category(models.Model):
         related_name='categories',
         verbose_name="Тип операции"
     )
+    usage_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Операций")
 
     class Meta:
         verbose_name = "Категория"
@@ -53,6 +57,7 @@ class Subcategory(models.Model):
         related_name='subcategories',
         verbose_name="Категория"
     )
+    usage_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Операций")
 
     class Meta:
         verbose_name = "Подкатегория"
@@ -63,28 +68,36 @@ class Subcategory(models.Model):
         return f"{self.name} ({self.category.name})"
 
 
-class Transaction(models.Model):
+class TransactionFields(models.Model):
+    """Поля операции, общие для рабочей таблицы и архива"""
+
+    # Справочник с операциями не удаляется: сначала перенос операций (bulk.delete_dictionary_entry)
+
     # Дата автоматически заполняется текущей датой, но может быть изменена
     date = models.DateField(verbose_name="Дата")
 
     status = models.ForeignKey(
         Status,
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,
+        db_index=False,
         verbose_name="Статус"
     )
     transaction_type = models.ForeignKey(
         TransactionType,
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,
+        db_index=False,
         verbose_name="Тип операции"
     )
     category = models.ForeignKey(
         Category,
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,
+        db_index=False,
         verbose_name="Категория"
     )
     subcategory = models.ForeignKey(
         Subcategory,
-        on_delete=models.CASCADE,
+        on_delete=models.PROTECT,
+        db_index=False,
         verbose_name="Подкатегория"
     )
     amount = models.DecimalField(
@@ -97,10 +110,275 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        abstract = True
+
+
+class Transaction(TransactionFields):
     class Meta:
         verbose_name = "Транзакция"
         verbose_name_plural = "Транзакции"
         ordering = ['-date', '-created_at']
+        # Индексы повторяют формы запросов transaction_list: равенство по одному из
+        # фильтров, затем диапазон дат и сортировка -date, -created_at (id в SQLite
+        # входит в ключ индекса как rowid). Составные индексы начинаются с FK и
+        # заменяют отдельные FK-индексы.
+        indexes = [
+            models.Index(fields=['date', 'created_at'], name='trx_date_created_idx'),
+            models.Index(fields=['status', 'date', 'created_at'], name='trx_status_date_idx'),
+            models.Index(fields=['transaction_type', 'date', 'created_at'], name='trx_type_date_idx'),
+            models.Index(fields=['category', 'date', 'created_at'], name='trx_category_date_idx'),
+            models.Index(fields=['subcategory', 'date', 'created_at'], name='trx_subcategory_date_idx'),
+            models.Index(fields=['updated_at'], name='trx_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.amount} руб. ({self.transaction_type.name})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженные значения, чтобы при сохранении знать старый ключ сводки
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class ArchivedTransaction(TransactionFields):
+    """
+    Операции закрытых периодов, перенесённые командой archive_transactions.
+    Рабочая таблица и её индексы не растут с историей; архив только читается.
+    """
+
+    # Проверка PROTECT читала бы архив без индекса по справочникам. Удаление
+    # справочника с операциями (в том числе архивными) и так запрещено по
+    # usage_count, а ограничение внешнего ключа в БД остаётся
+    status = models.ForeignKey(Status, on_delete=models.DO_NOTHING, db_index=False, verbose_name="Статус")
+    transaction_type = models.ForeignKey(
+        TransactionType, on_delete=models.DO_NOTHING, db_index=False, verbose_name="Тип операции"
+    )
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_index=False, verbose_name="Категория")
+    subcategory = models.ForeignKey(
+        Subcategory, on_delete=models.DO_NOTHING, db_index=False, verbose_name="Подкатегория"
+    )
+
+    class Meta:
+        verbose_name = "Архивная транзакция"
+        verbose_name_plural = "Архив транзакций"
+        ordering = ['-date', '-created_at']
+        # Архив читается редко и почти всегда по периоду; индекс по updated_at -
+        # для ленты изменений (changes.py), архивные строки меняет только перенос справочника
+        indexes = [
+            models.Index(fields=['date', 'created_at'], name='trx_archive_date_idx'),
+            models.Index(fields=['updated_at'], name='trx_archive_updated_at_idx'),
+        ]
+
+
+class CombinedTransaction(models.Model):
+    """
+    Представление (VIEW) рабочей таблицы и архива через UNION ALL, только для
+    чтения. Используется, когда фильтр по дате доходит до архива (см. archive.py).
+    """
+
+    date = models.DateField(verbose_name="Дата")
+    status = models.ForeignKey(Status, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    transaction_type = models.ForeignKey(
+        TransactionType, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'transactions_combinedtransaction'
+        ordering = ['-date', '-created_at']
+
+
+class TransactionTombstone(models.Model):
+    """
+    Отметка об удалённой операции для ленты изменений (changes.py): без неё
+    клиент, синхронизирующий операции по updated_at, не узнал бы об удалении.
+    Пишется там же, где правятся дневные сводки при удалении (signals.py, bulk.delete).
+    """
+
+    transaction_id = models.BigIntegerField(primary_key=True, verbose_name="Операция")
+    deleted_at = models.DateTimeField(default=timezone.now, verbose_name="Удалена")
+
+    class Meta:
+        verbose_name = "Удалённая операция"
+        verbose_name_plural = "Удалённые операции"
+        # transaction_id (bigint) не псевдоним rowid, поэтому для порядка ленты он входит в индекс явно
+        indexes = [
+            models.Index(fields=['deleted_at', 'transaction_id'], name='trx_tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.transaction_id} удалена {self.deleted_at:%d.%m.%Y %H:%M}"
+
+
+class CacheVersion(models.Model):
+    """
+    Версия закэшированных данных (снимка справочников и т.п.) в самой БД.
+    Меняется в той же транзакции, что и данные, поэтому любой процесс - веб,
+    команда или run_worker - видит новую версию вместе с изменением.
+    """
+
+    name = models.CharField(max_length=50, primary_key=True, verbose_name="Данные")
+    token = models.CharField(max_length=32, verbose_name="Версия")
+
+    class Meta:
+        verbose_name = "Версия кэша"
+        verbose_name_plural = "Версии кэша"
+
+    def __str__(self):
+        return f"{self.name}: {self.token}"
+
+
+class DailyRollup(models.Model):
+    """Дневная сводка операций: сумма и количество по дате и справочникам"""
+
+    date = models.DateField(verbose_name="Дата")
+    status = models.ForeignKey(Status, on_delete=models.CASCADE, verbose_name="Статус")
+    transaction_type = models.ForeignKey(TransactionType, on_delete=models.CASCADE, verbose_name="Тип операции")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    subcategory = models.ForeignKey(Subcategory, on_delete=models.CASCADE, verbose_name="Подкатегория")
+    total = models.DecimalField(max_digits=18, decimal_places=2, default=0, verbose_name="Сумма")
+    count = models.PositiveIntegerField(default=0, verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Дневная сводка"
+        verbose_name_plural = "Дневные сводки"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'status', 'transaction_type', 'category', 'subcategory'],
+                name='daily_rollup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.total} руб. ({self.count})"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Остаток на конец месяца: поступления минус списания по всем операциям
+    с датой до конца месяца включительно. Строки удаляются начиная с месяца
+    изменённой операции и достраиваются по дневным сводкам при чтении.
+    """
+
+    month = models.DateField(unique=True, verbose_name="Месяц")
+    balance = models.DecimalField(max_digits=18, decimal_places=2, verbose_name="Остаток на конец месяца")
+
+    class Meta:
+        verbose_name = "Остаток на конец месяца"
+        verbose_name_plural = "Остатки на конец месяца"
+
+    def __str__(self):
+        return f"{self.month:%m.%Y} - {self.balance} руб."
+
+
+class SearchField(models.TextField):
+    """Столбец полнотекстового индекса FTS5: поддерживает поиск __match"""
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class TransactionSearch(models.Model):
+    """
+    Полнотекстовый индекс комментариев (виртуальная таблица SQLite FTS5 с
+    внешним содержимым). Таблица и триггеры синхронизации создаются миграцией.
+    """
+
+    transaction = models.OneToOneField(
+        Transaction,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='search',
+    )
+    comment = SearchField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'transactions_transaction_fts'
+
+
+class ArchivedTransactionSearch(models.Model):
+    """Полнотекстовый индекс комментариев архива, устроен как TransactionSearch"""
+
+    transaction = models.OneToOneField(
+        ArchivedTransaction,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='search',
+    )
+    comment = SearchField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'transactions_archivedtransaction_fts'
+
+
+class Job(models.Model):
+    """
+    Фоновая задача (выгрузка, пересборка) в очереди в самой БД. Выполняется
+    командой run_worker, см. jobs.py.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name="Вид задачи")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name="Состояние")
+    progress = models.PositiveBigIntegerField(default=0, verbose_name="Выполнено")
+    total = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="Всего")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name="Попыток максимум")
+    # Раньше этого времени задача не берётся: так откладываются повторы после ошибки
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Не раньше")
+    worker = models.CharField(max_length=100, blank=True, verbose_name="Обработчик")
+    # Обновляется при каждом шаге; задача без отметки дольше JOB_STALE_AFTER считается брошенной
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний шаг")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    result = models.FileField(upload_to='jobs/%Y/%m/', blank=True, verbose_name="Результат")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начата")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            # Выбор следующей задачи: WHERE status = 'queued' AND run_after <= now ORDER BY run_after
+            models.Index(fields=['status', 'run_after'], name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.get_status_display()})"
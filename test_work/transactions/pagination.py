@@ -0,0 +1,186 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from django.db.models import Q
+
+
+class CursorPage:
+    """Страница курсорной пагинации (без COUNT и OFFSET)"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, total=None, total_capped=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.total = total
+        self.total_capped = total_capped
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Keyset-пагинация по порядку модели Transaction: -date, -created_at, -id.
+
+    Курсор хранит ключ граничной строки и направление, поэтому любая страница
+    выбирается одним запросом по индексу, независимо от её "глубины".
+    """
+
+    def __init__(self, queryset, per_page=20, count_limit=None):
+        self.queryset = queryset.order_by('-date', '-created_at', '-id')
+        self.per_page = per_page
+        self.count_limit = count_limit
+
+    @staticmethod
+    def encode_cursor(obj, reverse=False):
+        payload = [obj.date.isoformat(), obj.created_at.isoformat(), obj.pk, int(reverse)]
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Возвращает (date, created_at, id, reverse) или None для некорректного курсора"""
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            date_value, created_at, pk, reverse = json.loads(raw)
+            return date.fromisoformat(date_value), datetime.fromisoformat(created_at), int(pk), bool(reverse)
+        except (ValueError, TypeError, binascii.Error):
+            return None
+
+    @staticmethod
+    def _after(date_value, created_at, pk):
+        """Строки, идущие после ключа в порядке -date, -created_at, -id"""
+        # Избыточное условие date <= ... даёт планировщику диапазон по индексу
+        return Q(date__lte=date_value) & (
+            Q(date__lt=date_value)
+            | Q(date=date_value, created_at__lt=created_at)
+            | Q(date=date_value, created_at=created_at, pk__lt=pk)
+        )
+
+    @staticmethod
+    def _before(date_value, created_at, pk):
+        """Строки, идущие перед ключом в порядке -date, -created_at, -id"""
+        return Q(date__gte=date_value) & (
+            Q(date__gt=date_value)
+            | Q(date=date_value, created_at__gt=created_at)
+            | Q(date=date_value, created_at=created_at, pk__gt=pk)
+        )
+
+    def count(self):
+        """Общее количество строк, ограниченное count_limit (None - без ограничения, 0 - не считать)"""
+        if self.count_limit == 0:
+            return None, False
+        if self.count_limit is None:
+            return self.queryset.count(), False
+        total = self.queryset.order_by().values('pk')[:self.count_limit + 1].count()
+        return min(total, self.count_limit), total > self.count_limit
+
+    async def acount(self):
+        if self.count_limit == 0:
+            return None, False
+        if self.count_limit is None:
+            return await self.queryset.acount(), False
+        total = await self.queryset.order_by().values('pk')[:self.count_limit + 1].acount()
+        return min(total, self.count_limit), total > self.count_limit
+
+    def page_queryset(self, position):
+        """Queryset строк страницы, начинающейся от декодированного курсора"""
+        if position is None:
+            return self.queryset
+        date_value, created_at, pk, reverse = position
+        if reverse:
+            return self.queryset.filter(self._before(date_value, created_at, pk)).reverse()
+        return self.queryset.filter(self._after(date_value, created_at, pk))
+
+    def _make_page(self, rows, position, total, total_capped):
+        reverse = position is not None and position[3]
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            # В обратном направлении "лишняя" строка означает наличие предыдущей страницы
+            if (has_more and not reverse) or (reverse and position is not None):
+                next_cursor = self.encode_cursor(rows[-1])
+            if (has_more and reverse) or (not reverse and position is not None):
+                previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return CursorPage(rows, next_cursor, previous_cursor, total, total_capped)
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        rows = list(self.page_queryset(position)[:self.per_page + 1])
+        return self._make_page(rows, position, *self.count())
+
+    async def aget_page(self, cursor=None):
+        position = self.decode_cursor(cursor)
+        rows = [row async for row in self.page_queryset(position)[:self.per_page + 1]]
+        return self._make_page(rows, position, *await self.acount())
+
+
+class RankedPaginator:
+    """
+    Пагинация результатов поиска в порядке релевантности. Ранг не входит в
+    ключ строки, поэтому курсор хранит смещение; глубина ограничена числом
+    найденных строк. Интерфейс страниц тот же, что у KeysetPaginator.
+    """
+
+    def __init__(self, queryset, per_page=20, count_limit=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count_limit = count_limit
+
+    @staticmethod
+    def encode_cursor(offset):
+        raw = json.dumps(['offset', offset], separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return 0
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            kind, offset = json.loads(raw)
+            return max(int(offset), 0) if kind == 'offset' else 0
+        except (ValueError, TypeError, binascii.Error):
+            return 0
+
+    count = KeysetPaginator.count
+    acount = KeysetPaginator.acount
+
+    def _make_page(self, rows, offset, total, total_capped):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = self.encode_cursor(offset + self.per_page) if has_more else None
+        previous_cursor = self.encode_cursor(max(offset - self.per_page, 0)) if offset else None
+        return CursorPage(rows, next_cursor, previous_cursor, total, total_capped)
+
+    def get_page(self, cursor=None):
+        offset = self.decode_cursor(cursor)
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        return self._make_page(rows, offset, *self.count())
+
+    async def aget_page(self, cursor=None):
+        offset = self.decode_cursor(cursor)
+        rows = [row async for row in self.queryset[offset:offset + self.per_page + 1]]
+        return self._make_page(rows, offset, *await self.acount())
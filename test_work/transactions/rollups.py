@@ -0,0 +1,158 @@
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .archive import source_model
+from .balance import invalidate_checkpoints
+from .list_cache import bump_data_version
+from .models import DailyRollup, Status, TransactionType, Category, Subcategory
+
+ROLLUP_KEY_FIELDS = ('date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id')
+# Справочники со счётчиком usage_count в порядке полей ключа сводки после даты
+USAGE_MODELS = (Status, TransactionType, Category, Subcategory)
+
+
+def rollup_key(values):
+    """Ключ сводки из словаря значений транзакции"""
+    return tuple(values[field] for field in ROLLUP_KEY_FIELDS)
+
+
+def instance_rollup_key(instance):
+    return tuple(getattr(instance, field) for field in ROLLUP_KEY_FIELDS)
+
+
+def add_delta(deltas, key, amount, count):
+    """Добавляет изменение (сумма, количество) к накопленным дельтам по ключу"""
+    total, number = deltas.get(key, (0, 0))
+    deltas[key] = (total + amount, number + count)
+
+
+def queryset_deltas(queryset, sign=1):
+    """Дельты сводки для всех транзакций queryset одним GROUP BY запросом"""
+    deltas = {}
+    rows = queryset.order_by().values(*ROLLUP_KEY_FIELDS).annotate(
+        rollup_total=Sum('amount'), rollup_count=Count('id')
+    )
+    for row in rows:
+        add_delta(deltas, rollup_key(row), sign * row['rollup_total'], sign * row['rollup_count'])
+    return deltas
+
+
+def _rollup_sql():
+    quote = connection.ops.quote_name
+    table = quote(DailyRollup._meta.db_table)
+    key_columns = [quote(DailyRollup._meta.get_field(field).column) for field in ROLLUP_KEY_FIELDS]
+    total, count = quote('total'), quote('count')
+    upsert = (
+        f'INSERT INTO {table} ({", ".join(key_columns)}, {total}, {count}) '
+        f'VALUES ({", ".join(["%s"] * (len(key_columns) + 2))}) '
+        f'ON CONFLICT ({", ".join(key_columns)}) '
+        f'DO UPDATE SET {total} = {total} + excluded.{total}, {count} = {count} + excluded.{count}'
+    )
+    update = (
+        f'UPDATE {table} SET {total} = {total} + %s, {count} = {count} + %s '
+        f'WHERE {" AND ".join(f"{column} = %s" for column in key_columns)}'
+    )
+    return upsert, update
+
+
+def usage_changes(deltas):
+    """Изменения usage_count справочников по дельтам сводки: {модель: [(изменение, id), ...]}"""
+    changes = {model: {} for model in USAGE_MODELS}
+    for key, (_, count) in deltas.items():
+        if not count:
+            continue
+        for model, pk in zip(USAGE_MODELS, key[1:]):
+            changes[model][pk] = changes[model].get(pk, 0) + count
+    return {
+        model: [(count, pk) for pk, count in by_id.items() if count]
+        for model, by_id in changes.items()
+    }
+
+
+def apply_deltas(deltas):
+    """
+    Применяет дельты к DailyRollup двумя пакетными запросами и к счётчикам
+    usage_count справочников - по одному пакетному UPDATE на справочник.
+
+    Положительные дельты вставляются через upsert, остальные только обновляют
+    существующие строки: отрицательная дельта без строки означает, что строка
+    уже удалена каскадом справочника.
+
+    Сюда приходят все записи операций (в том числе с нулевыми дельтами, например
+    правка комментария), поэтому здесь же меняется версия данных для кэша списка -
+    в той же транзакции после сводок: при откате версия не меняется, а читатель
+    не закэширует страницу под новой версией до фиксации изменений.
+    """
+    inserts = []
+    updates = []
+    earliest = None
+    for key, (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+        if amount and (earliest is None or key[0] < earliest):
+            earliest = key[0]
+        params = (connection.ops.adapt_datefield_value(key[0]),) + tuple(key[1:])
+        if count > 0:
+            inserts.append(params + (amount, count))
+        else:
+            updates.append((amount, count) + params)
+
+    with transaction.atomic():
+        if inserts or updates:
+            upsert, update = _rollup_sql()
+            with connection.cursor() as cursor:
+                if inserts:
+                    cursor.executemany(upsert, inserts)
+                if updates:
+                    cursor.executemany(update, updates)
+                for model, changes in usage_changes(deltas).items():
+                    if changes:
+                        table = connection.ops.quote_name(model._meta.db_table)
+                        cursor.executemany(f'UPDATE {table} SET usage_count = usage_count + %s WHERE id = %s', changes)
+            # Остатки на конец месяца после самой ранней изменённой даты больше не верны
+            if earliest is not None:
+                invalidate_checkpoints(earliest)
+        bump_data_version()
+
+
+def rebuild_usage_counts():
+    """Пересчитывает usage_count всех справочников по дневным сводкам"""
+    with transaction.atomic():
+        for model, field in zip(USAGE_MODELS, ROLLUP_KEY_FIELDS[1:]):
+            model.objects.update(usage_count=0)
+            rows = DailyRollup.objects.order_by().values_list(field).annotate(usage=Sum('count'))
+            changes = [(usage, pk) for pk, usage in rows if usage]
+            if changes:
+                table = connection.ops.quote_name(model._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.executemany(f'UPDATE {table} SET usage_count = %s WHERE id = %s', changes)
+
+
+def rebuild_rollups(batch_size=1000):
+    """
+    Полностью пересобирает сводку из операций, вместе с архивом (и сбрасывает
+    остатки на конец месяца, пересчитывает счётчики справочников)
+    """
+    with transaction.atomic():
+        DailyRollup.objects.all().delete()
+        invalidate_checkpoints()
+        rows = source_model().objects.order_by().values(*ROLLUP_KEY_FIELDS).annotate(
+            rollup_total=Sum('amount'), rollup_count=Count('id')
+        )
+        batch = []
+        created = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(DailyRollup(
+                total=row['rollup_total'],
+                count=row['rollup_count'],
+                **dict(zip(ROLLUP_KEY_FIELDS, rollup_key(row))),
+            ))
+            if len(batch) >= batch_size:
+                DailyRollup.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            DailyRollup.objects.bulk_create(batch)
+            created += len(batch)
+        rebuild_usage_counts()
+    return created
@@ -0,0 +1,96 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import ArchivedTransaction, Transaction
+
+# Индексы FTS5 рабочей таблицы и архива (миграции 0005 и 0011)
+SEARCH_TABLES = ('transactions_transaction_fts', 'transactions_archivedtransaction_fts')
+INSERT_TRIGGER = 'transactions_transaction_fts_insert'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из пользовательского текста: каждое слово в кавычках (без
+    операторов FTS) и с поиском по началу слова, слова объединяются через AND.
+    """
+    tokens = TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+
+def search_queryset(queryset, text, ranked=False):
+    """
+    Операции, в комментарии которых есть все слова text. ranked - порядок по
+    релевантности (bm25), затем по дате; иначе порядок queryset не меняется.
+    """
+    query = fts_query(text)
+    if query is None:
+        return queryset
+    if not search_available():
+        queryset = queryset.filter(_contains_all(text))
+        return queryset.order_by('-date', '-created_at', '-id') if ranked else queryset
+    if queryset.model is not Transaction:
+        # Вместе с архивом (CombinedTransaction): у каждой таблицы свой индекс с тем же
+        # токенизатором; bm25 двух индексов несравнимы, поэтому порядок - по дате
+        indexed = Transaction.objects.filter(search__comment__match=query).values('id')
+        archived = ArchivedTransaction.objects.filter(search__comment__match=query).values('id')
+        queryset = queryset.filter(Q(archived=False, id__in=indexed) | Q(archived=True, id__in=archived))
+        return queryset.order_by('-date', '-created_at', '-id') if ranked else queryset
+
+    queryset = queryset.filter(search__comment__match=query)
+    if ranked:
+        queryset = queryset.order_by('search__rank', '-date', '-created_at', '-id')
+    return queryset
+
+
+def _contains_all(text):
+    condition = Q()
+    for token in TOKEN_RE.findall(text):
+        condition &= Q(comment__icontains=token)
+    return condition
+
+
+def rebuild_search_index():
+    """Перестраивает индексы рабочей таблицы и архива и объединяет их сегменты"""
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            quoted = connection.ops.quote_name(table)
+            cursor.execute(f"INSERT INTO {quoted}({quoted}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {quoted}({quoted}) VALUES ('optimize')")
+
+
+def insert_indexed(cursor, sql, params):
+    """
+    Вставляет строки операций одним executemany (sql - INSERT в рабочую таблицу).
+
+    Построчный триггер FTS5 в несколько раз медленнее самой вставки, поэтому на
+    SQLite он на время вставки снимается, а новые строки попадают в индекс одним
+    INSERT ... SELECT. Вызывать внутри транзакции, уже взявшей блокировку записи:
+    новые id тогда больше прежнего максимума, а триггер создаётся заново до
+    фиксации, и другие соединения его отсутствия не видят.
+    """
+    if search_available():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = %s", [INSERT_TRIGGER])
+        trigger = cursor.fetchone()
+    else:
+        trigger = None
+    if trigger is None:
+        cursor.executemany(sql, params)
+        return
+
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    index = connection.ops.quote_name(SEARCH_TABLES[0])
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+    last_id = cursor.fetchone()[0]
+    cursor.execute(f'DROP TRIGGER {INSERT_TRIGGER}')
+    cursor.executemany(sql, params)
+    cursor.execute(f'INSERT INTO {index}(rowid, comment) SELECT id, comment FROM {table} WHERE id > %s', [last_id])
+    cursor.execute(trigger[0])
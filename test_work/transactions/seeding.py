@@ -0,0 +1,144 @@
+import json
+from pathlib import Path
+
+from django.db import transaction
+
+from .dictionary_cache import bump_version
+from .models import Status, TransactionType, Category, Subcategory
+
+DEFAULT_TREE_PATH = Path(__file__).resolve().parent / 'data' / 'initial_dictionaries.json'
+
+
+class SeedError(ValueError):
+    """Некорректный файл справочников"""
+
+
+def read_tree(path):
+    """
+    Читает дерево справочников из JSON или YAML:
+
+        statuses: [имя, ...]
+        transaction_types: {тип: {категория: [подкатегория, ...]}}
+    """
+    path = Path(path)
+    with open(path, encoding='utf-8') as stream:
+        if path.suffix.lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise SeedError('Для YAML-файлов установите PyYAML или используйте JSON')
+            data = yaml.safe_load(stream)
+        else:
+            data = json.load(stream)
+
+    if not isinstance(data, dict):
+        raise SeedError('Файл должен содержать объект со statuses и transaction_types')
+    statuses = data.get('statuses') or []
+    types = data.get('transaction_types') or {}
+    if not isinstance(statuses, list) or not isinstance(types, dict):
+        raise SeedError('statuses должен быть списком, transaction_types - объектом')
+    for type_name, categories in types.items():
+        if not isinstance(categories, dict):
+            raise SeedError(f'Категории типа "{type_name}" должны быть объектом')
+        for category_name, subcategories in categories.items():
+            if not isinstance(subcategories, list):
+                raise SeedError(f'Подкатегории категории "{category_name}" должны быть списком')
+    return data
+
+
+class TreeDiff:
+    """Узлы дерева из файла, которых нет в БД (и узлы БД, которых нет в файле)"""
+
+    def __init__(self, tree):
+        types = tree.get('transaction_types') or {}
+        self.statuses = list(dict.fromkeys(tree.get('statuses') or []))
+        self.types = list(types)
+        self.categories = [
+            (type_name, category_name)
+            for type_name, categories in types.items()
+            for category_name in categories
+        ]
+        self.subcategories = list(dict.fromkeys(
+            (type_name, category_name, subcategory_name)
+            for type_name, categories in types.items()
+            for category_name, subcategories in categories.items()
+            for subcategory_name in subcategories
+        ))
+
+        # Одно чтение на уровень, сравнение по названиям
+        existing_statuses = set(Status.objects.values_list('name', flat=True))
+        existing_types = set(TransactionType.objects.values_list('name', flat=True))
+        existing_categories = set(Category.objects.values_list('transaction_type__name', 'name'))
+        existing_subcategories = set(Subcategory.objects.values_list(
+            'category__transaction_type__name', 'category__name', 'name'
+        ))
+
+        self.new_statuses = [name for name in self.statuses if name not in existing_statuses]
+        self.new_types = [name for name in self.types if name not in existing_types]
+        self.new_categories = [key for key in self.categories if key not in existing_categories]
+        self.new_subcategories = [key for key in self.subcategories if key not in existing_subcategories]
+
+        self.extra_statuses = sorted(existing_statuses - set(self.statuses))
+        self.extra_types = sorted(existing_types - set(self.types))
+        self.extra_categories = sorted(existing_categories - set(self.categories))
+        self.extra_subcategories = sorted(existing_subcategories - set(self.subcategories))
+
+    @property
+    def has_changes(self):
+        return bool(self.new_statuses or self.new_types or self.new_categories or self.new_subcategories)
+
+    def lines(self):
+        for name in self.new_statuses:
+            yield f'+ статус: {name}'
+        for name in self.new_types:
+            yield f'+ тип: {name}'
+        for type_name, name in self.new_categories:
+            yield f'+ категория: {name} ({type_name})'
+        for type_name, category_name, name in self.new_subcategories:
+            yield f'+ подкатегория: {name} ({category_name}, {type_name})'
+        for name in self.extra_statuses:
+            yield f'? статус есть только в БД: {name}'
+        for name in self.extra_types:
+            yield f'? тип есть только в БД: {name}'
+        for type_name, name in self.extra_categories:
+            yield f'? категория есть только в БД: {name} ({type_name})'
+        for type_name, category_name, name in self.extra_subcategories:
+            yield f'? подкатегория есть только в БД: {name} ({category_name}, {type_name})'
+
+
+def apply_diff(diff):
+    """
+    Создаёт недостающие узлы по уровням: один bulk_create на уровень в одном atomic-блоке.
+
+    Узлы справочников состоят только из ключа (название и родитель), поэтому
+    обновлять у существующих строк нечего - конфликты просто пропускаются.
+    Узлы, которых нет в файле, не удаляются.
+    """
+    with transaction.atomic():
+        Status.objects.bulk_create(
+            [Status(name=name) for name in diff.new_statuses], ignore_conflicts=True
+        )
+        TransactionType.objects.bulk_create(
+            [TransactionType(name=name) for name in diff.new_types], ignore_conflicts=True
+        )
+
+        type_ids = dict(TransactionType.objects.values_list('name', 'id'))
+        Category.objects.bulk_create(
+            [Category(name=name, transaction_type_id=type_ids[type_name]) for type_name, name in diff.new_categories],
+            ignore_conflicts=True,
+        )
+
+        if diff.new_subcategories:
+            category_ids = {
+                (type_name, name): pk
+                for pk, type_name, name in Category.objects.values_list('id', 'transaction_type__name', 'name')
+            }
+            Subcategory.objects.bulk_create(
+                [
+                    Subcategory(name=name, category_id=category_ids[(type_name, category_name)])
+                    for type_name, category_name, name in diff.new_subcategories
+                ],
+                ignore_conflicts=True,
+            )
+        # bulk_create не отправляет сигналы, поэтому сбрасываем кэш справочников явно
+        bump_version()
@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .dictionary_cache import DictionaryTree, get_tree
+from .models import Transaction, Status, TransactionType, Category, Subcategory
+from .rollups import add_delta, apply_deltas, instance_rollup_key, rollup_key
+
+# Максимальное количество операций в одном пакетном запросе
+BULK_MAX_ITEMS = 5000
+
+
+def requested_fields(request, serializer_class):
+    """
+    Поля из параметра ?fields=id,date,amount или None, если параметр не передан.
+    Неизвестные поля - ошибка запроса.
+    """
+    value = request.query_params.get('fields') if request is not None else None
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in serializer_class.Meta.fields]
+    if unknown:
+        raise serializers.ValidationError({'fields': [f'Неизвестные поля: {", ".join(unknown)}']})
+    return fields
+
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля из ?fields= (при чтении)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        fields = requested_fields(request, type(self))
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DictionaryField(serializers.PrimaryKeyRelatedField):
+    """Внешний ключ на справочник: id проверяется по кэшу справочников без запроса к БД"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        model = self.get_queryset().model
+        node = get_tree().get(model, pk)
+        if node is None:
+            self.fail('does_not_exist', pk_value=data)
+        return DictionaryTree.instance(model, node)
+
+
+class StatusSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Status
+        fields = ['id', 'name']
+
+
+class TransactionTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = TransactionType
+        fields = ['id', 'name']
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'transaction_type']
+
+
+class SubcategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Subcategory
+        fields = ['id', 'name', 'category']
+
+
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Операция с плоскими id справочников"""
+
+    serializer_related_field = DictionaryField
+
+    class Meta:
+        model = Transaction
+        fields = ['id', 'date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment',
+                  'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+    def _current_id(self, attrs, name):
+        if name in attrs:
+            return attrs[name].pk
+        return getattr(self.instance, f'{name}_id', None)
+
+    def validate(self, attrs):
+        """Категория должна относиться к типу операции, подкатегория - к категории"""
+        errors = get_tree().hierarchy_errors(
+            *(self._current_id(attrs, name) for name in ('transaction_type', 'category', 'subcategory'))
+        )
+        if errors:
+            raise serializers.ValidationError({field: [message] for field, message in errors.items()})
+        return attrs
+
+
+class TransactionBulkListSerializer(serializers.ListSerializer):
+    """
+    Пакет операций: элементы без id создаются одним bulk_create, элементы с id
+    обновляются одним bulk_update. Дневные сводки обновляются теми же пакетными
+    дельтами, что и при импорте.
+    """
+
+    def validate(self, attrs):
+        ids = [item['id'] for item in attrs if item.get('id') is not None]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError('Операция с одним id передана несколько раз')
+        return attrs
+
+    def create(self, validated_data):
+        ids = [item['id'] for item in validated_data if item.get('id') is not None]
+        objects = []
+        created = []
+        updated = []
+        deltas = {}
+        with transaction.atomic():
+            # Обновляемые операции читаются одним запросом внутри транзакции записи (с блокировкой
+            # строк там, где она есть): дельты сводок считаются от значений, которые перезаписываются
+            existing = Transaction.objects.select_for_update().in_bulk(ids)
+            missing = [pk for pk in ids if pk not in existing]
+            if missing:
+                raise serializers.ValidationError(f'Не найдены операции: {", ".join(map(str, missing))}')
+            now = timezone.now()
+            for item in validated_data:
+                pk = item.pop('id', None)
+                if pk is None:
+                    obj = Transaction(**item)
+                    created.append(obj)
+                    objects.append(obj)
+                    continue
+                obj = existing[pk]
+                previous = obj._loaded_values
+                add_delta(deltas, rollup_key(previous), -previous['amount'], -1)
+                for name, value in item.items():
+                    setattr(obj, name, value)
+                # bulk_update не вызывает pre_save, поэтому auto_now выставляем сами
+                obj.updated_at = now
+                updated.append(obj)
+                objects.append(obj)
+
+            Transaction.objects.bulk_create(created)
+            if updated:
+                Transaction.objects.bulk_update(
+                    updated,
+                    ['date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment',
+                     'updated_at'],
+                )
+            for obj in objects:
+                add_delta(deltas, instance_rollup_key(obj), obj.amount, 1)
+            apply_deltas(deltas)
+        return objects
+
+
+class TransactionBulkSerializer(TransactionSerializer):
+    """Элемент пакета: как TransactionSerializer, но id можно передать для обновления"""
+
+    id = serializers.IntegerField(required=False, min_value=1)
+
+    class Meta(TransactionSerializer.Meta):
+        list_serializer_class = TransactionBulkListSerializer
@@ -0,0 +1,77 @@
+from django.db.backends.signals import connection_created
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .balance import invalidate_checkpoints
+from .database import apply_pragmas
+from .dictionary_cache import bump_version
+from .models import (
+    Transaction, Status, TransactionType, Category, Subcategory, TransactionTombstone,
+)
+from .rollups import ROLLUP_KEY_FIELDS, add_delta, apply_deltas, instance_rollup_key, rollup_key
+
+ROLLUP_VALUE_FIELDS = ROLLUP_KEY_FIELDS + ('amount',)
+
+
+def _stored_rollup_values(instance):
+    """Значения ключа и суммы, которые сейчас учтены в сводке для этой транзакции"""
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if all(field in loaded and loaded[field] is not DEFERRED for field in ROLLUP_VALUE_FIELDS):
+        return loaded
+    return Transaction.objects.filter(pk=instance.pk).values(*ROLLUP_VALUE_FIELDS).first()
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_rollup(sender, instance, **kwargs):
+    instance._previous_rollup = None
+    if not instance._state.adding:
+        instance._previous_rollup = _stored_rollup_values(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance, **kwargs):
+    deltas = {}
+    previous = getattr(instance, '_previous_rollup', None)
+    if previous:
+        add_delta(deltas, rollup_key(previous), -previous['amount'], -1)
+    add_delta(deltas, instance_rollup_key(instance), instance.amount, 1)
+    apply_deltas(deltas)
+
+    instance._loaded_values = {field: getattr(instance, field) for field in ROLLUP_VALUE_FIELDS}
+    instance._previous_rollup = None
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    apply_deltas({instance_rollup_key(instance): (-instance.amount, -1)})
+
+
+@receiver(post_delete, sender=Transaction)
+def record_tombstone(sender, instance, **kwargs):
+    # Для ленты изменений (changes.py); массовое удаление пишет отметки в bulk.delete
+    TransactionTombstone.objects.create(transaction_id=instance.pk)
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_save, sender=TransactionType)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Status)
+@receiver(post_delete, sender=TransactionType)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Subcategory)
+def invalidate_dictionary_cache(sender, **kwargs):
+    bump_version()
+
+
+@receiver(post_save, sender=TransactionType)
+@receiver(post_delete, sender=TransactionType)
+def reset_balance_checkpoints(sender, **kwargs):
+    # Знак операции в остатке зависит от названия типа
+    invalidate_checkpoints()
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    apply_pragmas(connection)
@@ -1,3 +1,1324 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import re
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .forms import TransactionFilterForm
+from .models import Transaction, Status, TransactionType, Category, Subcategory, DailyRollup
+from .pagination import KeysetPaginator
+from .rollups import ROLLUP_KEY_FIELDS, rebuild_rollups
+from .views import transaction_list_queryset
+
+
+FILTER_FIELDS = ['date_from', 'date_to', 'status', 'transaction_type', 'category', 'subcategory']
+CSRF_TOKEN_RE = re.compile(rb'name="csrfmiddlewaretoken" value="[^"]*"')
+
+
+class TransactionsTestCase(TestCase):
+    def setUp(self):
+        # Откат транзакции теста не сбрасывает версию справочников в кэше
+        cache.clear()
+
+
+class TransactionListQueryPlanTests(TransactionsTestCase):
+    """Каждая комбинация фильтров списка операций должна идти по индексу без временной сортировки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.transaction_type = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.transaction_type)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+        today = date.today()
+        for days_ago in range(30):
+            Transaction.objects.create(
+                date=today - timedelta(days=days_ago),
+                status=cls.status,
+                transaction_type=cls.transaction_type,
+                category=cls.category,
+                subcategory=cls.subcategory,
+                amount=Decimal('100.00'),
+            )
+
+    def filter_data(self, fields):
+        values = {
+            'date_from': (date.today() - timedelta(days=20)).isoformat(),
+            'date_to': (date.today() - timedelta(days=5)).isoformat(),
+            'status': self.status.pk,
+            'transaction_type': self.transaction_type.pk,
+            'category': self.category.pk,
+            'subcategory': self.subcategory.pk,
+        }
+        return {field: values[field] for field in fields}
+
+    def assertUsesIndexWithoutSort(self, queryset, label):
+        plan = queryset.explain()
+        table_steps = [line for line in plan.splitlines() if 'transactions_transaction ' in line]
+        self.assertTrue(table_steps, plan)
+        for step in table_steps:
+            self.assertIn('USING INDEX trx_', step, f'{label}: запрос не использует индекс\n{plan}')
+        self.assertNotIn('TEMP B-TREE', plan, f'{label}: запрос использует временную сортировку\n{plan}')
+
+    def test_every_filter_combination_uses_index(self):
+        anchor = Transaction.objects.order_by('-date', '-created_at', '-id')[10]
+        cursors = {
+            'first page': None,
+            'next page': KeysetPaginator.encode_cursor(anchor),
+            'previous page': KeysetPaginator.encode_cursor(anchor, reverse=True),
+        }
+
+        for size in range(len(FILTER_FIELDS) + 1):
+            for fields in itertools.combinations(FILTER_FIELDS, size):
+                form = TransactionFilterForm(self.filter_data(fields))
+                self.assertTrue(form.is_valid(), form.errors)
+                paginator = KeysetPaginator(form.filter_queryset(transaction_list_queryset()))
+
+                for cursor_label, cursor in cursors.items():
+                    position = KeysetPaginator.decode_cursor(cursor)
+                    queryset = paginator.page_queryset(position)[:paginator.per_page + 1]
+                    self.assertUsesIndexWithoutSort(queryset, f'{fields or "без фильтров"}, {cursor_label}')
+
+    def test_keyset_pages_across_ties(self):
+        # Пять операций с одинаковыми датой и временем создания: порядок решает id
+        tied = Transaction.objects.order_by('id')[:5]
+        Transaction.objects.filter(pk__in=[row.pk for row in tied]).update(
+            date=date.today() - timedelta(days=3), created_at=tied[0].created_at
+        )
+        expected = list(Transaction.objects.order_by('-date', '-created_at', '-id').values_list('id', flat=True))
+        paginator = KeysetPaginator(Transaction.objects.all(), per_page=7, count_limit=None)
+
+        pages = [paginator.get_page()]
+        self.assertFalse(pages[0].has_previous)
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([row.pk for page in pages for row in page], expected)
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+        self.assertEqual(pages[-1].total, 30)
+
+        # Назад от последней страницы - те же страницы в обратном порядке
+        page = pages[-1]
+        backward = [[row.pk for row in page]]
+        while page.has_previous:
+            page = paginator.get_page(page.previous_cursor)
+            backward.append([row.pk for row in page])
+        self.assertEqual(backward[::-1], [[row.pk for row in page] for page in pages])
+        self.assertFalse(page.has_previous)
+
+        # Некорректный курсор - первая страница
+        self.assertEqual([row.pk for row in paginator.get_page('не-курсор')], expected[:7])
+
+
+class DailyRollupTests(TransactionsTestCase):
+    """Дневная сводка поддерживается дельтами и совпадает с полной пересборкой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.other_category = Category.objects.create(name='Инфраструктура', transaction_type=cls.expense)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+        cls.other_subcategory = Subcategory.objects.create(name='VPS', category=cls.other_category)
+
+    def create_transaction(self, amount, **kwargs):
+        values = {
+            'date': date(2025, 1, 10),
+            'status': self.status,
+            'transaction_type': self.expense,
+            'category': self.category,
+            'subcategory': self.subcategory,
+            'amount': Decimal(amount),
+        }
+        values.update(kwargs)
+        return Transaction.objects.create(**values)
+
+    def rollup_state(self):
+        return sorted(
+            DailyRollup.objects.filter(count__gt=0).values_list(*ROLLUP_KEY_FIELDS, 'total', 'count')
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollup_state()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollup_state())
+
+    def test_create_edit_delete(self):
+        first = self.create_transaction('100.00')
+        self.create_transaction('50.00')
+        rollup = DailyRollup.objects.get()
+        self.assertEqual((rollup.total, rollup.count), (Decimal('150.00'), 2))
+
+        response = self.client.post(reverse('transaction_edit', args=[first.pk]), {
+            'date': '2025-02-01',
+            'status': self.status.pk,
+            'transaction_type': self.expense.pk,
+            'category': self.other_category.pk,
+            'subcategory': self.other_subcategory.pk,
+            'amount': '70.00',
+            'comment': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertMatchesRebuild()
+
+        self.client.post(reverse('transaction_delete', args=[first.pk]))
+        self.assertMatchesRebuild()
+
+    def test_data_version_rolls_back_with_write(self):
+        from . import list_cache
+
+        self.create_transaction('100.00')
+        version = list_cache.data_version()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.create_transaction('50.00')
+            raise RuntimeError
+        self.assertEqual(list_cache.data_version(), version)
+        self.create_transaction('50.00')
+        self.assertNotEqual(list_cache.data_version(), version)
+
+    def test_bulk_write_times_are_read_after_first_write(self):
+        from . import bulk
+        from .models import TransactionTombstone
+
+        first = self.create_transaction('100.00')
+        second = self.create_transaction('50.00')
+        clock_reads = []
+        real_now = timezone.now
+
+        def now():
+            # Без BEGIN IMMEDIATE блокировку берёт только первая запись в транзакции
+            clock_reads.append([query['sql'].split()[0] for query in queries.captured_queries])
+            return real_now()
+
+        with CaptureQueriesContext(connection) as queries, mock.patch.object(bulk.timezone, 'now', now):
+            bulk.set_status(Transaction.objects.filter(pk=first.pk), self.status)
+            bulk.delete(Transaction.objects.filter(pk=second.pk))
+        self.assertEqual(len(clock_reads), 2)
+        for statements in clock_reads:
+            # В тесте atomic-блок действия - точка сохранения внутри транзакции теста
+            opened = len(statements) - statements[::-1].index('SAVEPOINT')
+            self.assertTrue({'INSERT', 'UPDATE'} & set(statements[opened:]), statements)
+        first.refresh_from_db()
+        self.assertGreaterEqual(TransactionTombstone.objects.get(transaction_id=second.pk).deleted_at,
+                                first.updated_at)
+
+    def test_bulk_actions(self):
+        first = self.create_transaction('100.00')
+        second = self.create_transaction('50.00', date=date(2025, 2, 1))
+        self.create_transaction('20.00', date=date(2025, 3, 1))
+        other_status = Status.objects.create(name='Личное')
+        url = reverse('transaction_bulk')
+
+        # Отмеченные строки - одним UPDATE
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'action': 'status', 'status': other_status.pk,
+                                              'ids': [first.pk, second.pk]})
+        self.assertRedirects(response, reverse('transaction_list'), fetch_redirect_response=False)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "transactions_transaction"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Transaction.objects.filter(status=other_status).count(), 2)
+        self.assertMatchesRebuild()
+
+        # Все операции под фильтрами списка
+        response = self.client.post(f'{url}?date_from=2025-02-01', {
+            'action': 'category', 'category': self.other_category.pk, 'subcategory': self.other_subcategory.pk,
+            'apply_to_all': 'on',
+        })
+        self.assertEqual(response.url, f'{reverse("transaction_list")}?date_from=2025-02-01')
+        self.assertEqual(Transaction.objects.filter(category=self.other_category).count(), 2)
+        self.assertMatchesRebuild()
+
+        # Подкатегория чужой категории отклоняется целиком
+        self.client.post(url, {'action': 'category', 'category': self.category.pk,
+                               'subcategory': self.other_subcategory.pk, 'apply_to_all': 'on'})
+        self.assertEqual(Transaction.objects.filter(category=self.category).count(), 1)
+
+        self.client.post(f'{url}?status={other_status.pk}', {'action': 'delete', 'apply_to_all': 'on'})
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertMatchesRebuild()
+
+    def usage_counts(self):
+        return [
+            list(model.objects.order_by('id').values_list('usage_count', flat=True))
+            for model in (Status, TransactionType, Category, Subcategory)
+        ]
+
+    def test_protected_dictionary_delete_and_reassign(self):
+        self.create_transaction('10.00')
+        moved = self.create_transaction('20.00', category=self.other_category, subcategory=self.other_subcategory)
+        self.create_transaction('30.00', category=self.other_category, subcategory=self.other_subcategory)
+        self.assertEqual(self.usage_counts(), [[3], [3], [1, 2], [1, 2]])
+
+        # Удаление используемой записи отклоняется по счётчику, без выборки операций
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('delete_category', args=[self.other_category.pk]))
+        self.assertTrue(Category.objects.filter(pk=self.other_category.pk).exists())
+        self.assertFalse([query for query in queries if 'transactions_transaction"' in query['sql']])
+
+        moved.comment = 'Перенос'
+        moved.save()
+        self.client.post(reverse('delete_category', args=[self.other_category.pk]), {'target': self.subcategory.pk})
+        self.assertFalse(Category.objects.filter(pk=self.other_category.pk).exists())
+        self.assertEqual(Transaction.objects.filter(category=self.category).count(), 3)
+        self.assertEqual(self.usage_counts(), [[3], [3], [3], [3]])
+        self.assertMatchesRebuild()
+        self.assertEqual(self.usage_counts(), [[3], [3], [3], [3]])
+
+        # Счётчик разошёлся с данными: ссылку из архива находит проверка по таблицам,
+        # а не ошибка внешнего ключа при фиксации
+        from .archive import archive_rows
+
+        archive_rows(date(2100, 1, 1))
+        Category.objects.filter(pk=self.category.pk).update(usage_count=0)
+        response = self.client.post(reverse('delete_category', args=[self.category.pk]), follow=True)
+        self.assertContains(response, f'Невозможно удалить категорию &quot;{self.category.name}&quot;')
+        self.assertTrue(Category.objects.filter(pk=self.category.pk).exists())
+
+    def test_report_uses_rollup(self):
+        self.create_transaction('10.00')
+        self.create_transaction('15.00', date=date(2025, 1, 20))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cash_flow_report'), {'period': 'month'})
+        self.assertFalse([query for query in queries if 'transactions_transaction"' in query['sql']])
+        rows = list(response.context['rows'])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['period_total'], Decimal('25.00'))
+        self.assertEqual(rows[0]['period_count'], 2)
+
+
+class ImportTransactionsTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.income = TransactionType.objects.create(name='Пополнение')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        Category.objects.create(name='Зарплата', transaction_type=cls.income)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+
+    def test_import_csv_with_error_report(self):
+        rows = [
+            ['2025-01-10', 'Бизнес', 'Списание', 'Маркетинг', 'Avito', '1 200,50', 'Реклама'],
+            ['10.01.2025', 'Бизнес', 'Списание', 'Маркетинг', 'Avito', '99.5', ''],
+            ['2025-01-10', 'Бизнес', 'Списание', 'Зарплата', 'Avito', '10', 'чужая категория'],
+            ['2025-01-10', 'Бизнес', 'Списание', 'Маркетинг', 'Avito', '0', 'нулевая сумма'],
+            ['2025-02-30', 'Бизнес', 'Списание', 'Маркетинг', 'Avito', '10', 'нет такой даты'],
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory) / 'statement.csv'
+            errors = Path(directory) / 'errors.csv'
+            with open(source, 'w', newline='', encoding='utf-8') as stream:
+                writer = csv.writer(stream)
+                writer.writerow(['date', 'status', 'transaction_type', 'category', 'subcategory', 'amount', 'comment'])
+                writer.writerows(rows)
+
+            call_command('import_transactions', str(source), errors=str(errors), stdout=io.StringIO())
+
+            with open(errors, encoding='utf-8') as stream:
+                reported = [int(row['line']) for row in csv.DictReader(stream)]
+
+        self.assertEqual(reported, [4, 5, 6])
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('amount', flat=True)),
+            [Decimal('99.50'), Decimal('1200.50')],
+        )
+        rollup = DailyRollup.objects.get()
+        self.assertEqual((rollup.total, rollup.count), (Decimal('1300.00'), 2))
+
+    def test_insert_rows_limits_transaction_size(self):
+        from .importing import ROW_FIELDS, insert_rows
+
+        rows = [
+            (date(2025, 1, day), self.status.pk, self.expense.pk, self.category.pk, self.subcategory.pk,
+             Decimal('10.00'), '')
+            for day in range(1, 6)
+        ]
+        with mock.patch('transactions.importing.INSERT_TRANSACTION_ROWS', 2), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(insert_rows(rows), 5)
+        statements = [query['sql'] for query in queries]
+        inserts = [index for index, sql in enumerate(statements) if 'INSERT INTO "transactions_transaction"' in sql]
+        self.assertEqual(len(inserts), 3)
+        # В каждой транзакции строки пишутся после сводок, когда блокировка записи уже взята
+        for previous, index in zip([-1] + inserts, inserts):
+            self.assertIn('transactions_dailyrollup', ' '.join(statements[previous + 1:index]))
+        self.assertEqual(DailyRollup.objects.count(), 5)
+
+        # Поисковый индекс пополняется пачкой, а триггер после вставки снова на месте
+        from .search import search_queryset
+        rows = [row[:6] + (f'Импорт {day}',) for day, row in enumerate(rows, start=1)]
+        insert_rows(rows)
+        self.assertEqual(search_queryset(Transaction.objects.all(), 'импорт').count(), 5)
+        Transaction.objects.create(**dict(zip(ROW_FIELDS, rows[0][:6] + ('Импорт вручную',))))
+        self.assertEqual(search_queryset(Transaction.objects.all(), 'вручную').count(), 1)
+
+    def test_malformed_json_array(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory) / 'statement.json'
+            source.write_text('[{"date": "2025-01-10",', encoding='utf-8')
+            with self.assertRaisesMessage(CommandError, 'statement.json'):
+                call_command('import_transactions', str(source), stdout=io.StringIO())
+        self.assertFalse(Transaction.objects.exists())
+
+class SeedingCommandTests(TransactionsTestCase):
+    def test_load_test_transactions_is_reproducible(self):
+        from .dictionary_cache import get_tree
+
+        call_command('load_initial_data', stdout=io.StringIO())
+        options = {'count': 300, 'seed': 42, 'end_date': date(2025, 1, 31), 'days': 90, 'category_skew': 1.1,
+                   'batch_size': 120, 'stdout': io.StringIO()}
+        fields = ['date', 'status_id', 'transaction_type_id', 'category_id', 'subcategory_id', 'amount', 'comment']
+        call_command('load_test_transactions', **options)
+        first = list(Transaction.objects.order_by('id').values_list(*fields))
+        call_command('load_test_transactions', **options)
+        second = list(Transaction.objects.order_by('id').values_list(*fields))[len(first):]
+
+        self.assertEqual(len(first), 300)
+        self.assertEqual(first, second)
+        tree = get_tree()
+        for row in first:
+            self.assertEqual(tree.hierarchy_errors(*row[2:5]), {})
+            self.assertTrue(date(2024, 11, 3) <= row[0] <= date(2025, 1, 31))
+        self.assertEqual(sum(DailyRollup.objects.values_list('count', flat=True)), 600)
+
+    def test_load_initial_data_dry_run_and_repeat(self):
+        models = (Status, TransactionType, Category, Subcategory)
+        output = io.StringIO()
+        call_command('load_initial_data', dry_run=True, stdout=output)
+        self.assertIn('+ статус:', output.getvalue())
+        self.assertEqual([model.objects.count() for model in models], [0, 0, 0, 0])
+
+        call_command('load_initial_data', stdout=io.StringIO())
+        counts = [model.objects.count() for model in models]
+        self.assertTrue(all(counts))
+
+        # Повторная загрузка ничего не добавляет, записи только из БД показываются, но не удаляются
+        Status.objects.create(name='Только в БД')
+        output = io.StringIO()
+        call_command('load_initial_data', stdout=output)
+        self.assertIn('статусов 0, типов 0, категорий 0, подкатегорий 0', output.getvalue())
+        self.assertIn('? статус есть только в БД: Только в БД', output.getvalue())
+        self.assertEqual([model.objects.count() for model in models], [counts[0] + 1] + counts[1:])
+
+
+class DictionaryCacheTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+
+    def dictionary_queries(self, queries):
+        tables = ('transactions_status"', 'transactions_transactiontype"', 'transactions_category"',
+                  'transactions_subcategory"')
+        # Счётчики usage_count на странице справочников читаются всегда, сам снимок - нет
+        return [query['sql'] for query in queries if query['sql'].startswith('SELECT')
+                and any(f'FROM "{table}' in query['sql'] for table in tables) and 'usage_count' not in query['sql']]
+
+    def test_warm_requests_do_not_query_dictionaries(self):
+        requests = [
+            (reverse('transaction_list'), {}),
+            (reverse('transaction_create'), {}),
+            (reverse('dictionaries'), {}),
+            (reverse('ajax_load_categories'), {'transaction_type': self.expense.pk}),
+            (reverse('ajax_load_subcategories'), {'category': self.category.pk}),
+        ]
+        self.client.get(reverse('dictionaries'))
+        for url, params in requests:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.dictionary_queries(queries), [], url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('transaction_create'), {
+                'date': '2025-01-10',
+                'status': self.status.pk,
+                'transaction_type': self.expense.pk,
+                'category': self.category.pk,
+                'subcategory': self.subcategory.pk,
+                'amount': '10.00',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.dictionary_queries(queries), [])
+
+    def test_form_rejects_broken_hierarchy_without_queries(self):
+        from .forms import TransactionForm
+
+        income = TransactionType.objects.create(name='Пополнение')
+        salary = Category.objects.create(name='Зарплата', transaction_type=income)
+        advance = Subcategory.objects.create(name='Аванс', category=salary)
+        data = {
+            'date': '2025-01-10',
+            'status': self.status.pk,
+            'transaction_type': income.pk,
+            'category': self.category.pk,
+            'subcategory': advance.pk,
+            'amount': '10.00',
+        }
+        TransactionForm(data).is_valid()
+        with CaptureQueriesContext(connection) as queries:
+            form = TransactionForm(data)
+            self.assertFalse(form.is_valid())
+        self.assertEqual(self.dictionary_queries(queries), [])
+        self.assertEqual(form.errors['category'], ['Категория «Маркетинг» относится к типу «Списание», а не «Пополнение»'])
+        self.assertEqual(form.errors['subcategory'], ['Подкатегория «Аванс» относится к категории «Зарплата», '
+                                                      'а не «Маркетинг»'])
+
+    def test_dictionary_change_invalidates_tree(self):
+        response = self.client.get(reverse('ajax_load_categories'), {'transaction_type': self.expense.pk})
+        self.assertEqual([row['name'] for row in response.json()], ['Маркетинг'])
+
+        Category.objects.create(name='Инфраструктура', transaction_type=self.expense)
+        response = self.client.get(reverse('ajax_load_categories'), {'transaction_type': self.expense.pk})
+        self.assertEqual([row['name'] for row in response.json()], ['Инфраструктура', 'Маркетинг'])
+
+        # Изменение из другого процесса: видна только новая версия в БД, кэш процесса о ней не знает
+        from .dictionary_cache import bump_version
+        Category.objects.bulk_create([Category(name='Аренда', transaction_type=self.expense)])
+        bump_version()
+        cache.clear()
+        response = self.client.get(reverse('ajax_load_categories'), {'transaction_type': self.expense.pk})
+        self.assertEqual([row['name'] for row in response.json()], ['Аренда', 'Инфраструктура', 'Маркетинг'])
+
+    def test_dictionary_tree_revalidation(self):
+        url = reverse('ajax_dictionary_tree')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(response.json()['categories'], [[self.category.pk, 'Маркетинг', self.expense.pk]])
+        etag = response['ETag']
+
+        # Только версия справочников из БД
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        Subcategory.objects.create(name='Farpost', category=self.category)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class TransactionAdminTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+
+    def create_transactions(self, count, start):
+        for offset in range(count):
+            Transaction.objects.create(
+                date=start + timedelta(days=offset * 7),
+                status=self.status,
+                transaction_type=self.expense,
+                category=self.category,
+                subcategory=self.subcategory,
+                amount=Decimal('100.00'),
+            )
+
+    def changelist_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:transactions_transaction_changelist'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        self.client.force_login(self.user)
+        self.create_transactions(3, start=date(2024, 12, 20))
+        self.changelist_queries()
+        _, small = self.changelist_queries()
+
+        self.create_transactions(20, start=date(2025, 3, 1))
+        response, large = self.changelist_queries()
+        self.assertEqual(len(large), len(small))
+        self.assertLessEqual(len(large), 12)
+        self.assertEqual(response.context['cl'].result_count, 23)
+        self.assertFalse(any('COUNT(*)' in query['sql'] and 'transactions_transaction"' in query['sql']
+                             and 'WHERE' not in query['sql'] for query in large))
+
+        # Месяцы для date_hierarchy находятся переходами по индексу, а не DISTINCT по таблице
+        response, _ = self.changelist_queries({'date__year': 2025, 'status__id__exact': self.status.pk})
+        queryset = response.context['cl'].queryset
+        expected = sorted({value.replace(day=1) for value in queryset.values_list('date', flat=True)})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(queryset.dates('date', 'month'), expected)
+        self.assertEqual(len(queries), len(expected) + 1)
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in queries))
+        self.assertEqual(response.context['cl'].result_count, 21)
+
+    def test_changelist_counts_with_archive_and_pages_past_the_cap(self):
+        from .admin import TransactionAdmin
+
+        self.client.force_login(self.user)
+        self.create_transactions(23, start=date(2025, 1, 1))
+        call_command('archive_transactions', before='2025-03-01', stdout=io.StringIO())
+        # Строка задним числом после переноса остаётся в рабочей таблице
+        self.create_transactions(1, start=date(2025, 1, 2))
+        response, queries = self.changelist_queries()
+        self.assertEqual(response.context['cl'].result_count, Transaction.objects.count())
+        self.assertFalse([query for query in queries if 'COUNT(*)' in query['sql']
+                          and 'transactions_archivedtransaction' in query['sql']])
+
+        # Отфильтрованный список считается на ADMIN_COUNT_LIMIT строк дальше текущей страницы
+        params = {'date__year': 2025}
+        with mock.patch('transactions.admin.ADMIN_COUNT_LIMIT', 3), \
+                mock.patch.object(TransactionAdmin, 'list_per_page', 2):
+            response, _ = self.changelist_queries(params)
+            self.assertEqual(response.context['cl'].result_count, 5)
+            self.assertContains(response, 'Найдено больше 5 операций')
+            response, _ = self.changelist_queries({**params, 'p': 3})
+            self.assertEqual(response.context['cl'].result_count, 9)
+            self.assertEqual(len(response.context['cl'].result_list), 2)
+            response, _ = self.changelist_queries({**params, 'p': 7})
+            self.assertEqual(response.context['cl'].result_count, 15)
+            self.assertNotContains(response, 'Найдено больше')
+
+
+class TransactionApiTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.income = TransactionType.objects.create(name='Пополнение')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+        cls.salary = Category.objects.create(name='Зарплата', transaction_type=cls.income)
+        cls.user = User.objects.create_user('api', password='password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def item(self, **values):
+        data = {
+            'date': '2025-01-10',
+            'status': self.status.pk,
+            'transaction_type': self.expense.pk,
+            'category': self.category.pk,
+            'subcategory': self.subcategory.pk,
+            'amount': '100.00',
+            'comment': 'Оплата',
+        }
+        data.update(values)
+        return data
+
+    def test_list_cursor_filters_and_fields(self):
+        self.client.post(reverse('api-transaction-bulk'), [
+            self.item(date=f'2025-01-{day:02d}') for day in range(1, 6)
+        ], content_type='application/json')
+
+        url = reverse('api-transaction-list')
+        response = self.client.get(url, {'page_size': 2, 'date_from': '2025-01-02', 'fields': 'id,date'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'], [
+            {'id': row.pk, 'date': row.date.isoformat()}
+            for row in Transaction.objects.filter(date__gte='2025-01-02')[:2]
+        ])
+        self.assertIsNone(data['previous'])
+
+        # Сессия и пользователь, затем одна выборка операций
+        with self.assertNumQueries(3):
+            data = self.client.get(data['next']).json()
+        self.assertEqual([row['date'] for row in data['results']], ['2025-01-03', '2025-01-02'])
+        self.assertIsNone(data['next'])
+
+        self.assertEqual(self.client.get(url, {'fields': 'id,owner'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'status': 'unknown'}).status_code, 400)
+
+    def test_bulk_create_and_update(self):
+        url = reverse('api-transaction-bulk')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, [self.item(), self.item(amount='50.00')], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Справочники проверяются по кэшу, операции пишутся одним INSERT
+        self.assertEqual(
+            [query['sql'].split(' (')[0] for query in queries if '"transactions_transaction"' in query['sql']],
+            ['INSERT INTO "transactions_transaction"'],
+        )
+        first, second = response.json()
+        self.assertEqual(Transaction.objects.count(), 2)
+
+        response = self.client.post(url, [
+            self.item(id=first['id'], amount='70.00'),
+            self.item(date='2025-01-11'),
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['id'], first['id'])
+        self.assertEqual(Transaction.objects.get(pk=first['id']).amount, Decimal('70.00'))
+
+        rollups = dict(DailyRollup.objects.values_list('date', 'count'))
+        self.assertEqual(rollups, {date(2025, 1, 10): 2, date(2025, 1, 11): 1})
+        self.assertEqual(DailyRollup.objects.get(date=date(2025, 1, 10)).total, Decimal('120.00'))
+
+    def test_bulk_rejects_whole_batch_on_hierarchy_error(self):
+        response = self.client.post(reverse('api-transaction-bulk'), [
+            self.item(),
+            self.item(category=self.salary.pk),
+            self.item(id=999999),
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn('category', errors[1])
+        self.assertFalse(Transaction.objects.exists())
+
+        # Обновляемые строки читаются уже в транзакции записи: пропавшая откатывает весь пакет
+        response = self.client.post(reverse('api-transaction-bulk'), [self.item(), self.item(id=999999)],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['Не найдены операции: 999999'])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api-transaction-list')).status_code, 403)
+        response = self.client.post(reverse('api-transaction-bulk'), [self.item()], content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Transaction.objects.exists())
+
+    def sync_changes(self, cursor=None, limit=2):
+        """Все страницы ленты изменений: (записи, курсор после последней)"""
+        url = reverse('api-transaction-changes')
+        records = []
+        while True:
+            params = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(url, params)
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+            *page, last = lines
+            self.assertEqual((last['cursor'] or ''), response['X-Next-Cursor'])
+            records += page
+            cursor = last['cursor']
+            if not last['has_more']:
+                return records, cursor
+
+    def test_change_feed_with_tombstones(self):
+        self.client.post(reverse('api-transaction-bulk'), [
+            self.item(date=f'2025-01-{day:02d}') for day in range(1, 6)
+        ], content_type='application/json')
+        ids = list(Transaction.objects.order_by('id').values_list('id', flat=True))
+
+        with self.settings(TRANSACTIONS_CHANGE_FEED_LAG=0):
+            records, cursor = self.sync_changes()
+            self.assertEqual([(record['op'], record['id']) for record in records], [('upsert', pk) for pk in ids])
+            self.assertEqual(records[0]['amount'], '100.00')
+            self.assertEqual(self.sync_changes(cursor), ([], cursor))
+
+            # Правка, одиночное удаление и массовое удаление видны в ленте
+            self.client.post(reverse('api-transaction-bulk'), [self.item(id=ids[0], amount='70.00')],
+                             content_type='application/json')
+            self.client.post(reverse('transaction_delete', args=[ids[1]]))
+            self.client.post(reverse('transaction_bulk'), {'action': 'delete', 'ids': [ids[2], ids[3]]})
+            records, _ = self.sync_changes(cursor)
+        self.assertEqual(
+            [(record['op'], record['id']) for record in records],
+            [('upsert', ids[0]), ('delete', ids[1]), ('delete', ids[2]), ('delete', ids[3])],
+        )
+        self.assertEqual(records[0]['amount'], '70.00')
+        self.assertEqual(self.client.get(reverse('api-transaction-changes'), {'cursor': 'x'}).status_code, 400)
+
+
+class AsyncViewsTests(TransactionsTestCase):
+    """Асинхронные представления отдают то же, что и синхронные"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+        for day in range(1, 26):
+            Transaction.objects.create(
+                date=date(2025, 1, day),
+                status=cls.status,
+                transaction_type=cls.expense,
+                category=cls.category,
+                subcategory=cls.subcategory,
+                amount=Decimal('100.00'),
+                comment=f'Операция {day}',
+            )
+
+    async def content(self, response):
+        if response.streaming:
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return response.content
+
+    async def test_async_views_match_sync_views(self):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory, RequestFactory
+        from . import async_views, views
+
+        cases = [
+            ('transaction_list', {'category': self.category.pk}),
+            ('transaction_list', {'cursor': KeysetPaginator.encode_cursor(
+                await Transaction.objects.aget(date=date(2025, 1, 20)))}),
+            ('transaction_export', {'format': 'ndjson', 'date_from': '2025-01-10'}),
+            ('cash_flow_report', {'period': 'day'}),
+            ('load_categories', {'transaction_type': self.expense.pk}),
+            ('load_subcategories', {'category': self.category.pk}),
+        ]
+        for name, params in cases:
+            sync_response = await sync_to_async(getattr(views, name))(RequestFactory().get('/', params))
+            async_response = await getattr(async_views, name)(AsyncRequestFactory().get('/', params))
+            self.assertEqual(async_response.status_code, 200)
+            # Маска токена CSRF формы массовых действий случайна при каждой отрисовке
+            self.assertEqual(CSRF_TOKEN_RE.sub(b'', await self.content(async_response)),
+                             CSRF_TOKEN_RE.sub(b'', await sync_to_async(self.sync_content)(sync_response)), name)
+
+    def sync_content(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+
+class AnalyticsTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.income = TransactionType.objects.create(name='Пополнение')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.salary = Category.objects.create(name='Зарплата', transaction_type=cls.income)
+        cls.marketing = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.advance = Subcategory.objects.create(name='Аванс', category=cls.salary)
+        cls.avito = Subcategory.objects.create(name='Avito', category=cls.marketing)
+        for day, category, subcategory, amount in [
+            (date(2025, 1, 5), cls.salary, cls.advance, '1000.10'),
+            (date(2025, 1, 6), cls.marketing, cls.avito, '200.05'),
+            (date(2025, 1, 31), cls.marketing, cls.avito, '0.01'),
+            (date(2025, 2, 3), cls.salary, cls.advance, '500.00'),
+        ]:
+            Transaction.objects.create(
+                date=day, status=cls.status, transaction_type=category.transaction_type,
+                category=category, subcategory=subcategory, amount=Decimal(amount),
+            )
+
+    def setUp(self):
+        super().setUp()
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest('NumPy не установлен')
+
+    def test_group_by_matches_orm(self):
+        from django.db.models import Count, Sum
+        from django.db.models.functions import TruncMonth
+        from .analytics import TransactionFrame
+
+        frame = TransactionFrame.load()
+        expected = [
+            {'period': row['month'], 'transaction_type': row['transaction_type'], 'category': row['category'],
+             'total': row['total'], 'count': row['count']}
+            for row in Transaction.objects.annotate(month=TruncMonth('date')).values(
+                'month', 'transaction_type', 'category'
+            ).annotate(total=Sum('amount'), count=Count('id')).order_by('month', 'transaction_type', 'category')
+        ]
+        self.assertEqual(frame.group_by(['transaction_type', 'category'], bucket='month'), expected)
+        self.assertEqual(
+            [(row['period'], row['count']) for row in frame.group_by(bucket='week')],
+            [(date(2024, 12, 30), 1), (date(2025, 1, 6), 1), (date(2025, 1, 27), 1), (date(2025, 2, 3), 1)],
+        )
+        self.assertEqual(frame.top('category', limit=1)[0]['category'], self.salary.pk)
+        self.assertEqual(frame.income_expense()[0], {
+            'period': date(2025, 1, 1), 'income': Decimal('1000.10'), 'expense': Decimal('200.06'),
+            'net': Decimal('800.04'),
+        })
+        selected = frame.select(date_from=date(2025, 1, 6), category=self.marketing.pk)
+        self.assertEqual(selected.group_by(), [{'total': Decimal('200.06'), 'count': 2}])
+
+    def test_snapshot_follows_data_version(self):
+        from .analytics import get_frame
+
+        frame = get_frame()
+        # Проверка версии - одна выборка по первичному ключу, без агрегатов по таблицам
+        with self.assertNumQueries(1):
+            self.assertIs(get_frame(), frame)
+        Transaction.objects.filter(category=self.marketing).first().delete()
+        frame = get_frame()
+        self.assertEqual(len(frame), 3)
+
+        # Изменения только в архиве тоже меняют версию
+        from .bulk import delete_dictionary_entry
+
+        call_command('archive_transactions', before='2025-02-01', stdout=io.StringIO())
+        yandex = Subcategory.objects.create(name='Яндекс', category=self.marketing)
+        self.avito.refresh_from_db()
+        delete_dictionary_entry(self.avito, subcategory=yandex)
+        self.assertEqual([row['subcategory'] for row in get_frame().group_by(['subcategory'])],
+                         sorted([self.advance.pk, yandex.pk]))
+
+
+class RunningBalanceTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.income = TransactionType.objects.create(name='Пополнение')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.salary = Category.objects.create(name='Зарплата', transaction_type=cls.income)
+        cls.marketing = Category.objects.create(name='Маркетинг', transaction_type=cls.expense)
+        cls.advance = Subcategory.objects.create(name='Аванс', category=cls.salary)
+        cls.avito = Subcategory.objects.create(name='Avito', category=cls.marketing)
+        for day, amount in [
+            (date(2025, 1, 10), '1000.00'), (date(2025, 1, 20), '-150.00'), (date(2025, 3, 1), '-200.00'),
+            (date(2025, 3, 1), '500.00'), (date(2025, 4, 15), '-50.00'),
+        ]:
+            cls.create(day, amount)
+
+    @classmethod
+    def create(cls, day, amount):
+        amount = Decimal(amount)
+        category, subcategory = (cls.salary, cls.advance) if amount > 0 else (cls.marketing, cls.avito)
+        return Transaction.objects.create(
+            date=day, status=cls.status, transaction_type=category.transaction_type,
+            category=category, subcategory=subcategory, amount=abs(amount),
+        )
+
+    def expected_balances(self):
+        balance = Decimal('0.00')
+        result = {}
+        for transaction in Transaction.objects.order_by('date', 'created_at', 'id').select_related('transaction_type'):
+            balance += transaction.amount if transaction.transaction_type_id == self.income.pk else -transaction.amount
+            result[transaction.pk] = balance
+        return result
+
+    def test_running_balance_uses_checkpoints(self):
+        from .balance import running_balances
+        from .models import BalanceCheckpoint
+
+        keys = list(Transaction.objects.values_list('id', 'date'))
+        self.assertEqual(running_balances(keys), self.expected_balances())
+        self.assertEqual(
+            list(BalanceCheckpoint.objects.order_by('month').values_list('month', 'balance')),
+            [(date(2025, 1, 1), Decimal('850.00')), (date(2025, 3, 1), Decimal('1150.00'))],
+        )
+
+        # Операция задним числом сбрасывает остатки начиная со своего месяца
+        self.create(date(2025, 2, 5), '-25.00')
+        self.assertEqual(list(BalanceCheckpoint.objects.values_list('month', flat=True)), [date(2025, 1, 1)])
+        keys = list(Transaction.objects.values_list('id', 'date'))
+        self.assertEqual(running_balances(keys), self.expected_balances())
+
+        # Для строки читаются только операции её дня, остальное - из остатков и сводок
+        latest = list(Transaction.objects.filter(date=date(2025, 4, 15)).values_list('id', 'date'))
+        with CaptureQueriesContext(connection) as queries:
+            running_balances(latest)
+        transaction_queries = [query['sql'] for query in queries if 'FROM "transactions_transaction"' in query['sql']]
+        self.assertEqual(len(transaction_queries), 1)
+        self.assertIn('"date" IN (\'2025-04-15\')', transaction_queries[0])
+
+    def test_checkpoints_are_not_saved_after_concurrent_invalidation(self):
+        from . import balance
+        from .models import BalanceCheckpoint
+
+        real_type_signs = balance.type_signs
+
+        def type_signs_with_backdated_write():
+            # Запись задним числом между чтением поколения и вставкой остатков
+            if not Transaction.objects.filter(date=date(2025, 1, 5)).exists():
+                self.create(date(2025, 1, 5), '-40.00')
+            return real_type_signs()
+
+        with mock.patch('transactions.balance.type_signs', side_effect=type_signs_with_backdated_write):
+            self.assertEqual(
+                balance.ensure_checkpoints(date(2025, 4, 1)),
+                [(date(2025, 1, 1), Decimal('810.00')), (date(2025, 3, 1), Decimal('1110.00'))],
+            )
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+
+        keys = list(Transaction.objects.values_list('id', 'date'))
+        self.assertEqual(balance.running_balances(keys), self.expected_balances())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 2)
+
+    def test_list_and_export_show_balance(self):
+        response = self.client.get(reverse('transaction_list'))
+        self.assertContains(response, '1100,00 ₽')
+        response = self.client.get(reverse('transaction_export'), {'format': 'ndjson'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['balance'] for record in records], ['1100.00', '1150.00', '650.00', '850.00', '1000.00'])
+
+    def test_export_formats_filters_and_gzip(self):
+        url = reverse('transaction_export')
+        response = self.client.get(url, {'date_from': '2025-03-01'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = b''.join(response.streaming_content)
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], ['id', 'date', 'status', 'transaction_type', 'category', 'subcategory',
+                                   'amount', 'comment', 'balance'])
+        self.assertEqual([(row[1], row[6], row[8]) for row in rows[1:]], [
+            ('2025-04-15', '50.00', '1100.00'), ('2025-03-01', '500.00', '1150.00'), ('2025-03-01', '200.00', '650.00'),
+        ])
+
+        response = self.client.get(url, {'date_from': '2025-03-01', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('transactions.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), content)
+        for value in ('0', 'false', ''):
+            response = self.client.get(url, {'date_from': '2025-03-01', 'gzip': value})
+            self.assertEqual(b''.join(response.streaming_content), content)
+
+        response = self.client.get(url, {'format': 'ndjson', 'transaction_type': self.income.pk})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(record['category'], record['amount']) for record in records],
+                         [('Зарплата', '500.00'), ('Зарплата', '1000.00')])
+
+    def test_archived_rows_stay_in_list_export_and_balances(self):
+        from .models import ArchivedTransaction
+
+        url = reverse('transaction_list')
+        self.assertNotContains(self.client.get(url), 'В архиве')
+        call_command('archive_transactions', before='2025-03-01', stdout=io.StringIO())
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+
+        # Кэш страницы сброшен переносом, архивные строки видны без правки и удаления
+        response = self.client.get(url)
+        self.assertContains(response, 'В архиве', count=2)
+        self.assertContains(response, '850,00 ₽')
+        response = self.client.get(reverse('transaction_export'), {'format': 'ndjson'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['balance'] for record in records], ['1100.00', '1150.00', '650.00', '850.00', '1000.00'])
+
+        # Фильтр после границы архива читает только рабочую таблицу
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'date_from': '2025-03-01'})
+        self.assertNotContains(response, 'В архиве')
+        self.assertFalse([query for query in queries if 'transactions_combinedtransaction' in query['sql']])
+
+        # Действие ко всем операциям под фильтром архив не меняет и сообщает, сколько пропущено
+        response = self.client.post(f'{reverse("transaction_bulk")}?transaction_type={self.expense.pk}', {
+            'action': 'status', 'status': self.status.pk, 'apply_to_all': 'on',
+        }, follow=True)
+        self.assertContains(response, 'Статус изменён у операций: 2')
+        self.assertContains(response, 'Архивные операции не изменяются, пропущено: 1')
+        from . import jobs
+        from .models import Job
+
+        filters = {'date_from': '2025-01-15', 'format': 'ndjson'}
+        expected = b''.join(self.client.get(reverse('transaction_export'), filters).streaming_content)
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            def result_files():
+                return [path for path in Path(media_root).rglob('*') if path.is_file()]
+
+            response = self.client.post(f'{reverse("transaction_export_job")}?date_from=2025-01-15&format=ndjson')
+            self.assertEqual(response.status_code, 202)
+            status_url = response.json()['status_url']
+            self.assertEqual(self.client.get(status_url).json()['status'], Job.QUEUED)
+
+            # Первая попытка падает: задача возвращается в очередь с паузой
+            with mock.patch.object(jobs, 'export_values', side_effect=RuntimeError('диск')):
+                jobs.run_job(jobs.claim_next('test'))
+            state = self.client.get(status_url).json()
+            self.assertEqual((state['status'], state['attempts']), (Job.QUEUED, 1))
+            self.assertIn('RuntimeError', state['error'])
+            self.assertIsNone(jobs.claim_next('test'))
+
+            Job.objects.update(run_after=timezone.now())
+            jobs.run_job(jobs.claim_next('test'))
+            state = self.client.get(status_url).json()
+            self.assertEqual((state['status'], state['progress'], state['total']), (Job.DONE, 4, 4))
+            response = self.client.get(state['result_url'])
+            self.assertEqual(b''.join(response.streaming_content), expected)
+
+            # Задачу, которую вернули в очередь и отдали другому обработчику, прежний не завершает
+            job = jobs.enqueue('export', filters={'date_from': '2025-01-15'})
+            slow = jobs.claim_next('old')
+            Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            self.assertEqual(jobs.requeue_stale(), 1)
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            taken = jobs.claim_next('new')
+            # Отметка прежнего обработчика задачу не продлевает, отметка нового - продлевает
+            taken.refresh_from_db()
+            jobs.heartbeat('old', [job.pk])
+            self.assertEqual(Job.objects.get(pk=job.pk).heartbeat_at, taken.heartbeat_at)
+            jobs.heartbeat('new', [job.pk])
+            self.assertGreater(Job.objects.get(pk=job.pk).heartbeat_at, taken.heartbeat_at)
+            with self.assertLogs('transactions.jobs', 'WARNING'):
+                self.assertFalse(jobs.run_job(slow))
+            taken.refresh_from_db()
+            self.assertEqual((taken.status, taken.result.name), (Job.RUNNING, ''))
+            self.assertTrue(jobs.run_job(taken))
+            # Файл отброшенной попытки удалён, остались результаты двух выполненных задач
+            self.assertEqual(len(result_files()), 2)
+
+            # Завершённые задачи старше срока хранения удаляются вместе с файлами результатов
+            self.assertEqual(jobs.purge_finished(), 0)
+            Job.objects.update(finished_at=timezone.now() - timedelta(days=30))
+            self.assertEqual(jobs.purge_finished(), 2)
+            self.assertFalse(Job.objects.exists())
+            self.assertEqual(result_files(), [])
+
+
+class TransactionSearchTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        cls.other_status = Status.objects.create(name='Личное')
+        transaction_type = TransactionType.objects.create(name='Списание')
+        category = Category.objects.create(name='Маркетинг', transaction_type=transaction_type)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        cls.rows = {}
+        for key, status, day, comment in [
+            ('ads', cls.status, date(2025, 1, 1), 'Реклама на Avito, январь'),
+            ('ads_twice', cls.status, date(2025, 1, 2), 'Реклама Avito: продление рекламы'),
+            ('ads_personal', cls.other_status, date(2025, 1, 3), 'Реклама в соцсетях'),
+            ('fuel', cls.status, date(2025, 1, 4), 'Бензин'),
+        ]:
+            cls.rows[key] = Transaction.objects.create(
+                date=day, status=status, transaction_type=transaction_type, category=category,
+                subcategory=subcategory, amount=Decimal('100.00'), comment=comment,
+            )
+
+    def search(self, text, ranked=False, **filters):
+        form = TransactionFilterForm({'q': text, **filters})
+        return list(form.filter_queryset(Transaction.objects.all(), ranked=ranked).values_list('pk', flat=True))
+
+    def test_search_with_filters_and_rank(self):
+        rows = self.rows
+        self.assertCountEqual(self.search('реклам'), [rows['ads'].pk, rows['ads_twice'].pk, rows['ads_personal'].pk])
+        self.assertEqual(self.search('реклам', status=self.status.pk, ranked=True)[0], rows['ads_twice'].pk)
+        self.assertEqual(self.search('avito январь'), [rows['ads'].pk])
+        # Операторы FTS5 в тексте пользователя не интерпретируются
+        self.assertEqual(self.search('"avito" OR NEAR('), [])
+
+        form = TransactionFilterForm({'q': 'бензин'})
+        plan = form.filter_queryset(Transaction.objects.all()).explain()
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+
+        response = self.client.get(reverse('transaction_list'), {'q': 'реклама avito'})
+        self.assertEqual([row.pk for row in response.context['page_obj']], [rows['ads_twice'].pk, rows['ads'].pk])
+
+    def test_index_follows_writes(self):
+        fuel = self.rows['fuel']
+        fuel.comment = 'Бензин и мойка'
+        fuel.save()
+        self.assertEqual(self.search('мойка'), [fuel.pk])
+
+        Transaction.objects.filter(pk=fuel.pk).update(comment='Стоянка')
+        self.assertEqual(self.search('мойка'), [])
+        self.assertEqual(self.search('стоянка'), [fuel.pk])
+
+        fuel.delete()
+        self.assertEqual(self.search('стоянка'), [])
+
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(len(self.search('реклама')), 3)
+
+    def test_archive_has_own_index_and_rollups(self):
+        from .models import ArchivedTransaction, CombinedTransaction
+
+        rollups = list(DailyRollup.objects.order_by('date').values_list('date', 'total', 'count'))
+        call_command('archive_transactions', before='2025-01-03', stdout=io.StringIO())
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+
+        def search_all(text):
+            form = TransactionFilterForm({'q': text})
+            return form.filter_queryset(CombinedTransaction.objects.all())
+
+        # Регистр кириллицы сворачивается одинаково для архива и рабочей таблицы
+        rows = self.rows
+        expected = [rows['ads'].pk, rows['ads_twice'].pk, rows['ads_personal'].pk]
+        self.assertCountEqual(search_all('РЕКЛАМА').values_list('pk', flat=True), expected)
+        # Архив не перебирается: строки находятся по rowid из его индекса
+        plan = search_all('РЕКЛАМА').explain()
+        self.assertIn('SEARCH transactions_archivedtransaction USING INTEGER PRIMARY KEY', plan)
+        self.assertNotIn('SCAN transactions_archivedtransaction', plan)
+
+        ArchivedTransaction.objects.filter(pk=rows['ads'].pk).update(comment='Баннеры')
+        self.assertEqual(list(search_all('баннер').values_list('pk', flat=True)), [rows['ads'].pk])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(search_all('реклама').count(), 2)
+
+        # Пересборка сводок учитывает архив (rebuild_rollups читает source_model())
+        rebuild_rollups()
+        self.assertEqual(list(DailyRollup.objects.order_by('date').values_list('date', 'total', 'count')), rollups)
+
+
+class InstrumentationTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        status = Status.objects.create(name='Бизнес')
+        transaction_type = TransactionType.objects.create(name='Списание')
+        category = Category.objects.create(name='Маркетинг', transaction_type=transaction_type)
+        subcategory = Subcategory.objects.create(name='Avito', category=category)
+        Transaction.objects.create(
+            date=date(2025, 1, 1), status=status, transaction_type=transaction_type,
+            category=category, subcategory=subcategory, amount=Decimal('10.00'),
+        )
+
+    def setUp(self):
+        super().setUp()
+        from .instrumentation import reset_metrics
+        reset_metrics()
+
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('transaction_list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    def test_server_timing_metrics_and_duplicates(self):
+        from .instrumentation import RequestProfile
+
+        with self.settings(TRANSACTIONS_INSTRUMENTATION=True, INSTRUMENTATION_SLOW_REQUEST_MS=0):
+            with self.assertLogs('transactions.instrumentation', 'WARNING') as logs:
+                response = self.client.get(reverse('transaction_list'))
+                metrics = self.client.get(reverse('metrics')).content.decode()
+            timing = response['Server-Timing']
+            for name in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+                self.assertIn(name, timing)
+            self.assertIn('Медленный запрос GET /transactions/', logs.output[0])
+        self.assertIn('dds_request_duration_seconds_count{route="/transactions/",method="GET"} 1', metrics)
+        self.assertIn('# TYPE dds_request_queries histogram', metrics)
+
+        # Один и тот же запрос по строкам (в том числе IN разной длины) - признак N+1
+        profile = RequestProfile()
+        profile.queries = [('SELECT * FROM "category" WHERE "id" = %s', 0.001)] * 6 + [
+            ('SELECT * FROM "t" WHERE "id" IN (%s)', 0.001), ('SELECT * FROM "t" WHERE "id" IN (%s, %s)', 0.001),
+        ]
+        self.assertEqual(profile.duplicates(5), [('SELECT * FROM "category" WHERE "id" = %s', 6)])
+        self.assertEqual(profile.duplicates(2)[1], ('SELECT * FROM "t" WHERE "id" IN (...)', 2))
+
+    def test_counts_streaming_and_thread_queries(self):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from .instrumentation import RequestProfile, _current_profile, install_query_timer
+
+        with self.settings(TRANSACTIONS_INSTRUMENTATION=True):
+            response = self.client.get(reverse('transaction_export'), {'format': 'ndjson'})
+            header_queries = int(re.search(r'"(\d+) SQL"', response['Server-Timing']).group(1))
+            self.assertNotIn('route="/transactions/export/"', self.client.get(reverse('metrics')).content.decode())
+            b''.join(response.streaming_content)
+            metrics = self.client.get(reverse('metrics')).content.decode()
+        # Строки выгрузки читаются при выдаче тела: эти SQL тоже в замере запроса
+        queries = re.search(r'dds_request_queries_sum\{route="/transactions/export/",method="GET"\} (\S+)', metrics)
+        self.assertGreater(float(queries.group(1)), header_queries)
+
+        def count_in_thread():
+            # Своё соединение потока; таблицы заняты транзакцией теста, поэтому без них
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connection.close()
+
+        install_query_timer()
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            async_to_sync(sync_to_async(count_in_thread, thread_sensitive=False))()
+        finally:
+            _current_profile.reset(token)
+        self.assertEqual(len(profile.queries), 1)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_sizes_and_regressions(self):
+        from .management.commands.benchmark import compare_results, parse_sizes
+
+        self.assertEqual(parse_sizes('1M,10k,10000'), [10000, 1000000])
+
+        def result(p50, queries):
+            return {'sizes': {'10000': {'scenarios': {'dictionaries': {'p50_ms': p50, 'queries': queries}}}}}
+
+        baseline = result(10.0, 3)
+        self.assertEqual(compare_results(baseline, result(11.5, 3)), [])
+        # Быстрые запросы не считаются регрессией из-за шума меньше min_ms
+        self.assertEqual(compare_results(result(0.2, 3), result(0.5, 3)), [])
+        self.assertEqual(len(compare_results(baseline, result(13.0, 4))), 2)
+
+
+class SqliteProfileTests(TestCase):
+    def test_pragmas_and_router(self):
+        from .database import ReadWriteRouter, apply_pragmas
+
+        with self.settings(SQLITE_PRAGMAS={'cache_size': -2048, 'busy_timeout': 1234}):
+            apply_pragmas(connection)
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA cache_size').fetchone()[0], -2048)
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 1234)
+
+        router = ReadWriteRouter()
+        with mock.patch('transactions.database.read_alias', return_value='read'):
+            # TestCase держит транзакцию основной базы: чтения не уходят в соединение для чтения
+            self.assertEqual(router.db_for_read(Transaction), 'default')
+            self.assertEqual(router.db_for_write(Transaction), 'default')
+            self.assertFalse(router.allow_migrate('read', 'transactions'))
+
+
+class TransactionListCacheTests(TransactionsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.status = Status.objects.create(name='Бизнес')
+        transaction_type = TransactionType.objects.create(name='Списание')
+        cls.category = Category.objects.create(name='Маркетинг', transaction_type=transaction_type)
+        subcategory = Subcategory.objects.create(name='Avito', category=cls.category)
+        cls.transaction = Transaction.objects.create(
+            date=date(2025, 1, 1), status=cls.status, transaction_type=transaction_type,
+            category=cls.category, subcategory=subcategory, amount=Decimal('10.00'), comment='Реклама',
+        )
+
+    def test_repeat_views_skip_transaction_table(self):
+        from . import list_cache
+
+        url = reverse('transaction_list')
+        before = list_cache.stats()
+        self.client.get(url, {'status': self.status.pk, 'date_from': ''})
+        # Те же фильтры в другом виде - тот же ключ
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'status': str(self.status.pk)})
+        self.assertContains(response, 'Реклама')
+        self.assertFalse([query for query in queries if 'transactions_transaction' in query['sql']])
+        after = list_cache.stats()
+        self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (1, 1))
+
+        # Любая запись операций (даже правка только комментария) меняет версию данных
+        self.transaction.comment = 'Продвижение'
+        self.transaction.save()
+        self.assertContains(self.client.get(url, {'status': self.status.pk}), 'Продвижение')
+
+        # Переименование справочника тоже меняет страницу
+        self.category.name = 'Реклама и продвижение'
+        self.category.save()
+        self.assertContains(self.client.get(url, {'status': self.status.pk}), 'Реклама и продвижение')
+
+        # Запись из другого процесса (команда, run_worker) видна через версию в БД, а не в кэше процесса
+        Transaction.objects.filter(pk=self.transaction.pk).update(comment='Баннеры')
+        list_cache.bump_data_version()
+        self.assertContains(self.client.get(url, {'status': self.status.pk}), 'Баннеры')
 
-# Create your tests here.
+    def test_cached_pagination_links_use_normalized_filters(self):
+        Transaction.objects.bulk_create([
+            Transaction(
+                date=date(2025, 2, 1), status=self.status, transaction_type=self.transaction.transaction_type,
+                category=self.category, subcategory=self.transaction.subcategory, amount=Decimal('1.00'),
+            )
+            for _ in range(25)
+        ])
+        url = reverse('transaction_list')
+        self.client.get(url, {'status': self.status.pk, 'utm_source': 'mail'})
+        response = self.client.get(url, {'status': str(self.status.pk)})
+        links = re.findall(r'class="page-link" href="([^"]+)"', response.content.decode())
+        self.assertTrue(links)
+        for link in links:
+            self.assertTrue(link.startswith(f'{url}?status={self.status.pk}'), link)
+            self.assertNotIn('utm_source', link)
@@ -1,14 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Читающие представления: асинхронные под ASGI, синхронные под WSGI
+read_views = async_views if getattr(settings, 'TRANSACTIONS_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('', views.transaction_list, name='transaction_list'),
+    path('', read_views.transaction_list, name='transaction_list'),
+    path('export/', read_views.transaction_export, name='transaction_export'),
     path('create/', views.transaction_create, name='transaction_create'),
     path('<int:pk>/edit/', views.transaction_edit, name='transaction_edit'),
     path('<int:pk>/delete/', views.transaction_delete, name='transaction_delete'),
-    path('ajax/load-categories/', views.load_categories, name='ajax_load_categories'),
-    path('ajax/load-subcategories/', views.load_subcategories, name='ajax_load_subcategories'),
+    path('bulk/', views.transaction_bulk, name='transaction_bulk'),
+    path('export/job/', views.transaction_export_job, name='transaction_export_job'),
+    path('jobs/<int:pk>/', views.job_status, name='job_status'),
+    path('jobs/<int:pk>/result/', views.job_result, name='job_result'),
+    path('ajax/load-categories/', read_views.load_categories, name='ajax_load_categories'),
+    path('ajax/load-subcategories/', read_views.load_subcategories, name='ajax_load_subcategories'),
+    path('ajax/dictionary-tree/', views.dictionary_tree, name='ajax_dictionary_tree'),
+    path('report/', read_views.cash_flow_report, name='cash_flow_report'),
     path('dictionaries/', views.dictionaries, name='dictionaries'),
+    path('metrics/', views.metrics, name='metrics'),
 
     # URL для управления статусами
     path('status/add/', views.add_status, name='add_status'),
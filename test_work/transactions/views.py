@@ -1,45 +1,146 @@
+import os
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import ProtectedError, Sum
+from django.db.models.functions import Substr, TruncDay, TruncMonth, TruncYear
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-from .models import Transaction, Status, TransactionType, Category, Subcategory
-from .forms import TransactionForm, TransactionFilterForm
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from . import bulk, jobs
+from .models import Transaction, Status, TransactionType, Category, Subcategory, DailyRollup, Job
+from .forms import TransactionForm, TransactionFilterForm, TransactionBulkForm, RollupReportForm
+from .pagination import KeysetPaginator, RankedPaginator
+from .balance import running_balances
+from .dictionary_cache import get_tree
+from .export import EXPORT_FORMATS, export_stream, export_values, gzip_requested, gzip_stream
+from .instrumentation import render_metrics
+from .list_cache import cached_table, filters_query, normalized_filters
+
+COMMENT_PREVIEW_LENGTH = 50
+
+REPORT_PERIODS = {
+    'day': TruncDay,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+
+def transaction_list_queryset(model=Transaction):
+    # Полный комментарий не загружаем: в таблице показываются только первые 50 символов
+    return model.objects.select_related(
+        'status', 'transaction_type', 'category', 'subcategory'
+    ).defer('comment').annotate(
+        comment_preview=Substr('comment', 1, COMMENT_PREVIEW_LENGTH + 1)
+    )
 
 
-def transaction_list(request):
-    transactions = Transaction.objects.select_related(
-        'status', 'transaction_type', 'category', 'subcategory'
-    ).all()
+def attach_running_balances(page_obj):
+    """Остаток после каждой операции страницы (по всем операциям, без учёта фильтров)"""
+    balances = running_balances((transaction.pk, transaction.date) for transaction in page_obj)
+    for transaction in page_obj:
+        transaction.running_balance = balances.get(transaction.pk)
+
 
+def transaction_list_paginator(filter_form):
+    """Пагинатор списка: по дате (keyset) или, при поиске, по релевантности"""
+    ranked = bool(filter_form.search_text())
+    transactions = filter_form.filter_queryset(
+        transaction_list_queryset(filter_form.source_model()), ranked=ranked
+    )
+    paginator_class = RankedPaginator if ranked else KeysetPaginator
+    return paginator_class(
+        transactions,
+        per_page=20,
+        count_limit=getattr(settings, 'TRANSACTION_LIST_COUNT_LIMIT', 1000),
+    )
+
+
+def transaction_list(request):
     filter_form = TransactionFilterForm(request.GET)
+    cursor = request.GET.get('cursor')
 
-    if filter_form.is_valid():
-        if filter_form.cleaned_data['date_from']:
-            transactions = transactions.filter(date__gte=filter_form.cleaned_data['date_from'])
-        if filter_form.cleaned_data['date_to']:
-            transactions = transactions.filter(date__lte=filter_form.cleaned_data['date_to'])
-        if filter_form.cleaned_data['status']:
-            transactions = transactions.filter(status=filter_form.cleaned_data['status'])
-        if filter_form.cleaned_data['transaction_type']:
-            transactions = transactions.filter(transaction_type=filter_form.cleaned_data['transaction_type'])
-        if filter_form.cleaned_data['category']:
-            transactions = transactions.filter(category=filter_form.cleaned_data['category'])
-        if filter_form.cleaned_data['subcategory']:
-            transactions = transactions.filter(subcategory=filter_form.cleaned_data['subcategory'])
-
-    paginator = Paginator(transactions, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    def render_table():
+        page_obj = transaction_list_paginator(filter_form).get_page(cursor)
+        attach_running_balances(page_obj)
+        context = {'page_obj': page_obj, 'filter_query': filters_query(normalized_filters(filter_form))}
+        return render_to_string('transactions/transaction_table.html', context, request)
 
     context = {
-        'page_obj': page_obj,
+        'table': cached_table(filter_form, cursor, render_table),
         'filter_form': filter_form,
+        'bulk_form': TransactionBulkForm(),
     }
     return render(request, 'transactions/transaction_list.html', context)
 
 
+def transaction_export(request):
+    """Потоковая выгрузка отфильтрованных операций в CSV или NDJSON (опционально gzip)"""
+    filter_form = TransactionFilterForm(request.GET)
+    rows = export_values(filter_form.filter_queryset(filter_form.source_model().objects.all()))
+
+    export_format = request.GET.get('format')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    filename = f'transactions.{export_format}'
+
+    stream = export_stream(rows, export_format)
+    content_type = EXPORT_FORMATS[export_format]
+    if gzip_requested(request.GET):
+        stream = gzip_stream(stream)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _job_state(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'attempts': job.attempts,
+        'error': job.error,
+        'status_url': reverse('job_status', args=[job.pk]),
+        'result_url': reverse('job_result', args=[job.pk]) if job.status == Job.DONE and job.result else None,
+    }
+
+
+def transaction_export_job(request):
+    """Ставит выгрузку в очередь фоновых задач; фильтры - в строке запроса, как у transaction_export"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Нужен POST'}, status=405)
+    filter_form = TransactionFilterForm(request.GET)
+    if not filter_form.is_valid():
+        return JsonResponse({'error': 'Исправьте фильтры списка', 'fields': filter_form.errors}, status=400)
+    filters = {name: value for name, value in request.GET.items() if name in filter_form.fields}
+    job = jobs.enqueue(
+        'export', filters=filters, export_format=request.GET.get('format', 'csv'), gzip=gzip_requested(request.GET)
+    )
+    return JsonResponse(_job_state(job), status=202)
+
+
+def job_status(request, pk):
+    """Состояние фоновой задачи для опроса со страницы"""
+    return JsonResponse(_job_state(get_object_or_404(Job, pk=pk)))
+
+
+def job_result(request, pk):
+    job = get_object_or_404(Job, pk=pk, status=Job.DONE)
+    if not job.result:
+        raise Http404
+    return FileResponse(job.result.open('rb'), as_attachment=True, filename=os.path.basename(job.result.name))
+
+
 def transaction_create(request):
     if request.method == 'POST':
         form = TransactionForm(request.POST)
@@ -91,28 +192,164 @@ def transaction_delete(request, pk):
     return render(request, 'transactions/transaction_confirm_delete.html', {'transaction': transaction})
 
 
+def transaction_bulk(request):
+    """Массовое действие из списка; фильтры списка приходят в строке запроса"""
+    list_url = reverse('transaction_list') + (f'?{request.GET.urlencode()}' if request.GET else '')
+    if request.method != 'POST':
+        return redirect(list_url)
+
+    filter_form = TransactionFilterForm(request.GET)
+    form = TransactionBulkForm(request.POST)
+    if not filter_form.is_valid():
+        # С ошибкой в фильтрах выборкой оказались бы все операции
+        messages.error(request, 'Исправьте фильтры списка')
+        return redirect(list_url)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+        return redirect(list_url)
+
+    queryset = form.selection(filter_form)
+    skipped = form.skipped_archived(filter_form)
+    data = form.cleaned_data
+    try:
+        if data['action'] == 'status':
+            count = bulk.set_status(queryset, data['status'])
+            message = f'Статус изменён у операций: {count}'
+        elif data['action'] == 'category':
+            count = bulk.set_category(queryset, data['category'], data['subcategory'])
+            message = f'Категория изменена у операций: {count}'
+        else:
+            count = bulk.delete(queryset)
+            message = f'Удалено операций: {count}'
+    except bulk.BulkActionError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, message)
+        if skipped:
+            messages.warning(request, f'Архивные операции не изменяются, пропущено: {skipped}')
+    return redirect(list_url)
+
+
+def _int_param(request, name):
+    try:
+        return int(request.GET.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
 def load_categories(request):
-    transaction_type_id = request.GET.get('transaction_type')
-    categories = Category.objects.filter(transaction_type_id=transaction_type_id).order_by('name')
-    return JsonResponse(list(categories.values('id', 'name')), safe=False)
+    tree = get_tree()
+    category_ids = tree.type_categories.get(_int_param(request, 'transaction_type'), ())
+    categories = [tree.get(Category, pk) for pk in category_ids]
+    return JsonResponse([{'id': node.id, 'name': node.name} for node in categories], safe=False)
 
 
 def load_subcategories(request):
-    category_id = request.GET.get('category')
-    subcategories = Subcategory.objects.filter(category_id=category_id).order_by('name')
-    return JsonResponse(list(subcategories.values('id', 'name')), safe=False)
+    tree = get_tree()
+    subcategory_ids = tree.category_subcategories.get(_int_param(request, 'category'), ())
+    subcategories = [tree.get(Subcategory, pk) for pk in subcategory_ids]
+    return JsonResponse([{'id': node.id, 'name': node.name} for node in subcategories], safe=False)
+
+
+def cash_flow_report(request):
+    """Итоги по периодам и категориям из дневных сводок, без агрегации таблицы транзакций"""
+    form = RollupReportForm(request.GET)
+    rollups = form.filter_queryset(DailyRollup.objects.all())
+    period = (form.cleaned_data.get('period') if form.is_valid() else None) or 'month'
+
+    rows = rollups.annotate(
+        period=REPORT_PERIODS[period]('date')
+    ).values(
+        'period', 'transaction_type__name', 'category__name'
+    ).annotate(
+        period_total=Sum('total'), period_count=Sum('count')
+    ).order_by('-period', 'transaction_type__name', 'category__name')
+
+    totals = rollups.values('transaction_type__name').annotate(
+        period_total=Sum('total'), period_count=Sum('count')
+    ).order_by('transaction_type__name')
+
+    context = {
+        'form': form,
+        'period': period,
+        'rows': rows,
+        'totals': totals,
+    }
+    return render(request, 'transactions/report.html', context)
+
+
+def _dictionary_tree_etag(request):
+    return get_tree().version
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=_dictionary_tree_etag)
+def dictionary_tree(request):
+    """
+    Всё дерево тип -> категория -> подкатегория одним компактным ответом.
+    ETag равен версии справочников, поэтому повторная проверка браузером
+    отвечает 304 без тела, пока справочники не изменились.
+    """
+    tree = get_tree()
+    return JsonResponse({
+        'version': tree.version,
+        'transaction_types': [[node.id, node.name] for node in tree.transaction_types],
+        'categories': [[node.id, node.name, node.transaction_type.id] for node in tree.categories],
+        'subcategories': [[node.id, node.name, node.category.id] for node in tree.subcategories],
+    })
+
+
+def metrics(request):
+    """Гистограммы времени и числа SQL по маршрутам в текстовом формате Prometheus"""
+    if not getattr(settings, 'TRANSACTIONS_INSTRUMENTATION', False):
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 def dictionaries(request):
+    tree = get_tree()
+    # Счётчики операций меняются с каждой записью и в снимок не входят: читаются
+    # из колонок usage_count по первичному ключу, без агрегации по операциям
+    def with_usage(model):
+        counts = dict(model.objects.values_list('id', 'usage_count'))
+        return [dict(node._asdict(), usage_count=counts.get(node.id, 0)) for node in tree.ordered(model)]
+
     context = {
-        'statuses': Status.objects.all(),
-        'transaction_types': TransactionType.objects.all(),
-        'categories': Category.objects.select_related('transaction_type').all(),
-        'subcategories': Subcategory.objects.select_related('category').all(),
+        'statuses': with_usage(Status),
+        'transaction_types': with_usage(TransactionType),
+        'categories': with_usage(Category),
+        'subcategories': with_usage(Subcategory),
     }
     return render(request, 'transactions/dictionaries.html', context)
 
 
+def _post_id(request, name):
+    try:
+        return int(request.POST.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def _delete_dictionary_entry(request, entry, replacement, deleted_message, in_use_message):
+    """
+    Удаление записи справочника: запись с операциями (по счётчику usage_count,
+    нулевой перепроверяется по таблицам операций) сразу не удаляется, а с
+    выбранной заменой операции сначала переносятся.
+    """
+    try:
+        moved = bulk.delete_dictionary_entry(entry, **(replacement or {}))
+    except (bulk.BulkActionError, ProtectedError, IntegrityError):
+        # IntegrityError - ссылка, которую не нашли ни счётчик, ни проверка (отложенный внешний ключ)
+        messages.error(request, in_use_message)
+    else:
+        if moved:
+            deleted_message += f' Перенесено операций: {moved}.'
+        messages.success(request, deleted_message)
+    return redirect('dictionaries')
+
+
 # Управление статусами
 def add_status(request):
     if request.method == 'POST':
@@ -137,12 +374,13 @@ def edit_status(request, pk):
 def delete_status(request, pk):
     status = get_object_or_404(Status, pk=pk)
     if request.method == 'POST':
-        name = status.name
-        try:
-            status.delete()
-            messages.success(request, f'Статус "{name}" успешно удален!')
-        except Exception as e:
-            messages.error(request, f'Невозможно удалить статус "{name}". Он используется в транзакциях.')
+        target = Status.objects.exclude(pk=status.pk).filter(pk=_post_id(request, 'target')).first()
+        return _delete_dictionary_entry(
+            request, status, target and {'status': target},
+            f'Статус "{status.name}" успешно удален!',
+            f'Невозможно удалить статус "{status.name}". Он используется в операциях ({status.usage_count}), '
+            'выберите, куда их перенести.',
+        )
     return redirect('dictionaries')
 
 
@@ -170,12 +408,14 @@ def edit_transaction_type(request, pk):
 def delete_transaction_type(request, pk):
     transaction_type = get_object_or_404(TransactionType, pk=pk)
     if request.method == 'POST':
-        name = transaction_type.name
-        try:
-            transaction_type.delete()
-            messages.success(request, f'Тип операции "{name}" успешно удален!')
-        except Exception as e:
-            messages.error(request, f'Невозможно удалить тип операции "{name}". Он используется в транзакциях.')
+        # Перенос на другой тип изменил бы знак операций в остатке: сначала переносятся категории
+        return _delete_dictionary_entry(
+            request, transaction_type, None,
+            f'Тип операции "{transaction_type.name}" успешно удален!',
+            f'Невозможно удалить тип операции "{transaction_type.name}". '
+            f'Он используется в операциях ({transaction_type.usage_count}), '
+            'сначала удалите его категории с переносом операций.',
+        )
     return redirect('dictionaries')
 
 
@@ -208,12 +448,16 @@ def edit_category(request, pk):
 def delete_category(request, pk):
     category = get_object_or_404(Category, pk=pk)
     if request.method == 'POST':
-        name = category.name
-        try:
-            category.delete()
-            messages.success(request, f'Категория "{name}" успешно удалена!')
-        except Exception as e:
-            messages.error(request, f'Невозможно удалить категорию "{name}". Она используется в транзакциях.')
+        # Замена - подкатегория другой категории того же типа (вместе со своей категорией)
+        target = Subcategory.objects.select_related('category').filter(
+            pk=_post_id(request, 'target'), category__transaction_type_id=category.transaction_type_id
+        ).exclude(category=category).first()
+        return _delete_dictionary_entry(
+            request, category, target and {'category': target.category, 'subcategory': target},
+            f'Категория "{category.name}" успешно удалена!',
+            f'Невозможно удалить категорию "{category.name}". Она используется в операциях ({category.usage_count}), '
+            'выберите, куда их перенести.',
+        )
     return redirect('dictionaries')
 
 
@@ -246,10 +490,14 @@ def edit_subcategory(request, pk):
 def delete_subcategory(request, pk):
     subcategory = get_object_or_404(Subcategory, pk=pk)
     if request.method == 'POST':
-        name = subcategory.name
-        try:
-            subcategory.delete()
-            messages.success(request, f'Подкатегория "{name}" успешно удалена!')
-        except Exception as e:
-            messages.error(request, f'Невозможно удалить подкатегорию "{name}". Она используется в транзакциях.')
+        target = Subcategory.objects.filter(
+            pk=_post_id(request, 'target'), category_id=subcategory.category_id
+        ).exclude(pk=subcategory.pk).first()
+        return _delete_dictionary_entry(
+            request, subcategory, target and {'subcategory': target},
+            f'Подкатегория "{subcategory.name}" успешно удалена!',
+            f'Невозможно удалить подкатегорию "{subcategory.name}". '
+            f'Она используется в операциях ({subcategory.usage_count}), '
+            'выберите, куда их перенести.',
+        )
     return redirect('dictionaries')